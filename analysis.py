@@ -0,0 +1,266 @@
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _biquad_response(b, a, freqs, rate):
+    z = np.exp(-2j * np.pi * freqs / rate)
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+def k_weighting(freqs, rate):
+    """ Power response of the ITU-R BS.1770 K-weighting filter (high shelf + high pass) at `freqs`. """
+    # stage 1: +4 dB high shelf around 1.5 kHz
+    A = 10 ** (4.0 / 40)
+    w0 = 2 * np.pi * 1500.0 / rate
+    alpha = np.sin(w0) / (2 * (1 / np.sqrt(2)))
+    cos = np.cos(w0)
+    shelf = _biquad_response(
+        (A * ((A + 1) + (A - 1) * cos + 2 * np.sqrt(A) * alpha),
+         -2 * A * ((A - 1) + (A + 1) * cos),
+         A * ((A + 1) + (A - 1) * cos - 2 * np.sqrt(A) * alpha)),
+        ((A + 1) - (A - 1) * cos + 2 * np.sqrt(A) * alpha,
+         2 * ((A - 1) - (A + 1) * cos),
+         (A + 1) - (A - 1) * cos - 2 * np.sqrt(A) * alpha),
+        freqs, rate)
+
+    # stage 2: high pass at 38 Hz
+    w0 = 2 * np.pi * 38.0 / rate
+    alpha = np.sin(w0) / (2 * 0.5)
+    cos = np.cos(w0)
+    high_pass = _biquad_response(
+        ((1 + cos) / 2, -(1 + cos), (1 + cos) / 2),
+        (1 + alpha, -2 * cos, 1 - alpha),
+        freqs, rate)
+
+    return np.abs(shelf * high_pass) ** 2
+
+
+def db(power):
+    return float(10 * np.log10(power)) if power > 0 else float('-inf')
+
+
+def loudness(samples, rate, block_seconds=0.4, overlap=0.75, batch=64):
+    """ Peak and RMS (dBFS) and integrated loudness (LUFS) of int16 `samples` shaped (frames, channels).
+
+    The K-weighting is applied to the spectrum of each gating block rather than filtering sample by sample,
+    which keeps everything vectorized; the gating follows BS.1770 (-70 LUFS absolute, -10 LU relative).
+    """
+    x = np.asarray(samples, dtype=np.float32) / 32768
+    if x.ndim == 1:
+        x = x.reshape(-1, 1)
+    frames = len(x)
+    if not frames:
+        return {'peak_db': float('-inf'), 'rms_db': float('-inf'), 'lufs': float('-inf')}
+
+    peak = float(np.abs(x).max())
+    rms = float(np.sqrt(np.mean(np.square(x, dtype=np.float64))))
+
+    size = min(frames, int(block_seconds * rate))
+    hop = max(1, int(size * (1 - overlap)))
+    starts = np.arange(0, frames - size + 1, hop)
+    weights = k_weighting(np.fft.rfftfreq(size, 1 / rate), rate)
+
+    # mean square of each K-weighted block, summed over the channels (Parseval)
+    powers = []
+    for i in range(0, len(starts), batch):
+        idx = starts[i:i + batch, None] + np.arange(size)
+        spectrum = np.fft.rfft(x[idx], axis=1)  # (blocks, bins, channels)
+        energy = (np.abs(spectrum) ** 2 * weights[None, :, None])
+        # the one-sided spectrum counts every bin but DC (and Nyquist for even sizes) twice
+        energy[:, 1:(size + 1) // 2] *= 2
+        powers.append(energy.sum(axis=(1, 2)) / (size * size))
+    powers = np.concatenate(powers)
+
+    result = {'peak_db': db(peak * peak), 'rms_db': db(rms * rms), 'lufs': float('-inf')}
+
+    block_lufs = -0.691 + 10 * np.log10(np.maximum(powers, 1e-20))
+    gated = powers[block_lufs > -70]
+    if len(gated):
+        relative = -0.691 + db(gated.mean()) - 10
+        result['lufs'] = -0.691 + db(powers[(block_lufs > -70) & (block_lufs > relative)].mean())
+    return result
+
+
+def apply_gain(samples, gain):
+    """ A copy of int16 `samples` multiplied by `gain`, clipped to the int16 range. """
+    return np.clip(np.asarray(samples, dtype=np.float32) * gain, -32768, 32767).astype(np.int16)
+
+
+def leading_silence(samples, rate, threshold_db=-50.0):
+    """ Seconds before the first sample louder than `threshold_db` dBFS (the whole length if there is none). """
+    x = np.asarray(samples)
+    if x.ndim == 1:
+        x = x.reshape(-1, 1)
+    threshold = 32768 * 10 ** (threshold_db / 20)
+
+    # look at the start in growing chunks, the first audible sample is usually near the beginning
+    start, chunk = 0, rate // 10 or 1
+    while start < len(x):
+        audible = np.flatnonzero((np.abs(x[start:start + chunk].astype(np.int32)) > threshold).any(axis=1))
+        if len(audible):
+            return (start + int(audible[0])) / rate
+        start += chunk
+        chunk *= 2
+    return len(x) / rate
+
+
+class LibraryAnalyzer:
+    """ Per sfx measurements, cached in a JSON file and only recomputed for files that are new or changed.
+
+    `loader(path)` returns (samples, rate) with samples an int16 array shaped (frames, channels). Files are
+    analyzed on a thread pool (NumPy's FFTs release the GIL) and looking up a result is a dict access.
+    With a `trim_threshold_db` the leading silence of every file is measured too, and `on_update(files)` is
+    called after every batch of files that got new results.
+    """
+
+    def __init__(self, sfx_dir, cache_path, loader, normalize=True, target_lufs=-16.0, max_gain_db=12.0,
+                 ceiling_db=-1.0, trim_threshold_db=None, workers=None, on_update=None):
+        if np is None:
+            raise RuntimeError('Analyzing the library needs numpy')
+
+        self.sfx_dir = sfx_dir
+        self.cache_path = cache_path
+        self.loader = loader
+        self.normalize = normalize
+        self.target_lufs = target_lufs
+        self.max_gain_db = max_gain_db
+        self.ceiling_db = ceiling_db
+        self.trim_threshold_db = trim_threshold_db
+        self.on_update = on_update
+
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count(), thread_name_prefix='Analyzer')
+        self._lock = threading.Lock()
+        self._results = self._read_cache()
+        self._gains = {file: self._gain(result) for file, result in self._results.items()}
+        self._trims = {file: self._trim(result) for file, result in self._results.items()}
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self):
+        with self._lock:
+            data = json.dumps(self._results)
+
+        tmp = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            logging.warning(f'Could not write the analysis cache: {e}')
+
+    def _stamp(self, file):
+        try:
+            st = os.stat(os.path.join(self.sfx_dir, file))
+        except OSError:
+            return None
+        return [st.st_mtime_ns, st.st_size]
+
+    def _gain(self, result):
+        """ Linear gain that brings the file to the target loudness without pushing its peak past the ceiling. """
+        lufs = result.get('lufs')
+        if not self.normalize or lufs is None or lufs == float('-inf'):
+            return 1.0
+        gain_db = min(self.target_lufs - lufs, self.max_gain_db, self.ceiling_db - result['peak_db'])
+        return 10 ** (gain_db / 20)
+
+    def _trim(self, result):
+        if self.trim_threshold_db is None or result.get('trim_threshold_db') != self.trim_threshold_db:
+            return 0.0
+        # a file that is silent all the way through is left alone
+        lead = result['lead_seconds']
+        return lead if lead < result['seconds'] else 0.0
+
+    def gain(self, file):
+        return self._gains.get(file, 1.0)
+
+    def trim_seconds(self, file):
+        """ Where playback of `file` should start to skip its leading silence. """
+        return self._trims.get(file, 0.0)
+
+    def trim_report(self):
+        """ (file, milliseconds of silence skipped) for every trimmed file, most first. """
+        return sorted(((file, round(trim * 1000, 1)) for file, trim in self._trims.items() if trim),
+                      key=lambda entry: entry[1], reverse=True)
+
+    def result(self, file):
+        return self._results.get(file)
+
+    def _analyze(self, file, stamp):
+        samples, rate = self.loader(os.path.join(self.sfx_dir, file))
+        result = loudness(samples, rate)
+        result['seconds'] = len(samples) / rate
+        if self.trim_threshold_db is not None:
+            result['lead_seconds'] = leading_silence(samples, rate, self.trim_threshold_db)
+            result['trim_threshold_db'] = self.trim_threshold_db
+        result['stamp'] = stamp
+        return file, result
+
+    def update(self, files):
+        """ Analyzes the files among `files` that have no up to date result, in the background. """
+        todo = []
+        for file in files:
+            stamp = self._stamp(file)
+            result = self._results.get(file)
+            if stamp is not None and (result is None or result.get('stamp') != stamp or
+                                      result.get('trim_threshold_db') != self.trim_threshold_db):
+                todo.append((file, stamp))
+        if not todo:
+            return None
+
+        def run():
+            futures = [self._pool.submit(self._analyze, file, stamp) for file, stamp in todo]
+            updated = []
+            for future in futures:
+                try:
+                    file, result = future.result()
+                except Exception as e:
+                    logging.warning(f'Could not analyze a sound: {e}')
+                    continue
+
+                with self._lock:
+                    self._results[file] = result
+                self._gains[file] = gain = self._gain(result)
+                self._trims[file] = trim = self._trim(result)
+                updated.append(file)
+                logging.debug(f'{file}: {result["lufs"]:.1f} LUFS, peak {result["peak_db"]:.1f} dBFS, '
+                              f'normalization gain {20 * np.log10(gain):+.1f} dB, {trim * 1000:.0f} ms leading silence')
+            self._write_cache()
+
+            if updated and self.on_update is not None:
+                self.on_update(updated)
+
+        thread = threading.Thread(target=run, name='AnalyzerBatch', daemon=True)
+        thread.start()
+        return thread
+
+    def rename(self, old, new):
+        # the contents didn't change, the result can move with the file
+        with self._lock:
+            if old in self._results:
+                self._results[new] = self._results.pop(old)
+        if old in self._gains:
+            self._gains[new] = self._gains.pop(old)
+        if old in self._trims:
+            self._trims[new] = self._trims.pop(old)
+
+    def forget(self, file):
+        with self._lock:
+            self._results.pop(file, None)
+        self._gains.pop(file, None)
+        self._trims.pop(file, None)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+from collections import deque
+
+
+class AudioDispatcher:
+    """ Runs mixer commands on one long-lived worker thread, fed by a bounded queue.
+
+    When the queue is full `overflow` decides what happens to a new command:
+    'drop_oldest' discards the longest waiting command, 'drop_newest' discards the new one
+    and 'block' makes the caller wait for room, or drops the command if the dispatcher is stopped meanwhile.
+
+    Given a `metrics` object (instrumentation.Metrics) it records how long commands waited in the queue
+    and how long each kind of command ran.
+    """
+
+    POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, maxsize=64, overflow='drop_oldest', metrics=None):
+        if overflow not in self.POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow!r}, expected one of {self.POLICIES}')
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.metrics = metrics
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        self.submitted = 0
+        self.executed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+
+        self._thread = threading.Thread(target=self._run, name='AudioDispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        """ Queues `func(*args)`, returns False if it was dropped instead. """
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('Dispatcher has been stopped')
+
+            self.submitted += 1
+
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == 'drop_oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                elif self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                else:
+                    while len(self._queue) >= self.maxsize and not self._stopped:
+                        self._cond.wait()
+                    # stopped while waiting, the worker may already be gone and would never run it
+                    if self._stopped:
+                        self.dropped += 1
+                        return False
+
+            self._queue.append((func, args, time.perf_counter()))
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify_all()
+
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+
+                func, args, queued = self._queue.popleft()
+                # wake producers blocked on a full queue
+                self._cond.notify_all()
+
+            start = time.perf_counter()
+            try:
+                func(*args)
+            except Exception:
+                self.errors += 1
+                logging.exception(f'Audio command {func.__name__} failed')
+            self.executed += 1
+
+            if self.metrics is not None:
+                self.metrics.record('dispatch.wait', start - queued)
+                self.metrics.since(f'dispatch.{func.__name__}', start)
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def stop(self, timeout=None):
+        """ Runs the commands that are already queued, then stops the worker. """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'submitted': self.submitted,
+            'executed': self.executed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
@@ -0,0 +1,126 @@
+""" Compares the NumPy software mixer with pygame channels at 1, 16 and 128 simultaneous voices.
+
+For both backends it measures the global operations the soundboard does (stop, pause, unpause and volume)
+and the CPU time spent mixing one second of audio. pygame is run on SDL's dummy audio driver, so no sound
+device is needed; the pygame half is skipped if pygame isn't installed.
+
+    python benchmarks/bench_mixer.py [--voices 1 16 128] [--channels-amt 256] [--seconds 1]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from software_mixer import SoftwareMixer
+
+RATE = 44100
+CHANNELS = 2
+BLOCK = 512
+
+
+def tone(seconds, freq=440.0):
+    t = np.arange(int(seconds * RATE)) / RATE
+    wave = (np.sin(2 * np.pi * freq * t) * 8000).astype(np.int16)
+    return np.repeat(wave.reshape(-1, 1), CHANNELS, axis=1)
+
+
+def timed(func, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_numpy(voices, seconds):
+    mixer = SoftwareMixer(RATE, CHANNELS, BLOCK)
+    samples = tone(2)
+    for _ in range(voices):
+        mixer.play(samples, 0.5, loops=-1)
+
+    blocks = int(seconds * RATE / BLOCK)
+    start = time.process_time()
+    for _ in range(blocks):
+        mixer.mix()
+    mix_cpu = (time.process_time() - start) / seconds
+
+    return {
+        'pause_us': timed(mixer.pause) * 1e6,
+        'unpause_us': timed(mixer.unpause) * 1e6,
+        'volume_us': timed(lambda: mixer.set_gain(0.4)) * 1e6,
+        'mix_cpu_pct': mix_cpu * 100,
+        'stop_us': timed(mixer.stop, repeat=1) * 1e6,
+    }
+
+
+def bench_pygame(voices, seconds, channel_amount):
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+
+    pygame.mixer.init(RATE, -16, CHANNELS, BLOCK)
+    pygame.mixer.set_num_channels(channel_amount)
+    sound = pygame.mixer.Sound(buffer=tone(2).tobytes())
+
+    # the same loops the soundboard runs over every channel
+    def for_each_channel(method, *args):
+        def run():
+            for i in range(0, (channel_amount + 1)):
+                try:
+                    getattr(pygame.mixer.Channel(i), method)(*args)
+                except IndexError:
+                    continue
+        return run
+
+    idle_start = time.process_time()
+    time.sleep(seconds)
+    idle_cpu = time.process_time() - idle_start
+
+    for _ in range(voices):
+        pygame.mixer.find_channel().play(sound, loops=-1)
+
+    start = time.process_time()
+    time.sleep(seconds)
+    mix_cpu = max(0.0, time.process_time() - start - idle_cpu) / seconds
+
+    result = {
+        'pause_us': timed(for_each_channel('pause')) * 1e6,
+        'unpause_us': timed(for_each_channel('unpause')) * 1e6,
+        'volume_us': timed(for_each_channel('set_volume', 0.4)) * 1e6,
+        'mix_cpu_pct': mix_cpu * 100,
+        'stop_us': timed(for_each_channel('stop'), repeat=1) * 1e6,
+    }
+    pygame.mixer.quit()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--voices', type=int, nargs='+', default=[1, 16, 128])
+    parser.add_argument('--channels-amt', type=int, default=256, help='pygame channels, like CHANNELS_AMT')
+    parser.add_argument('--seconds', type=float, default=1.0, help='audio mixed per measurement')
+    args = parser.parse_args()
+
+    try:
+        import pygame  # noqa: F401
+    except ImportError:
+        print('pygame is not installed, only benchmarking the numpy mixer.\n')
+        backends = [('numpy', bench_numpy)]
+    else:
+        backends = [('numpy', bench_numpy),
+                    ('pygame', lambda voices, seconds: bench_pygame(voices, seconds, args.channels_amt))]
+
+    columns = ('stop_us', 'pause_us', 'unpause_us', 'volume_us', 'mix_cpu_pct')
+    print(f'{"backend":<8} {"voices":>6} ' + ' '.join(f'{c:>12}' for c in columns))
+    for voices in args.voices:
+        for name, bench in backends:
+            result = bench(voices, args.seconds)
+            print(f'{name:<8} {voices:>6} ' + ' '.join(f'{result[c]:>12.1f}' for c in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+""" Benchmarks the soundboard's hot paths on synthetic sfx libraries and writes the results as JSON.
+
+For each library size it times scanning the library, get_sfx(), building the SoundGrid, registering the
+hotkeys with keybind_listener() and rebinding them, and key press to playback with the sound not yet decoded
+(cold) and already cached (warm). The presses are injected into SystemHotkey.data_queue by a fake hotkey
+backend, so from the queue on it's the soundboard's own code path. Recorder.save() throughput is measured once.
+
+It runs headless: pygame uses SDL's dummy audio driver, the recorder a fake PyAudio and the hotkeys no display.
+Only the SoundGrid needs an X display (e.g. `xvfb-run`), it's skipped without one. Compare two runs with --compare.
+
+    python benchmarks/bench_suite.py [--sizes 10 1000 10000] [--output results.json] [--compare baseline.json]
+"""
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from array import array
+from collections import defaultdict
+from importlib.machinery import SourceFileLoader
+from importlib.util import spec_from_loader, module_from_spec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+# the JSON may go to stdout
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import tkinter as tk
+
+from library import SoundLibrary
+from instrumentation import Metrics
+
+RATE = 44100
+CHANNELS = 2
+
+
+class RawMetrics(Metrics):
+    """ Metrics that also keep every sample, the histograms are too coarse to compare runs with. """
+
+    def __init__(self):
+        super().__init__()
+        self.samples = defaultdict(list)
+        self.played = threading.Semaphore(0)
+
+    def record(self, stage, seconds, key=None):
+        super().record(stage, seconds, key)
+        self.samples[stage].append(seconds)
+        if stage == 'press_to_play':
+            self.played.release()
+
+
+class FakeAudio:
+    """ The part of PyAudio's interface the Recorder uses before it starts a stream. """
+
+    def __init__(self, device_name):
+        self.device_name = device_name
+
+    def get_sample_size(self, fmt):
+        return 2
+
+    def get_device_count(self):
+        return 1
+
+    def get_device_info_by_index(self, i):
+        return {'index': i, 'name': self.device_name, 'hostApi': 0, 'maxInputChannels': CHANNELS}
+
+    def terminate(self):
+        pass
+
+
+def summarize(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 4),
+        **{f'p{p}_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 4)
+           for p in (50, 90, 99)},
+        'max_ms': round(ordered[-1] * 1000, 4),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 4),
+    }
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def tone(seconds, freq=440.0):
+    import math
+
+    frames = int(seconds * RATE)
+    # a bit of silence first, like most real sfx
+    lead = frames // 10
+    return array('h', [0 if i < lead else int(8000 * math.sin(2 * math.pi * freq * i / RATE))
+                       for i in range(frames) for _ in range(CHANNELS)]).tobytes()
+
+
+def make_library(directory, count, seconds):
+    """ `count` wav files; they are hard links to one file so a big library costs no disk space. """
+    os.makedirs(directory)
+    template = os.path.join(directory, 'sound_00000.wav')
+    wf = wave.open(template, 'wb')
+    wf.setnchannels(CHANNELS)
+    wf.setsampwidth(2)
+    wf.setframerate(RATE)
+    wf.writeframes(tone(seconds))
+    wf.close()
+
+    for i in range(1, count):
+        path = os.path.join(directory, f'sound_{i:05d}.wav')
+        try:
+            os.link(template, path)
+        except OSError:
+            shutil.copyfile(template, path)
+    return directory
+
+
+def load_soundboard():
+    """ soundboard.pyw as a module, without running its __main__ block. """
+    loader = SourceFileLoader('soundboard', os.path.join(ROOT, 'soundboard.pyw'))
+    module = module_from_spec(spec_from_loader('soundboard', loader))
+    loader.exec_module(module)
+    return module
+
+
+def setup_soundboard(sb, args):
+    """ The globals the __main__ block and init() would set, with the fake hotkey backend. """
+    from fake_hotkey import FakeHotkey
+
+    sb.bindable_chars = '567890qwertyuiopasdfghjklzxcvbnm'
+    sb.sound_banks = args.banks
+    sb.replay_keys = {}
+    sb.active_bank = 0
+    sb.debug = False
+    sb.hotkey_measure = False
+    sb.analyzer = None
+    sb.soft_mixer = None
+    sb.music_gain = 1.0
+    sb.state = sb.PlaybackState()
+    sb.root = None
+    sb.sound_grid = None
+    sb.SystemHotkey = lambda measure=False: FakeHotkey(measure, grab_seconds=args.grab_ms / 1000)
+
+
+def bench_library(sb, library, args):
+    results = {}
+
+    def scan():
+        SoundLibrary(library.sfx_dir, library.slots).scan()
+    results['library_scan'] = summarize(timed(scan, args.repeat))
+
+    sb.library = library
+    results['get_sfx'] = summarize(timed(sb.get_sfx, args.repeat * 5))
+    return results
+
+
+def bench_sound_grid(sb, root, args):
+    if root is None:
+        return {'skipped': 'no display, run it under xvfb-run to include the SoundGrid'}
+
+    sb.root = root
+    sb.sound_error_text = tk.StringVar(root, value='No sound effects!')
+
+    def build():
+        grid = sb.SoundGrid(root)
+        grid.grid(row=0, column=0)
+        root.update_idletasks()
+        grid.destroy()
+    return summarize(timed(build, args.repeat))
+
+
+def bench_hotkeys(sb, args):
+    results = {}
+    hks = []
+
+    def register():
+        hks.append(sb.keybind_listener())
+    results['keybind_listener'] = summarize(timed(register, args.repeat))
+    results['keybinds'] = len(hks[-1].keybinds)
+
+    # what on_library_change does, with nothing changed on disk
+    hk = hks[-1]
+
+    def rebind():
+        banks = sb.get_banks()
+        hk.rebind(sb.get_bindings(banks), atomic=False)
+        sb.define_banks(hk, banks)
+    results['rebind'] = summarize(timed(rebind, args.repeat))
+
+    # the callback loop threads can't be stopped, at least let go of the tables
+    for hk in hks:
+        hk.keybinds = {}
+        hk._tables = {None: {}}
+        hk._dispatch = {}
+    return results
+
+
+def bench_play(sb, args):
+    import pygame
+    from sound_cache import SoundCache
+    from audio_dispatcher import AudioDispatcher
+    from voices import VoiceManager, ChannelBackend
+    from fake_hotkey import FakeHotkey
+
+    sb.voices = VoiceManager(ChannelBackend(), max_voices=args.channels, per_sound=4)
+    sb.metrics = metrics = RawMetrics()
+    sb.dispatcher = dispatcher = AudioDispatcher(64, 'block', metrics)
+
+    hk = FakeHotkey()
+    sb.hk = hk
+    banks = sb.get_banks()
+    hk.register_many(sb.get_bindings(banks), atomic=False)
+    keys = sorted(banks.get(0, {}))[:args.presses]
+
+    passes = {'cold': defaultdict(list), 'warm': defaultdict(list)}
+    try:
+        for _ in range(args.rounds):
+            sb.sound_cache = SoundCache(256 * 1024 * 1024, loader=lambda path: sb.load_sound(pygame.mixer.Sound, path))
+            for name in ('cold', 'warm'):
+                metrics.samples.clear()
+                for key in keys:
+                    hk.press(['alt', sb.bindable_chars[key]])
+                    # one press at a time, so this is latency and not the queue filling up
+                    if not metrics.played.acquire(timeout=5):
+                        raise RuntimeError(f'alt+{sb.bindable_chars[key]} was never played')
+                for stage, samples in metrics.samples.items():
+                    passes[name][stage] += samples
+                sb.stop()
+    finally:
+        dispatcher.stop(timeout=1)
+
+    return {name: {stage: summarize(samples) for stage, samples in sorted(stages.items())}
+            for name, stages in passes.items()}
+
+
+def bench_recorder(args, work_dir):
+    from recorder import Recorder
+
+    recorder = Recorder(duration=args.record_seconds, rate=RATE, channels=CHANNELS, device_name='Fake',
+                        audio=FakeAudio('Fake'))
+    recorder.ring.write(os.urandom(recorder.ring.capacity))
+    path = os.path.join(work_dir, 'recording.wav')
+    nbytes = int(args.record_seconds * RATE) * CHANNELS * 2
+
+    samples = timed(lambda: recorder.save(path), args.repeat)
+    in_memory = timed(lambda: recorder.snapshot_wav(), args.repeat)
+    return {
+        'bytes': nbytes,
+        'save': summarize(samples),
+        'save_mb_per_s': round(nbytes / min(samples) / 1e6, 1),
+        'snapshot_wav': summarize(in_memory),
+        'snapshot_wav_mb_per_s': round(nbytes / min(in_memory) / 1e6, 1),
+    }
+
+
+def run_section(results, name, func, *args):
+    print(f'{name}...', file=sys.stderr)
+    try:
+        results[name] = func(*args)
+    except ImportError as e:
+        results[name] = {'skipped': f'{e}'}
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import pygame
+        pygame_version = pygame.version.ver
+    except ImportError:
+        pygame_version = None
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'pygame': pygame_version,
+        'audio_driver': os.environ['SDL_AUDIODRIVER'],
+        'args': vars(args),
+    }
+
+
+def flatten(results, prefix=''):
+    """ {'a/b/p50_ms': value} for every median in the results, for comparing runs. """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}/'))
+        elif key == 'p50_ms' or key.endswith('_per_s'):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(baseline, results, file):
+    old, new = flatten(baseline['results']), flatten(results)
+    print(f'{"benchmark":<60} {"before":>12} {"after":>12} {"change":>8}', file=file)
+    for key in sorted(new):
+        if old.get(key) and new[key] is not None:
+            print(f'{key:<60} {old[key]:>12.4f} {new[key]:>12.4f} {(new[key] / old[key] - 1) * 100:>+7.1f}%', file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000], help='sfx files per library')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every measurement')
+    parser.add_argument('--banks', type=int, default=4, help='like SOUND_BANKS')
+    parser.add_argument('--presses', type=int, default=32, help='sounds pressed per play pass')
+    parser.add_argument('--rounds', type=int, default=3, help='cold and warm play passes, each with an empty cache')
+    parser.add_argument('--channels', type=int, default=64, help='pygame channels and voices')
+    parser.add_argument('--sfx-seconds', type=float, default=0.5, help='length of the synthetic sfx')
+    parser.add_argument('--grab-ms', type=float, default=0.0, help='simulated X round trip per batch of grabs')
+    parser.add_argument('--record-seconds', type=float, default=10, help='recording length saved by Recorder.save')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--compare', help='JSON of an earlier run to print the change of every median against')
+    args = parser.parse_args()
+
+    # the library warns about every sfx past the hotkey slots, on every scan
+    logging.basicConfig(level=logging.ERROR)
+
+    work_dir = tempfile.mkdtemp(prefix='soundboard-bench-')
+    results = {}
+    try:
+        import pygame  # noqa: F401
+        sb = load_soundboard()
+    except ImportError as e:
+        sb = None
+        results['soundboard'] = {'skipped': f'could not import soundboard.pyw: {e}'}
+    else:
+        setup_soundboard(sb, args)
+        pygame.mixer.quit()
+        pygame.mixer.init(RATE, -16, CHANNELS, 512)
+        pygame.mixer.set_num_channels(args.channels)
+
+    try:
+        root = tk.Tk()
+        root.withdraw()
+    except tk.TclError:
+        root = None
+
+    try:
+        for size in args.sizes:
+            sizes = results.setdefault('libraries', {})
+            sfx_dir = make_library(os.path.join(work_dir, f'sfx{size}'), size, args.sfx_seconds)
+            library = SoundLibrary(sfx_dir, 32 * args.banks)
+            library.scan()
+
+            section = sizes[str(size)] = {}
+            if sb is None:
+                run_section(section, 'library', lambda: {'library_scan': summarize(timed(
+                    lambda: SoundLibrary(sfx_dir, library.slots).scan(), args.repeat))})
+                continue
+
+            sb.sfx_dir = sfx_dir
+            run_section(section, 'library', bench_library, sb, library, args)
+            run_section(section, 'sound_grid', bench_sound_grid, sb, root, args)
+            run_section(section, 'hotkeys', bench_hotkeys, sb, args)
+            run_section(section, 'play', bench_play, sb, args)
+
+        run_section(results, 'recorder', bench_recorder, args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if root is not None:
+            root.destroy()
+
+    output = {'meta': metadata(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            # stdout may be the JSON
+            compare(json.load(f), results, sys.stdout if args.output else sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
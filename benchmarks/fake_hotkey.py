@@ -0,0 +1,93 @@
+""" A SystemHotkey with no OS behind it, for benchmarks on machines without a display or keyboard.
+
+Grabs always succeed (after `grab_seconds`, to model the round trip to the X server) and key presses are
+injected with press(), which puts an event on `data_queue` the same way the xcb, Xlib and Windows threads do.
+`source` picks whose events and modifier masks are faked, 'x' or 'nt'. Everything after the queue (the callback
+loop, the dispatch table, layers) is the real SystemHotkey code.
+"""
+import _thread as thread
+import time
+
+from system_hotkey import SystemHotkey
+
+# the modifier masks of X11 and of RegisterHotKey, so dispatch keys look like the real backends' ones
+MODIFIERS = {
+    'x': {'control': 1 << 2, 'shift': 1 << 0, 'alt': 1 << 3, 'super': 1 << 6},
+    'nt': {'control': 0x2, 'shift': 0x4, 'alt': 0x1, 'super': 0x8},
+}
+TRIVIAL_MODS = {
+    'x': (0, 1 << 1, 1 << 4, 1 << 1 | 1 << 4),
+    'nt': (0,),
+}
+
+
+class FakeEvent:
+    """ Has the fields of both an X KeyPressEvent (state, detail) and a WM_HOTKEY message (lParam). """
+
+    __slots__ = ('state', 'detail', 'lParam', 'event_type', 'enqueue_time', 'seq')
+
+    def __init__(self, state, detail, seq=None):
+        self.state = state
+        self.detail = detail
+        self.lParam = detail << 16 | state
+        self.event_type = 'keypress'
+        self.seq = seq
+
+
+class FakeHotkey(SystemHotkey):
+    def __init__(self, measure=False, grab_seconds=0.0, callback_loop=True, source='x'):
+        self._init_state('callback', 0, False, True, measure)
+        # SystemHotkey keeps these on the class, a benchmark makes many instances that mustn't share them
+        self.keybinds = {}
+        self.hk_ref = {}
+
+        self.grab_seconds = grab_seconds
+        self.grabs = 0
+        self.modders = MODIFIERS[source]
+        self.trivial_mods = TRIVIAL_MODS[source]
+        if source == 'nt':
+            self._event_key = self._nt_event_key
+        self._mod_mask = self.or_modifiers_together(self.modders.values())
+        # keycodes are handed out as keys are first seen, 8 is the lowest keycode X uses
+        self._keycodes = {}
+        self._keysyms = {}
+
+        if callback_loop:
+            thread.start_new_thread(self._callback_loop, (), )
+
+    def _get_keycode(self, key):
+        key = key.lower()
+        if key not in self._keycodes:
+            keycode = len(self._keycodes) + 8
+            self._keycodes[key] = keycode
+            self._keysyms[keycode] = key
+        return self._keycodes[key]
+
+    def _get_keysym(self, keycode, i=0):
+        return self._keysyms.get(keycode)
+
+    def _the_grab(self, keycode, masks):
+        self._grab_many([(None, keycode, masks)])
+
+    def _grab_many(self, pending):
+        if pending and self.grab_seconds:
+            time.sleep(self.grab_seconds)
+        self.grabs += len(pending) * len(self.trivial_mods)
+        return {}
+
+    def _ungrab_many(self, pending):
+        if pending and self.grab_seconds:
+            time.sleep(self.grab_seconds)
+
+    def _event_key(self, e):
+        return (e.state & self._mod_mask) << 16 | e.detail
+
+    def event(self, hotkey, seq=None):
+        """ The event a press of `hotkey` (e.g. ['alt', 'q']) would produce. """
+        keycode, masks = self.parse_hotkeylist(self.order_hotkey(list(hotkey)))
+        return FakeEvent(masks, keycode, seq)
+
+    def press(self, hotkey, seq=None):
+        e = self.event(hotkey, seq)
+        self._put_event(e)
+        return e
@@ -0,0 +1,208 @@
+""" Floods the hotkey dispatch pipeline the way a macro pad or automation tool would and checks it keeps up.
+
+The generator puts fake X or Windows key press events on SystemHotkey.data_queue at a steady `--rate`,
+plus `--burst` events back to back every `--burst-every` seconds. From the queue on everything is the real
+SystemHotkey: the callback loop, the integer dispatch table and, with `--layer-switches`, layers being
+activated while events are in flight. Every event carries a sequence number, so the callbacks can tell
+lost and duplicated events apart from slow ones; the queue backlog is sampled throughout.
+
+It exits with status 1 when events were lost or duplicated or a threshold was exceeded, so it can run in CI.
+No display or keyboard is needed.
+
+    python benchmarks/stress_hotkeys.py [--rate 500] [--seconds 5] [--burst 200 --burst-every 1]
+                                        [--source x|nt] [--max-p99-ms 5] [--max-backlog 1000] [--output stress.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from system_hotkey import percentiles
+from fake_hotkey import FakeHotkey, FakeEvent
+
+KEYS = '567890qwertyuiopasdfghjklzxcvbnm'
+
+
+def spin(seconds):
+    """ Busy waits, a stand-in for the work a soundboard callback does while holding the callback thread. """
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class Collector:
+    def __init__(self, callback_seconds):
+        self.callback_seconds = callback_seconds
+        self.latencies = []
+        self.seen = Counter()
+
+    def callback(self, e):
+        # list.append and a Counter update are safe enough here, there is only the one callback thread
+        self.latencies.append(time.perf_counter() - e.enqueue_time)
+        self.seen[e.seq] += 1
+        if self.callback_seconds:
+            spin(self.callback_seconds)
+
+
+def generate(hk, templates, rate, seconds, burst, burst_every):
+    """ Injects events for `seconds`, returns how many were sent. """
+    seq = 0
+    start = time.perf_counter()
+    next_burst = start + burst_every if burst else float('inf')
+    interval = 1 / rate if rate else float('inf')
+    due = start if rate else float('inf')
+
+    while True:
+        now = time.perf_counter()
+        if now - start >= seconds:
+            return seq
+
+        if now >= next_burst:
+            for _ in range(burst):
+                state, detail = templates[seq % len(templates)]
+                hk._put_event(FakeEvent(state, detail, seq))
+                seq += 1
+            next_burst += burst_every
+
+        if now >= due:
+            state, detail = templates[seq % len(templates)]
+            hk._put_event(FakeEvent(state, detail, seq))
+            seq += 1
+            due += interval
+            # don't try to catch up on more than a second after a stall, that is a burst of its own
+            due = max(due, now - 1)
+        else:
+            time.sleep(min(due, next_burst, start + seconds) - now)
+
+
+def sample_backlog(hk, interval, stop, samples):
+    start = time.perf_counter()
+    while not stop.wait(interval):
+        samples.append((round(time.perf_counter() - start, 4), hk.data_queue.qsize()))
+
+
+def switch_layers(hk, per_second, stop):
+    layers = [None, 'stress']
+    i = 0
+    while not stop.wait(1 / per_second):
+        i += 1
+        hk.activate_layer(layers[i % 2])
+
+
+def run(args):
+    collector = Collector(args.callback_us / 1e6)
+    hk = FakeHotkey(source=args.source)
+
+    keys = KEYS[:args.keys]
+    bindings = [(['alt', key], collector.callback) for key in keys]
+    result = hk.register_many(bindings)
+    # a layer binding the same keys again, switching to it must not lose or repeat presses
+    hk.define_layer('stress', bindings)
+    templates = [(e.state, e.detail) for e in (hk.event(hotkey) for hotkey, _ in bindings)]
+
+    stop = threading.Event()
+    backlog = []
+    threads = [threading.Thread(target=sample_backlog, args=(hk, args.sample_ms / 1000, stop, backlog), daemon=True)]
+    if args.layer_switches:
+        threads.append(threading.Thread(target=switch_layers, args=(hk, args.layer_switches, stop), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    sent = generate(hk, templates, args.rate, args.seconds, args.burst, args.burst_every)
+    sent_seconds = time.perf_counter() - start
+
+    # let the callback loop drain what is still queued
+    deadline = time.perf_counter() + args.drain_seconds
+    while len(collector.latencies) < sent and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    drain_seconds = time.perf_counter() - start - sent_seconds
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    seen = collector.seen
+    lost = sum(1 for seq in range(sent) if seq not in seen)
+    duplicated = sum(count - 1 for count in seen.values() if count > 1)
+    points = percentiles(collector.latencies, (50, 90, 99, 100))
+
+    return {
+        'source': args.source,
+        'keys': len(keys),
+        'register_ms': round(result.seconds * 1000, 3),
+        'sent': sent,
+        'received': len(collector.latencies),
+        'lost': lost,
+        'duplicated': duplicated,
+        'offered_rate': round(sent / sent_seconds, 1),
+        'throughput': round(len(collector.latencies) / (sent_seconds + drain_seconds), 1),
+        'drain_ms': round(drain_seconds * 1000, 1),
+        'latency_ms': {f'p{p}': None if value is None else round(value * 1000, 4) for p, value in points.items()},
+        'backlog_max': max((depth for _, depth in backlog), default=0),
+        'backlog_final': hk.data_queue.qsize(),
+        # (seconds since start, events waiting in data_queue)
+        'backlog': backlog,
+    }
+
+
+def check(report, args):
+    failures = []
+    if report['lost']:
+        failures.append(f'{report["lost"]} events were lost')
+    if report['duplicated']:
+        failures.append(f'{report["duplicated"]} events were delivered more than once')
+
+    limits = (('p50', args.max_p50_ms), ('p99', args.max_p99_ms), ('p100', args.max_latency_ms))
+    for point, limit in limits:
+        value = report['latency_ms'][point]
+        if limit is not None and value is not None and value > limit:
+            failures.append(f'{point} latency {value} ms is over {limit} ms')
+
+    if args.max_backlog is not None and report['backlog_max'] > args.max_backlog:
+        failures.append(f'the queue backlog reached {report["backlog_max"]} events, over {args.max_backlog}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=500, help='steady events per second')
+    parser.add_argument('--seconds', type=float, default=5, help='how long to generate events')
+    parser.add_argument('--burst', type=int, default=200, help='events sent back to back in every burst (0: none)')
+    parser.add_argument('--burst-every', type=float, default=1.0, help='seconds between bursts')
+    parser.add_argument('--keys', type=int, default=len(KEYS), choices=range(1, len(KEYS) + 1), metavar='1-32',
+                        help='distinct hotkeys the events cycle through')
+    parser.add_argument('--source', choices=('x', 'nt'), default='x', help='whose key press events are faked')
+    parser.add_argument('--callback-us', type=float, default=10, help='work done in every callback')
+    parser.add_argument('--layer-switches', type=float, default=0, help='layer activations per second')
+    parser.add_argument('--sample-ms', type=float, default=10, help='how often the backlog is sampled')
+    parser.add_argument('--drain-seconds', type=float, default=10, help='how long to wait for the queue to drain')
+    parser.add_argument('--max-p50-ms', type=float, help='fail above this median latency')
+    parser.add_argument('--max-p99-ms', type=float, help='fail above this 99th percentile latency')
+    parser.add_argument('--max-latency-ms', type=float, help='fail above this worst latency')
+    parser.add_argument('--max-backlog', type=int, help='fail if more events than this were ever waiting')
+    parser.add_argument('--output', help='write the full report, backlog over time included, here as JSON')
+    args = parser.parse_args()
+
+    report = run(args)
+    failures = check(report, args)
+    report['failures'] = failures
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'report': report}, f, indent=2)
+
+    summary = {key: value for key, value in report.items() if key != 'backlog'}
+    print(json.dumps(summary, indent=2))
+    for failure in failures:
+        print(f'FAIL: {failure}', file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
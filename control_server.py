@@ -0,0 +1,239 @@
+import os
+import json
+import stat
+import time
+import socket
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import metrics
+
+
+class CommandError(Exception):
+    """ Raised by a command handler, its message is sent back to the client. """
+
+
+def parse_address(address):
+    """ ('tcp', host, port) for 'host:port', ('unix', path, None) for anything else. """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in host and '/' not in host:
+        return 'tcp', host or '127.0.0.1', int(port)
+    return 'unix', address, None
+
+
+class ControlServer:
+    """ Local socket that lets scripts and stream deck software trigger the soundboard without hotkeys.
+
+    Clients send one command per line, either as text (`play airhorn`, `volume 40`: the command, a space and
+    an optional argument that may contain spaces) or as JSON (`{"id": 1, "cmd": "play", "arg": "airhorn"}`).
+    A JSON array is a batch and gets one array of replies. Every command is acknowledged on its own line, in
+    order, with how long it took: `ok 0.042 <result as JSON>` / `error 0.010 <message>` for text and
+    `{"id": 1, "ok": true, "ms": 0.042, "result": ...}` for JSON. Clients can pipeline as many commands as they
+    like without waiting for the replies.
+
+    `commands` maps a command name to a handler taking the argument (a string, or None) and returning
+    something JSON serializable. Handlers run on a pool of `workers` threads, one command of a client at a time,
+    so a slow command (saving a recording, a full audio queue) only holds up the client that sent it; handlers
+    of different clients can run at the same time.
+    """
+
+    def __init__(self, commands, address, max_line=64 * 1024, workers=4):
+        self.commands = commands
+        self.kind, self.host, self.port = parse_address(address)
+        if self.kind == 'unix' and os.name == 'nt':
+            raise ValueError(f'{address!r} is not host:port, Windows can only listen on TCP')
+        self.max_line = max_line
+        self.workers = workers
+
+        self.clients = 0
+        self.handled = 0
+        self.errors = 0
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._executor = None
+        self._writers = set()
+        self._count_lock = threading.Lock()  # commands of different clients run on different threads
+
+    @property
+    def address(self):
+        return f'{self.host}:{self.port}' if self.kind == 'tcp' else self.host
+
+    def start(self):
+        """ Starts listening on a thread of its own, raises OSError if the address can't be used. """
+        started = threading.Event()
+        failure = []
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='ControlCommand')
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._server = self._loop.run_until_complete(self._listen())
+            except BaseException as e:
+                failure.append(e)
+                self._loop.close()
+                self._executor.shutdown(wait=False)
+                return
+            finally:
+                started.set()
+            self._loop.run_forever()
+            # clients still connected are cancelled and given the chance to close their connections
+            tasks = asyncio.all_tasks(self._loop)
+            if tasks:
+                for task in tasks:
+                    task.cancel()
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='ControlServer', daemon=True)
+        self._thread.start()
+        started.wait()
+        if failure:
+            raise failure[0]
+        logging.info(f'Control server listening on {self.address}')
+
+    async def _listen(self):
+        if self.kind == 'tcp':
+            server = await asyncio.start_server(self._client, self.host, self.port, limit=self.max_line)
+            # port 0 picks a free one
+            self.port = server.sockets[0].getsockname()[1]
+            return server
+
+        self._remove_stale_socket()
+        server = await asyncio.start_unix_server(self._client, self.host, limit=self.max_line)
+        os.chmod(self.host, 0o600)
+        return server
+
+    def _remove_stale_socket(self):
+        """ Removes a socket file left behind by a crash, which would make the bind fail.
+
+        Anything that isn't a socket, or is one another soundboard still listens on, is left alone and
+        the bind fails with an OSError instead.
+        """
+        try:
+            if not stat.S_ISSOCK(os.stat(self.host).st_mode):
+                return
+        except FileNotFoundError:
+            return
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.host)
+            except ConnectionRefusedError:
+                os.unlink(self.host)
+            except OSError:
+                pass
+            else:
+                raise OSError(f'another program is already listening on {self.host}')
+
+    async def _client(self, reader, writer):
+        self.clients += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(f'error 0 line longer than {self.max_line} bytes\n'.encode())
+                    break
+                if not line:
+                    break
+
+                # the next line is only read once this one is answered, which keeps the replies in order
+                reply = await self._loop.run_in_executor(
+                    self._executor, self.handle_line, line.decode(errors='replace').strip())
+                if reply is not None:
+                    writer.write(reply.encode() + b'\n')
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def handle_line(self, line):
+        """ The reply to one line, None for a blank one. """
+        if not line:
+            return None
+
+        if line[0] in '[{':
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self._count(False)
+                return json.dumps({'ok': False, 'ms': 0, 'error': f'invalid JSON: {e}'})
+            if isinstance(request, list):
+                return json.dumps([self._handle_json(item) for item in request])
+            return json.dumps(self._handle_json(request))
+
+        cmd, _, arg = line.partition(' ')
+        ok, result, ms = self.run(cmd, arg.strip() or None)
+        if not ok:
+            return f'error {ms} {result}'
+        return f'ok {ms}' if result is None else f'ok {ms} {json.dumps(result)}'
+
+    def _handle_json(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get('cmd'), str):
+            self._count(False)
+            return {'ok': False, 'ms': 0, 'error': 'expected an object with a "cmd" string'}
+
+        arg = request.get('arg')
+        ok, result, ms = self.run(request['cmd'], None if arg is None else str(arg))
+        reply = {'ok': ok, 'ms': ms, 'result' if ok else 'error': result}
+        if 'id' in request:
+            reply['id'] = request['id']
+        return reply
+
+    def run(self, cmd, arg):
+        """ Runs a command, returns (ok, result or error message, milliseconds it took). """
+        start = time.perf_counter()
+        cmd = cmd.lower()
+        handler = self.commands.get(cmd)
+        try:
+            if handler is None:
+                raise CommandError(f'unknown command {cmd!r}, expected one of {", ".join(sorted(self.commands))}')
+            ok, result = True, handler(arg)
+        except CommandError as e:
+            ok, result = False, str(e)
+        except Exception as e:
+            logging.exception(f'Control command {cmd} failed')
+            ok, result = False, f'{e.__class__.__name__}: {e}'
+
+        if ok:
+            metrics.since(f'control.{cmd}', start)
+        self._count(ok)
+        return ok, result, round((time.perf_counter() - start) * 1000, 3)
+
+    def _count(self, ok):
+        with self._count_lock:
+            if ok:
+                self.handled += 1
+            else:
+                self.errors += 1
+
+    def stop(self):
+        if self._loop is None or self._loop.is_closed():
+            return
+
+        def close():
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            self._loop.stop()
+
+        self._loop.call_soon_threadsafe(close)
+        self._thread.join(timeout=1)
+        self._executor.shutdown(wait=False)
+        if self.kind == 'unix' and os.path.exists(self.host):
+            os.unlink(self.host)
+
+    def stats(self):
+        return {
+            'address': self.address,
+            'clients': self.clients,
+            'handled': self.handled,
+            'errors': self.errors,
+        }
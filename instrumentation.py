@@ -0,0 +1,175 @@
+import json
+import time
+import logging
+import threading
+
+
+class Histogram:
+    """ Latency histogram with a bucket per microsecond below 4 µs, then buckets a quarter octave wide up to
+    2^31 µs (about 36 minutes); anything longer is counted in the last bucket.
+
+    Recording is a couple of integer operations on a preallocated list, so it can stay on in the hot path;
+    percentiles are accurate to the bucket width (at most 25%).
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    BUCKETS = 32 * 4
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _bucket(us):
+        bits = us.bit_length()
+        if bits < 3:
+            return us
+        # the octave plus the two bits after the leading one
+        return min(bits * 4 + ((us >> (bits - 3)) & 3), Histogram.BUCKETS - 1)
+
+    @staticmethod
+    def _upper_bound(bucket):
+        # below 4 µs every microsecond is a bucket of its own, 4-11 are never used
+        if bucket < 12:
+            return bucket + 1
+        bits, sub = divmod(bucket, 4)
+        return (4 + sub + 1) << (bits - 3)
+
+    def record(self, seconds):
+        self.counts[self._bucket(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """ Upper bound of the bucket holding the p-th percentile, in seconds. """
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                if bucket == self.BUCKETS - 1:
+                    # the last bucket also holds everything longer than it
+                    return self.max
+                return min(self._upper_bound(bucket) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else None,
+            **{f'p{p}_ms': None if self.percentile(p) is None else round(self.percentile(p) * 1000, 3)
+               for p in (50, 90, 99)},
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+
+class Metrics:
+    """ Per stage latency histograms, counters and the slowest keys (e.g. files) per stage, all in memory.
+
+    Writes from several threads may occasionally lose an update to a counter, which is fine for statistics
+    and keeps recording free of locks.
+    """
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self.started = time.time()
+        self._histograms = {}
+        self._counters = {}
+        self._slow = {}  # stage -> {key: worst seconds}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, key=None):
+        hist = self._histograms.get(stage)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(stage, Histogram())
+        hist.record(seconds)
+
+        if key is not None:
+            self._record_slow(stage, key, seconds)
+
+    def since(self, stage, start, key=None):
+        """ Records the time from `start` (a time.perf_counter() value) until now. """
+        self.record(stage, time.perf_counter() - start, key)
+
+    def _record_slow(self, stage, key, seconds):
+        with self._lock:
+            slow = self._slow.setdefault(stage, {})
+            if seconds <= slow.get(key, 0.0):
+                return
+            slow[key] = seconds
+            if len(slow) > self.slowest:
+                del slow[min(slow, key=slow.get)]
+
+    def count(self, name, n=1):
+        self._counters[name] = self._counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+            slow = {stage: dict(keys) for stage, keys in self._slow.items()}
+        return {
+            'uptime_s': round(time.time() - self.started, 1),
+            'stages': {stage: hist.summary() for stage, hist in sorted(histograms.items())},
+            'counters': dict(sorted(self._counters.items())),
+            'slowest_ms': {stage: {key: round(seconds * 1000, 3) for key, seconds in
+                                   sorted(keys.items(), key=lambda item: item[1], reverse=True)}
+                           for stage, keys in sorted(slow.items())},
+        }
+
+    def dump(self, path=None):
+        """ Logs the p50/p99 of every stage on one line and, given a path, writes everything there as JSON. """
+        snapshot = self.snapshot()
+        stages = ', '.join(f'{stage} {s["p50_ms"]}/{s["p99_ms"]} ms' for stage, s in snapshot['stages'].items())
+        logging.debug(f'Latency p50/p99: {stages or "nothing recorded"}; counters: {snapshot["counters"]}')
+
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(snapshot, f, indent=2)
+            logging.debug(f'Metrics written to {path}')
+        return snapshot
+
+
+# shared by the soundboard and the modules it uses
+metrics = Metrics()
+
+
+class StartupProfile:
+    """ How long each phase of startup took, a phase ending where the next begins.
+
+    `start` is a time.perf_counter() value, e.g. taken before the slow imports. Things that finish in the
+    background later are recorded as milestones, with their time since the start.
+    """
+
+    def __init__(self, start=None):
+        self.start = start if start is not None else time.perf_counter()
+        self.phases = []  # (name, seconds)
+        self.milestones = []  # (name, seconds since the start)
+        self._last = self.start
+
+    def mark(self, name):
+        """ Ends the phase called `name`, returns the seconds since the start. """
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        metrics.record(f'startup.{name}', now - self._last)
+        self._last = now
+        return now - self.start
+
+    def milestone(self, name):
+        elapsed = time.perf_counter() - self.start
+        self.milestones.append((name, elapsed))
+        return elapsed
+
+    def report(self):
+        width = max((len(name) for name, _ in self.phases + self.milestones), default=0)
+        lines = [f'{name:<{width}} {seconds * 1000:8.1f} ms' for name, seconds in self.phases]
+        lines.append(f'{"total":<{width}} {(self._last - self.start) * 1000:8.1f} ms')
+        lines += [f'{name:<{width}} {seconds * 1000:8.1f} ms after start' for name, seconds in self.milestones]
+        return '\n'.join(lines)
@@ -0,0 +1,142 @@
+import time
+import logging
+import threading
+from array import array
+
+from pyaudio import paInt16, paContinue
+
+from software_mixer import find_output
+
+MIN_BUFFER = 64
+MAX_BUFFER = 8192
+
+
+def fix_buffer(buffer):
+    """ SDL wants the buffer as a power of two frames, this is the nearest one at or above `buffer`. """
+    fixed = 1 << max(0, int(buffer) - 1).bit_length()
+    fixed = min(max(fixed, MIN_BUFFER), MAX_BUFFER)
+    if fixed != buffer:
+        logging.warning(f'AUDIO_BUFFER has to be a power of two between {MIN_BUFFER} and {MAX_BUFFER}, using {fixed}.')
+    return fixed
+
+
+def validate_output(audio, device_name, rate, channels, buffer):
+    """ Adjusts the requested mixer settings to what the output device can do, returns (rate, channels, buffer).
+
+    The rate and channel count are checked with PortAudio against the device pygame is going to use.
+    """
+    buffer = fix_buffer(buffer)
+
+    device_index = find_output(audio, device_name)
+    try:
+        dev = audio.get_device_info_by_index(device_index) if device_index is not None \
+            else audio.get_default_output_device_info()
+    except (IOError, OSError) as e:
+        logging.warning(f'Could not check the audio settings against the output device: {e}')
+        return rate, channels, buffer
+
+    if channels > dev['maxOutputChannels']:
+        logging.warning(f'{dev["name"]} has {dev["maxOutputChannels"]} output channels, not {channels}.')
+        channels = max(1, int(dev['maxOutputChannels']))
+
+    try:
+        audio.is_format_supported(rate, output_device=dev['index'], output_channels=channels, output_format=paInt16)
+    except ValueError:
+        default_rate = int(dev['defaultSampleRate'])
+        logging.warning(f'{dev["name"]} does not support {rate} Hz, using {default_rate} Hz.')
+        rate = default_rate
+
+    return rate, channels, buffer
+
+
+def click_samples(rate, channels, seconds=0.01, amplitude=20000):
+    """ A short full band click as interleaved int16 bytes, easy to find again in a recording. """
+    frames = max(2, int(rate * seconds))
+    samples = array('h', [amplitude if (i // 8) % 2 else -amplitude for i in range(frames) for _ in range(channels)])
+    return samples.tobytes()
+
+
+def measure_loopback(audio, input_device_index, trigger, rate=44100, channels=2, seconds=1.0, threshold_db=-30.0):
+    """ Calls `trigger()` (which should play a click) and times when the click comes back on a loopback input.
+
+    The input (e.g. Stereo Mix) has to hear the output the click is played on. The trigger time and the
+    capture are compared on the input stream's clock when the host API reports ADC timestamps, and on the
+    time the chunks arrived otherwise. Returns the trigger-to-output latency in seconds, or None if the
+    click was never heard.
+    """
+    chunks = []
+
+    def callback(in_data, frame_count, time_info, status):
+        arrival = time.perf_counter() - frame_count / rate
+        chunks.append(((time_info or {}).get('input_buffer_adc_time') or 0.0, arrival, in_data))
+        return None, paContinue
+
+    stream = audio.open(
+        format=paInt16,
+        channels=channels,
+        rate=rate,
+        frames_per_buffer=256,
+        input=True,
+        input_device_index=input_device_index,
+        stream_callback=callback
+    )
+    stream.start_stream()
+    try:
+        # give the input a moment to start delivering audio
+        time.sleep(0.2)
+        trigger_stream_time = stream.get_time()
+        trigger_time = time.perf_counter()
+        trigger()
+        time.sleep(seconds)
+    finally:
+        stream.stop_stream()
+        stream.close()
+
+    use_adc = bool(chunks) and all(adc for adc, _, _ in chunks)
+    start = trigger_stream_time if use_adc else trigger_time
+    threshold = 32768 * 10 ** (threshold_db / 20)
+
+    for adc, arrival, data in chunks:
+        chunk_start = adc if use_adc else arrival
+        samples = array('h', data)
+        for i, sample in enumerate(samples):
+            if abs(sample) > threshold:
+                onset = chunk_start + (i // channels) / rate
+                if onset >= start:
+                    return onset - start
+    return None
+
+
+class UnderrunWatch(threading.Thread):
+    """ Doubles the software mixer's block size while it keeps running dry, up to `max_block` frames.
+
+    A bigger block means more latency, so it only grows when `threshold` underruns were reported within
+    one `interval`. `resize(block)` does the change, by default right away on this thread.
+    """
+
+    def __init__(self, mixer, interval=5.0, threshold=3, max_block=4096, resize=None):
+        super().__init__(name='UnderrunWatch', daemon=True)
+        self.mixer = mixer
+        self.resize = resize or mixer.resize
+        self.interval = interval
+        self.threshold = threshold
+        self.max_block = max_block
+        self._stop_event = threading.Event()
+        self._last = mixer.underruns
+
+    def check(self):
+        """ Looks at the underruns since the last check, run() calls it every `interval`. """
+        underruns = self.mixer.underruns
+        if underruns - self._last >= self.threshold and self.mixer.block < self.max_block:
+            block = min(self.mixer.block * 2, self.max_block)
+            logging.warning(f'{underruns - self._last} audio underruns in {self.interval:.0f} s, '
+                            f'raising the mixer block to {block} frames ({block / self.mixer.rate * 1000:.1f} ms).')
+            self.resize(block)
+        self._last = underruns
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stop_event.set()
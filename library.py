@@ -0,0 +1,346 @@
+import os
+import sys
+import stat
+import time
+import heapq
+import struct
+import select
+import logging
+import threading
+from collections import deque
+
+
+class LibraryDiff:
+    def __init__(self, added=(), removed=(), modified=(), renamed=(), slots=None):
+        self.added = list(added)  # files
+        self.removed = list(removed)  # files
+        self.modified = list(modified)  # files
+        self.renamed = list(renamed)  # (old file, new file)
+        # hotkey slot a removed file had, or an added/renamed file (or one that was waiting for a slot) has now
+        self.slots = slots or {}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified or self.renamed)
+
+    def __repr__(self):
+        return (f'<LibraryDiff added={len(self.added)} removed={len(self.removed)} '
+                f'modified={len(self.modified)} renamed={len(self.renamed)}>')
+
+
+class NameIndex:
+    """ Lower-cased names prepared for type-to-filter search.
+
+    A query that extends the previous one only has to look through the previous results, so typing a name
+    letter by letter narrows the search instead of rescanning the whole library every keystroke.
+    """
+
+    def __init__(self, items, key):
+        self._items = [(key(item).lower(), item) for item in items]
+        self._last_query = ''
+        self._last = self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def search(self, query):
+        query = query.lower()
+        if not query:
+            results = self._items
+        else:
+            base = self._last if self._last_query and query.startswith(self._last_query) else self._items
+            results = [entry for entry in base if query in entry[0]]
+
+        self._last_query, self._last = query, results
+        return [item for _, item in results]
+
+
+class SoundLibrary:
+    """ In-memory catalog of the sfx directory.
+
+    The directory is listed once; after that only the names a watcher reports (or the ones a rescan finds
+    different) are looked at, and listeners get a LibraryDiff of what changed. Every file keeps the hotkey slot it
+    was given until it is removed, and a renamed file keeps its old one. Slots that become free go to the files
+    without one, in name order. Listeners are called without the catalog locked, in the order the diffs were made.
+    """
+
+    def __init__(self, sfx_dir, slots):
+        self.sfx_dir = sfx_dir
+        self.slots = slots
+
+        self._files = {}  # file -> (mtime_ns, size)
+        self._slot_of = {}  # file -> hotkey slot
+        self._free = list(range(slots))
+        self._names = None  # lower-cased file and sound name -> file, built when first needed
+        self._lock = threading.RLock()
+        self._notify_lock = threading.Lock()
+        self._pending = deque()  # diffs the listeners haven't seen yet
+        self._unslotted = 0
+        self._listeners = []
+        self._watcher = None
+
+    @staticmethod
+    def name(file):
+        return file.split('.')[0]
+
+    def path(self, file):
+        return os.path.join(self.sfx_dir, file)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def entries(self):
+        """ (slot, file, name) for every file with a hotkey slot, ordered by slot. """
+        with self._lock:
+            return sorted((slot, file, self.name(file)) for file, slot in self._slot_of.items())
+
+    def files(self):
+        with self._lock:
+            return list(self._files)
+
+    def catalog(self):
+        """ (file, name, slot) for every file: the ones with a hotkey by slot, then the rest by name. """
+        with self._lock:
+            slotted = sorted((slot, file) for file, slot in self._slot_of.items())
+            rest = sorted(file for file in self._files if file not in self._slot_of)
+            return ([(file, self.name(file), slot) for slot, file in slotted] +
+                    [(file, self.name(file), None) for file in rest])
+
+    def find(self, query):
+        """ The file called `query`, with or without its extension and in any case, or None. """
+        with self._lock:
+            if query in self._files:
+                return query
+            if self._names is None:
+                self._names = {}
+                for file in sorted(self._files):
+                    self._names.setdefault(file.lower(), file)
+                    self._names.setdefault(self.name(file).lower(), file)
+            return self._names.get(query.lower())
+
+    def slot(self, file):
+        return self._slot_of.get(file)
+
+    def free_slots(self):
+        with self._lock:
+            return sorted(self._free)
+
+    def __len__(self):
+        return len(self._files)
+
+    def _stat(self, file):
+        try:
+            st = os.stat(self.path(file))
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def scan(self):
+        """ Lists the whole directory and applies the difference to the catalog. """
+        current = {}
+        with os.scandir(self.sfx_dir) as it:
+            for e in it:
+                if e.is_file():
+                    st = e.stat()
+                    current[e.name] = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            names = set(current) | set(self._files)
+            diff = self._apply({name: current.get(name) for name in names})
+        self._notify()
+        return diff
+
+    def update(self, names):
+        """ Re-checks only `names`, e.g. the ones a file system watcher reported. """
+        with self._lock:
+            diff = self._apply({name: self._stat(name) for name in set(names)})
+        self._notify()
+        return diff
+
+    def _apply(self, stats):
+        removed = []
+        added = []
+        modified = []
+        for name, st in stats.items():
+            old = self._files.get(name)
+            if st is None and old is not None:
+                removed.append(name)
+            elif st is not None and old is None:
+                added.append(name)
+            elif st is not None and st != old:
+                modified.append(name)
+
+        # a file that disappeared and one that appeared with the same mtime and size was renamed
+        renamed = []
+        by_stat = {self._files[name]: name for name in removed}
+        for name in list(added):
+            old = by_stat.pop(stats[name], None)
+            if old is not None:
+                renamed.append((old, name))
+                added.remove(name)
+                removed.remove(old)
+
+        slots = {}
+        for name in removed:
+            del self._files[name]
+            slot = self._slot_of.pop(name, None)
+            if slot is not None:
+                heapq.heappush(self._free, slot)
+                slots[name] = slot
+
+        for old, new in renamed:
+            self._files[new] = self._files.pop(old)
+            if old in self._slot_of:
+                self._slot_of[new] = slots[new] = self._slot_of.pop(old)
+
+        for name in added:
+            self._files[name] = stats[name]
+
+        for name in modified:
+            self._files[name] = stats[name]
+
+        # free slots go to every file without one, the ones that were already waiting included
+        if self._free and (removed or added):
+            for name in sorted(name for name in self._files if name not in self._slot_of):
+                if not self._free:
+                    break
+                self._slot_of[name] = slots[name] = heapq.heappop(self._free)
+
+        diff = LibraryDiff(added, removed, modified, renamed, slots)
+        if diff:
+            self._names = None
+            unslotted = len(self._files) - len(self._slot_of)
+            if unslotted > self._unslotted:
+                logging.warning(f'{unslotted} sfx have no hotkey due to a lack of keybind characters. '
+                                f'The max amount of sfx with a hotkey is currently: {self.slots}')
+            self._unslotted = unslotted
+            self._pending.append(diff)
+        return diff
+
+    def _notify(self):
+        # whoever holds the notify lock delivers every pending diff, so listeners see them in the order they
+        # were made, and can use the library themselves since the catalog isn't locked
+        with self._notify_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return
+                    diff = self._pending.popleft()
+                for callback in self._listeners:
+                    try:
+                        callback(diff)
+                    except Exception:
+                        logging.exception('Sound library listener failed')
+
+    def watch(self, poll_interval=1.0):
+        """ Keeps the catalog up to date in the background, with inotify on Linux and polling elsewhere. """
+        if sys.platform.startswith('linux'):
+            try:
+                self._watcher = InotifyWatcher(self)
+            except OSError as e:
+                logging.warning(f'inotify is unavailable ({e}), polling the sfx folder instead.')
+        if self._watcher is None:
+            self._watcher = PollingWatcher(self, poll_interval)
+        self._watcher.start()
+        return self._watcher
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+
+class PollingWatcher(threading.Thread):
+    """ Rescans when the directory's mtime changes, which catches added, removed and renamed files.
+
+    Files edited in place don't touch the directory; the sound cache notices those itself on the next play.
+    """
+
+    def __init__(self, library, interval):
+        super().__init__(name='SoundLibraryPoller', daemon=True)
+        self.library = library
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._mtime = self._dir_mtime()
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.library.sfx_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            mtime = self._dir_mtime()
+            if mtime != self._mtime and mtime is not None:
+                self._mtime = mtime
+                self.library.scan()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class InotifyWatcher(threading.Thread):
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, library, settle=0.1):
+        super().__init__(name='SoundLibraryInotify', daemon=True)
+        import ctypes
+        import ctypes.util
+
+        self.library = library
+        self.settle = settle
+        self._stop_event = threading.Event()
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE | self.IN_DELETE_SELF
+        if libc.inotify_add_watch(self.fd, os.fsencode(library.sfx_dir), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def _read_names(self):
+        names = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def run(self):
+        while not self._stop_event.is_set():
+            ready, _, _ = select.select([self.fd], [], [], 1.0)
+            if not ready:
+                continue
+
+            # copies and moves come in bursts, give them a moment to settle into one update
+            names = self._read_names()
+            deadline = time.monotonic() + self.settle
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                    break
+                names |= self._read_names()
+
+            if names:
+                self.library.update(names)
+
+        os.close(self.fd)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,446 @@
+import io
+import os
+import re
+import time
+import wave
+import queue
+import logging
+import threading
+
+from pyaudio import PyAudio, get_sample_size, paInt16, paContinue, paInputOverflow
+
+
+class PcmRingBuffer:
+    """ Fixed size circular buffer of interleaved PCM frames, written in place.
+
+    It holds `seconds` of audio plus `headroom` seconds of slack: snapshot() hands out views into the buffer
+    rather than copies, and the slack is how long the caller has to consume them before the writer wraps around
+    onto the oldest snapshotted frames.
+    """
+
+    def __init__(self, seconds, rate, frame_bytes, headroom=1.0):
+        self.seconds = seconds
+        self.rate = rate
+        self.frame_bytes = frame_bytes
+        self.capacity = int((seconds + headroom) * rate) * frame_bytes
+
+        self._buf = bytearray(self.capacity)
+        self._view = memoryview(self._buf)
+        self.written = 0  # total bytes ever written, the write position is this modulo capacity
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        n = len(data)
+
+        if n > self.capacity:
+            self.written += n - self.capacity
+            data = data[n - self.capacity:]
+            n = self.capacity
+
+        pos = self.written % self.capacity
+        first = min(n, self.capacity - pos)
+        self._view[pos:pos + first] = data[:first]
+        if first < n:
+            self._view[:n - first] = data[first:]
+
+        self.written += n
+
+    def available(self):
+        return min(self.written, self.capacity)
+
+    def snapshot(self, nbytes=None):
+        """ The last `nbytes` (default: everything buffered) as at most two memoryviews, oldest first. """
+        available = self.available()
+        if nbytes is None or nbytes > available:
+            nbytes = available
+        nbytes -= nbytes % self.frame_bytes
+
+        if not nbytes:
+            return []
+
+        end = self.written % self.capacity
+        start = (end - nbytes) % self.capacity
+        if start + nbytes <= self.capacity:
+            return [self._view[start:start + nbytes]]
+        return [self._view[start:], self._view[:end]]
+
+    def snapshot_seconds(self, seconds=None):
+        if seconds is None:
+            seconds = self.seconds
+        return self.snapshot(int(seconds * self.rate) * self.frame_bytes)
+
+    def clear(self):
+        self.written = 0
+
+
+class RecordingIndex:
+    """ Hands out recording file numbers, scanning the recordings directory only the first time. """
+
+    PATTERN = re.compile(r'^.*?(\d+)\.wav$')
+
+    def __init__(self, rec_dir):
+        self.rec_dir = rec_dir
+        self.latest = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        os.makedirs(self.rec_dir, exist_ok=True)
+
+        self.latest = 0
+        for rec in os.listdir(self.rec_dir):
+            match = self.PATTERN.match(rec)
+            if match:
+                self.latest = max(self.latest, int(match.group(1)))
+
+    def next_path(self, prefix):
+        with self._lock:
+            if self.latest is None:
+                self._scan()
+
+            while True:
+                self.latest += 1
+                path = os.path.join(self.rec_dir, f'{prefix}{self.latest}.wav')
+                # someone may have put files there since the scan
+                if not os.path.exists(path):
+                    return path
+
+
+class SegmentWriter:
+    """ Streams captured PCM to wav files on a background thread, starting a new file every segment.
+
+    put() never blocks so it is safe to call from the audio callback; when the disk falls more than `max_queue`
+    chunks behind, chunks are dropped and counted instead. If writing fails (the folder is gone, the disk is full)
+    the error is kept in `error` and the rest of the recording is dropped.
+    """
+
+    def __init__(self, index, prefix, rate, channels, sample_width, segment_seconds=600, segment_bytes=0,
+                 max_queue=256):
+        self.index = index
+        self.prefix = prefix
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = sample_width
+
+        frame_bytes = channels * sample_width
+        limits = [int(segment_seconds * rate) * frame_bytes] if segment_seconds else []
+        if segment_bytes:
+            limits.append(segment_bytes - segment_bytes % frame_bytes)
+        self.segment_limit = min(limits) if limits else None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = None
+        self._wf = None
+        self._segment_written = 0
+
+        self.paths = []
+        self.bytes_written = 0
+        self.chunks_dropped = 0
+        self.max_backlog = 0
+        self.write_time = 0.0
+        self.error = None
+        self.started = time.perf_counter()
+
+        self._thread = threading.Thread(target=self._run, name='SegmentWriter', daemon=True)
+        self._thread.start()
+
+    def put(self, data):
+        if self.error is not None:
+            self.chunks_dropped += 1
+            return
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            if not self.chunks_dropped:
+                logging.warning('The disk is not keeping up with the recording, dropping audio.')
+            self.chunks_dropped += 1
+        else:
+            self.max_backlog = max(self.max_backlog, self._queue.qsize())
+
+    def _open_segment(self):
+        path = self.index.next_path(self.prefix)
+        logging.debug(f'Starting recording segment: {path}')
+
+        # opened here so a missing folder fails before wave has half built its writer
+        self._file = open(path, 'wb')
+        self._wf = wave.open(self._file, 'wb')
+        self._wf.setnchannels(self.channels)
+        self._wf.setsampwidth(self.sample_width)
+        self._wf.setframerate(self.rate)
+        self._segment_written = 0
+        self.paths.append(path)
+
+    def _close_segment(self):
+        if self._wf is not None:
+            try:
+                self._wf.close()
+            finally:
+                self._wf = None
+                self._file.close()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+
+            if self.error is not None:
+                # keep draining so put() and close() never wait on a writer that has given up
+                self.chunks_dropped += 1
+                continue
+
+            start = time.perf_counter()
+            try:
+                self._write(data)
+            except (OSError, EOFError, wave.Error) as e:
+                logging.error(f'Could not write the recording, the rest of it is dropped: {e}')
+                self.error = e
+                self.chunks_dropped += 1
+                try:
+                    self._close_segment()
+                except (OSError, wave.Error):
+                    pass
+            self.write_time += time.perf_counter() - start
+
+        try:
+            self._close_segment()
+        except (OSError, wave.Error) as e:
+            logging.error(f'Could not finish the recording: {e}')
+            self.error = self.error or e
+
+    def _write(self, data):
+        data = memoryview(data).cast('B')
+        while len(data):
+            if self._wf is None:
+                self._open_segment()
+
+            n = len(data)
+            if self.segment_limit:
+                n = min(n, self.segment_limit - self._segment_written)
+            self._wf.writeframesraw(data[:n])
+            self._segment_written += n
+            self.bytes_written += n
+            data = data[n:]
+
+            if self.segment_limit and self._segment_written >= self.segment_limit:
+                self._close_segment()
+
+    def close(self, timeout=None):
+        """ Writes out whatever is still queued and finishes the current segment. """
+        try:
+            # the writer thread always drains the queue, the timeout only guards against it having died anyway
+            self._queue.put(None, timeout=10 if timeout is None else timeout)
+        except queue.Full:
+            logging.error('The recording writer stopped responding, the end of the recording is lost.')
+            return
+        self._thread.join(timeout)
+        logging.debug(f'Recording written to {len(self.paths)} segments. {self.metrics()}')
+
+    def metrics(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'segments': len(self.paths),
+            'bytes_written': self.bytes_written,
+            'backlog': self._queue.qsize(),
+            'max_backlog': self.max_backlog,
+            'chunks_dropped': self.chunks_dropped,
+            'error': str(self.error) if self.error is not None else None,
+            'write_mb_per_s': round(self.bytes_written / self.write_time / 1e6, 1) if self.write_time else 0,
+            'capture_mb_per_s': round(self.bytes_written / elapsed / 1e6, 3) if elapsed else 0,
+        }
+
+
+class Recorder:
+    """ Keeps the last `duration` seconds of an input device in a ring buffer, using PyAudio's callback mode.
+
+    `audio` can be any object with PyAudio's interface, e.g. a fake one for tests. Without one PyAudio is only
+    started, which enumerates every audio device, when the recorder is first used.
+    """
+
+    def __init__(self, duration=10, rate=44100, channels=2, chunk=1024, device_name='Stereo Mix (Realtek(R) Audio)',
+                 verbose=False, audio=None):
+        self.duration = duration
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        self.device_name = device_name
+        self.verbose = verbose
+
+        self._audio = audio
+        self._audio_lock = threading.Lock()
+        self.sample_width = get_sample_size(paInt16)
+        self.ring = PcmRingBuffer(duration, rate, channels * self.sample_width)
+        self.stream = None
+        self.writer = None
+        self._closed = threading.Event()
+        self._closed.set()
+
+        self._dev_index = None
+        self._usable = None
+
+        self._reset_metrics()
+
+    @property
+    def p(self):
+        with self._audio_lock:
+            if self._audio is None:
+                self._audio = PyAudio()
+            return self._audio
+
+    def _find_device(self):
+        p = self.p
+        with self._audio_lock:
+            if self._usable is not None:
+                return
+
+            for i in range(p.get_device_count()):
+                dev = p.get_device_info_by_index(i)
+                if dev['name'] == self.device_name and dev['hostApi'] == 0:
+                    self._dev_index = dev['index']
+                    self._usable = True
+                    return
+
+            logging.warning(f'Could not find the {self.device_name} device. Is it disabled?')
+            self._dev_index = 0
+            self._usable = False
+
+    @property
+    def dev_index(self):
+        self._find_device()
+        return self._dev_index
+
+    @property
+    def usable(self):
+        self._find_device()
+        return self._usable
+
+    def _reset_metrics(self):
+        self.frames_captured = 0
+        self.callbacks = 0
+        self.overflows = 0
+        self.dropped_frames = 0
+        self.callback_time = 0.0
+        self.callback_time_max = 0.0
+        self._next_adc_time = None
+
+    def start(self, writer=None):
+        """ Starts capturing, also streaming everything to `writer` (a SegmentWriter) if one is given. """
+        if self.stream is not None:
+            return
+
+        self.writer = writer
+        self.ring.clear()
+        self._reset_metrics()
+        self._closed.clear()
+        self.stream = self.p.open(
+            format=paInt16,
+            channels=self.channels,
+            rate=self.rate,
+            frames_per_buffer=self.chunk,
+            input=True,
+            input_device_index=self.dev_index,
+            stream_callback=self._callback
+        )
+        self.stream.start_stream()
+
+        if self.verbose: logging.debug(
+            f'Starting recording.\n'
+            f'Settings:\n\t'
+            f'duration: {self.duration} seconds\n\t'
+            f'verbose: {self.verbose}\n\t'
+            f'frequency: {self.rate}\n\t'
+            f'channels: {self.channels}\n\t'
+            f'chunk size: {self.chunk}\n\t'
+            f'audio device index: {self.dev_index}')
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        start = time.perf_counter()
+
+        if status & paInputOverflow:
+            self.overflows += 1
+
+        # the adc timestamps tell how many frames were lost between two callbacks, the flag alone doesn't
+        adc_time = time_info.get('input_buffer_adc_time') if time_info else None
+        if adc_time:
+            if self._next_adc_time is not None:
+                gap = int(round((adc_time - self._next_adc_time) * self.rate))
+                if gap > self.chunk // 2:
+                    self.dropped_frames += gap
+            self._next_adc_time = adc_time + frame_count / self.rate
+
+        self.ring.write(in_data)
+        if self.writer is not None:
+            self.writer.put(in_data)
+        self.frames_captured += frame_count
+        self.callbacks += 1
+
+        elapsed = time.perf_counter() - start
+        self.callback_time += elapsed
+        self.callback_time_max = max(self.callback_time_max, elapsed)
+        return None, paContinue
+
+    def stop(self):
+        if self.stream is None:
+            return
+
+        # stop_stream() waits for the running callback to return, so there is nothing left to wait for after close()
+        self.stream.stop_stream()
+        self.stream.close()
+        self.stream = None
+        logging.debug(f'Stopping recording. {self.metrics()}')
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self._closed.set()
+
+    def join(self, timeout=None):
+        return self._closed.wait(timeout)
+
+    def is_recording(self):
+        return self.stream is not None and self.stream.is_active()
+
+    def terminate(self):
+        self.stop()
+        if self._audio is not None:
+            self._audio.terminate()
+
+    def _write_wav(self, file, seconds):
+        # views into the ring buffer, written out without joining them into one copy
+        frames_to_save = self.ring.snapshot_seconds(seconds)
+
+        wf = wave.open(file, 'wb')
+        wf.setnchannels(self.channels)
+        wf.setsampwidth(self.sample_width)
+        wf.setframerate(self.rate)
+        for frames in frames_to_save:
+            wf.writeframes(frames)
+        wf.close()
+
+    def save(self, filepath, seconds=None):
+        logging.debug(f'Creating wav file: {filepath}')
+        self._write_wav(filepath, seconds)
+        logging.debug('File exported successfully.')
+
+    def snapshot_wav(self, seconds=None):
+        """ The last `seconds` as an in-memory wav file, e.g. for pygame.mixer.Sound(file=...). """
+        buf = io.BytesIO()
+        self._write_wav(buf, seconds)
+        buf.seek(0)
+        return buf
+
+    def new_writer(self, index, prefix, segment_seconds=600, segment_bytes=0, max_queue=256):
+        return SegmentWriter(index, prefix, self.rate, self.channels, self.sample_width,
+                             segment_seconds=segment_seconds, segment_bytes=segment_bytes, max_queue=max_queue)
+
+    def metrics(self):
+        writer = self.writer
+        return {
+            'writer': writer.metrics() if writer is not None else None,
+            'frames_captured': self.frames_captured,
+            'seconds_captured': round(self.frames_captured / self.rate, 2),
+            'callbacks': self.callbacks,
+            'overflows': self.overflows,
+            'dropped_frames': self.dropped_frames,
+            'callback_avg_us': round(self.callback_time / self.callbacks * 1e6, 1) if self.callbacks else 0,
+            'callback_max_us': round(self.callback_time_max * 1e6, 1),
+        }
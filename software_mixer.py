@@ -0,0 +1,342 @@
+import time
+import logging
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from pyaudio import PyAudio, paInt16, paContinue, paOutputUnderflow
+except ImportError:
+    PyAudio = None
+
+
+class Voice:
+    __slots__ = ('id', 'samples', 'gain', 'loops', 'pos', 'paused', 'started')
+
+    def __init__(self, voice_id, samples, gain, loops):
+        self.id = voice_id
+        self.samples = samples
+        self.gain = gain
+        self.loops = loops  # plays loops + 1 times, -1 loops forever, like pygame
+        self.pos = 0
+        self.paused = False
+        self.started = time.perf_counter()
+
+
+def find_output(audio, device_name):
+    """ PortAudio index of the output device called `device_name`, or None for the default output. """
+    if not device_name:
+        return None
+
+    for i in range(audio.get_device_count()):
+        dev = audio.get_device_info_by_index(i)
+        # PortAudio and SDL don't always agree on the exact device names
+        if dev['maxOutputChannels'] and (dev['name'] in device_name or device_name in dev['name']):
+            return dev['index']
+
+    logging.warning(f'Could not find the {device_name} output device, using the default output.')
+    return None
+
+
+class MonitorOutput:
+    """ A second output stream that plays the blocks the mixer already mixed for the main one.
+
+    The two devices run on their own clocks, so up to `max_blocks` are buffered between them; past that the
+    oldest are dropped, and when the monitor runs dry it plays silence until the next block arrives.
+    """
+
+    def __init__(self, audio, device_index, device_name, rate, channels, block, max_blocks=8):
+        self.device_name = device_name
+        self.frame_bytes = channels * 2
+        self.max_bytes = max_blocks * block * self.frame_bytes
+
+        self._buf = bytearray()
+        self._lock = threading.Lock()
+        self.dropped_bytes = 0
+        self.silent_bytes = 0
+
+        self.stream = audio.open(
+            format=paInt16,
+            channels=channels,
+            rate=rate,
+            frames_per_buffer=block,
+            output=True,
+            output_device_index=device_index,
+            stream_callback=self._callback
+        )
+        self.stream.start_stream()
+
+    def push(self, data):
+        with self._lock:
+            self._buf += data
+            excess = len(self._buf) - self.max_bytes
+            if excess > 0:
+                excess += -excess % self.frame_bytes
+                del self._buf[:excess]
+                self.dropped_bytes += excess
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        n = frame_count * self.frame_bytes
+        with self._lock:
+            out = bytes(self._buf[:n])
+            del self._buf[:n]
+        if len(out) < n:
+            self.silent_bytes += n - len(out)
+            out += bytes(n - len(out))
+        return out, paContinue
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+
+
+class SoftwareMixer:
+    """ Sums any number of voices into one output stream with NumPy.
+
+    Voices are int16 sample arrays at the mixer's rate, added up in float32 with a per voice gain and a master
+    limiter that turns the whole mix down instead of letting it clip. Stopping, pausing and changing the volume
+    only visit the voices that are playing, however many of them the mixer could hold.
+
+    mix() can be driven directly (e.g. by a benchmark); start() feeds it to a PyAudio output stream and
+    add_monitor() plays the same mix on a second device without mixing it twice.
+    `audio` can be any object with PyAudio's interface.
+    """
+
+    def __init__(self, rate=44100, channels=2, block=512, ceiling=0.98, release=0.05, audio=None):
+        if np is None:
+            raise RuntimeError('The software mixer needs numpy, install it or use MIXER_BACKEND=pygame')
+
+        self.rate = rate
+        self.channels = channels
+        self.block = block
+        self.ceiling = ceiling
+        self.release = release  # how much the limiter gain may recover per block
+        self.volume = 1.0
+
+        self._audio = audio
+        self._voices = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._limit = 1.0
+        self._acc = np.zeros((block, channels), dtype=np.float32)
+        self._tmp = np.zeros((block, channels), dtype=np.float32)
+        self.stream = None
+        self.monitor = None
+        self.device_name = None
+
+        self.blocks = 0
+        self.mix_time = 0.0
+        self.mix_time_max = 0.0
+        self.max_voices = 0
+        self.limited_blocks = 0
+        self.underruns = 0
+
+    def _samples(self, samples):
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples.reshape(-1, 1)
+        return samples[:, :self.channels]
+
+    def play(self, samples, gain=1.0, loops=0):
+        """ Starts a voice and returns its id. """
+        samples = self._samples(samples)
+        if not len(samples):
+            return None
+
+        with self._lock:
+            self._next_id += 1
+            voice = Voice(self._next_id, samples, gain, loops)
+            self._voices[voice.id] = voice
+            self.max_voices = max(self.max_voices, len(self._voices))
+        return voice.id
+
+    def stop(self, voice_id=None):
+        """ Stops one voice, or all of them without an id. """
+        with self._lock:
+            if voice_id is None:
+                self._voices.clear()
+            else:
+                self._voices.pop(voice_id, None)
+
+    def pause(self, voice_id=None):
+        with self._lock:
+            for voice in self._select(voice_id):
+                voice.paused = True
+
+    def unpause(self, voice_id=None):
+        with self._lock:
+            for voice in self._select(voice_id):
+                voice.paused = False
+
+    def set_gain(self, gain, voice_id=None):
+        with self._lock:
+            for voice in self._select(voice_id):
+                voice.gain = gain
+
+    def _select(self, voice_id):
+        if voice_id is None:
+            return list(self._voices.values())
+        voice = self._voices.get(voice_id)
+        return [voice] if voice is not None else []
+
+    def is_playing(self, voice_id):
+        return voice_id in self._voices
+
+    @property
+    def active(self):
+        return len(self._voices)
+
+    def mix(self, frames=None):
+        """ Renders the next `frames` (default: one block) of the mix as interleaved int16 bytes. """
+        start = time.perf_counter()
+        if frames is None:
+            frames = self.block
+        if frames > len(self._acc):
+            self._acc = np.zeros((frames, self.channels), dtype=np.float32)
+            self._tmp = np.zeros((frames, self.channels), dtype=np.float32)
+
+        acc = self._acc[:frames]
+        acc.fill(0)
+        with self._lock:
+            finished = [voice.id for voice in self._voices.values()
+                        if not voice.paused and not self._render(voice, acc, frames)]
+            for voice_id in finished:
+                del self._voices[voice_id]
+
+        acc *= self.volume / 32768
+
+        # instant attack, gradual release, so a burst of voices is turned down for that moment and
+        # the level comes back over a few blocks instead of clipping
+        peak = float(np.abs(acc).max()) if frames else 0.0
+        target = min(1.0, self.ceiling / peak) if peak else 1.0
+        if target < self._limit:
+            self._limit = target
+        else:
+            self._limit = min(target, self._limit + self.release)
+        if self._limit < 1.0:
+            acc *= self._limit
+            self.limited_blocks += 1
+        np.clip(acc, -1.0, 1.0, out=acc)
+
+        out = (acc * 32767).astype(np.int16).tobytes()
+        monitor = self.monitor
+        if monitor is not None:
+            monitor.push(out)
+
+        elapsed = time.perf_counter() - start
+        self.blocks += 1
+        self.mix_time += elapsed
+        self.mix_time_max = max(self.mix_time_max, elapsed)
+        return out
+
+    def _render(self, voice, acc, frames):
+        """ Adds the voice's next `frames` into acc, returns False once it has finished. """
+        samples = voice.samples
+        gain = np.float32(voice.gain)
+        filled = 0
+        while filled < frames:
+            n = min(frames - filled, len(samples) - voice.pos)
+            tmp = self._tmp[:n]
+            np.multiply(samples[voice.pos:voice.pos + n], gain, out=tmp)
+            acc[filled:filled + n] += tmp
+            voice.pos += n
+            filled += n
+
+            if voice.pos >= len(samples):
+                if voice.loops == 0:
+                    return False
+                if voice.loops > 0:
+                    voice.loops -= 1
+                voice.pos = 0
+        return True
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if status & paOutputUnderflow:
+            self.underruns += 1
+        return self.mix(frame_count), paContinue
+
+    def _open_audio(self):
+        if self._audio is None:
+            if PyAudio is None:
+                raise RuntimeError('The software mixer needs PyAudio to play anything')
+            self._audio = PyAudio()
+        return self._audio
+
+    def start(self, device_name=None):
+        """ Opens an output stream on `device_name` (the default output if it can't be found).
+
+        Calling it again moves the mix to another device; voices keep playing.
+        """
+        if self.stream is not None:
+            self.close_stream()
+
+        self.device_name = device_name
+        device_index = find_output(self._open_audio(), device_name)
+        self.stream = self._open_audio().open(
+            format=paInt16,
+            channels=self.channels,
+            rate=self.rate,
+            frames_per_buffer=self.block,
+            output=True,
+            output_device_index=device_index,
+            stream_callback=self._callback
+        )
+        self.stream.start_stream()
+        logging.debug(f'Software mixer started on device {device_index}: {self.rate} Hz, {self.channels} channels, '
+                      f'{self.block} frames per block')
+
+    def resize(self, block):
+        """ Changes the frames mixed per block, reopening the stream if one is running. """
+        self.block = block
+        if self.stream is not None:
+            self.start(self.device_name)
+        if self.monitor is not None:
+            self.add_monitor(self.monitor.device_name)
+
+    def add_monitor(self, device_name, max_blocks=8):
+        """ Also plays the mix on `device_name`. """
+        self.remove_monitor()
+        device_index = find_output(self._open_audio(), device_name)
+        self.monitor = MonitorOutput(self._open_audio(), device_index, device_name, self.rate, self.channels,
+                                     self.block, max_blocks)
+        logging.debug(f'Monitoring the mix on device {device_index}')
+
+    def remove_monitor(self):
+        monitor, self.monitor = self.monitor, None
+        if monitor is not None:
+            monitor.close()
+
+    @property
+    def monitor_device(self):
+        return self.monitor.device_name if self.monitor is not None else None
+
+    def close_stream(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+    def close(self):
+        self.remove_monitor()
+        self.close_stream()
+        self.stop()
+        if self._audio is not None:
+            self._audio.terminate()
+            self._audio = None
+
+    def stats(self):
+        return {
+            'voices': len(self._voices),
+            'max_voices': self.max_voices,
+            'blocks': self.blocks,
+            'mix_avg_us': round(self.mix_time / self.blocks * 1e6, 1) if self.blocks else 0,
+            'mix_max_us': round(self.mix_time_max * 1e6, 1),
+            'block_budget_us': round(self.block / self.rate * 1e6, 1),
+            'limited_blocks': self.limited_blocks,
+            'underruns': self.underruns,
+            'monitor_dropped_bytes': self.monitor.dropped_bytes if self.monitor is not None else 0,
+            'monitor_silent_bytes': self.monitor.silent_bytes if self.monitor is not None else 0,
+        }
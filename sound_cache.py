@@ -0,0 +1,260 @@
+import os
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import pygame
+
+
+def sound_nbytes(sound):
+    # pygame doesn't expose the chunk size without copying it (get_raw), so derive it from the mixer format
+    freq, size, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * freq) * channels * (abs(size) // 8)
+
+
+class SoundCache:
+    """ Decoded pygame Sounds keyed by path, invalidated by mtime/size and evicted LRU past a byte budget. """
+
+    def __init__(self, budget, loader=pygame.mixer.Sound, sizeof=sound_nbytes):
+        self.budget = budget
+        self.loader = loader
+        self.sizeof = sizeof
+
+        self._entries = OrderedDict()  # path -> (stamp, sound, nbytes)
+        self._lock = threading.Lock()
+        self._warm_thread = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+
+    @staticmethod
+    def _stamp(path):
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, path):
+        stamp = self._stamp(path)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # decode outside the lock so a slow file doesn't block hits on other sounds
+        sound = self.loader(path)
+        self._insert(path, stamp, sound)
+        return sound
+
+    def _insert(self, path, stamp, sound):
+        nbytes = self.sizeof(sound)
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.resident_bytes -= old[2]
+
+            if nbytes > self.budget:
+                logging.warning(f'{path} ({nbytes} bytes) is larger than the sound cache budget, not caching it.')
+                return
+
+            self._entries[path] = (stamp, sound, nbytes)
+            self.resident_bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self.resident_bytes > self.budget and self._entries:
+            path, (_, _, nbytes) = self._entries.popitem(last=False)
+            self.resident_bytes -= nbytes
+            self.evictions += 1
+            logging.debug(f'Evicted {path} from the sound cache.')
+
+    def discard(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.resident_bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+
+    def export(self, convert):
+        """ (path, stamp, convert(sound)) for every entry, least recently used first. """
+        with self._lock:
+            entries = list(self._entries.items())
+        return [(path, stamp, convert(sound)) for path, (stamp, sound, nbytes) in entries]
+
+    def restore(self, exported, convert):
+        """ Replaces the entries with the ones export() returned, turned back into sounds with `convert`. """
+        self.clear()
+        for path, stamp, data in exported:
+            self._insert(path, stamp, convert(data))
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def warm(self, paths):
+        """ Decodes `paths` on a background thread until the budget is full. """
+        def warm_nested():
+            loaded = 0
+            for path in paths:
+                if path in self:
+                    continue
+                if self.resident_bytes >= self.budget:
+                    break
+
+                try:
+                    stamp = self._stamp(path)
+                    sound = self.loader(path)
+                except (OSError, pygame.error) as e:
+                    logging.warning(f'Could not preload {path}: {e}')
+                    continue
+
+                # a press may have raced us to it, don't count it twice
+                if path not in self:
+                    self._insert(path, stamp, sound)
+                    loaded += 1
+
+            logging.debug(f'Sound cache warm-up done, preloaded {loaded} sounds. {self.stats()}')
+
+        self._warm_thread = threading.Thread(target=warm_nested, daemon=True)
+        self._warm_thread.start()
+        return self._warm_thread
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'resident_bytes': self.resident_bytes,
+                'budget': self.budget,
+            }
+
+
+class PcmDiskCache:
+    """ Sounds stored pre-decoded in the mixer's format, so loading one is a memory map instead of a decode.
+
+    Each entry is a header (source mtime/size and mixer frequency/size/channels) followed by the raw samples.
+    Entries whose header doesn't match the source file or the current mixer format are rebuilt on load.
+    """
+
+    MAGIC = b'SBPCM1'
+    HEADER = struct.Struct('<6sqqiii')
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        self.mapped = 0
+        self.built = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, path):
+        name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + '.pcm')
+
+    def _header(self, path):
+        st = os.stat(path)
+        freq, size, channels = pygame.mixer.get_init()
+        return self.HEADER.pack(self.MAGIC, st.st_mtime_ns, st.st_size, freq, size, channels)
+
+    def load(self, path):
+        header = self._header(path)
+        entry = self._entry_path(path)
+
+        sound = self._map(entry, header)
+        if sound is None:
+            sound = self._build(path, entry, header)
+        return sound
+
+    def _map(self, entry, header):
+        try:
+            f = open(entry, 'rb')
+        except FileNotFoundError:
+            return None
+
+        try:
+            with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:self.HEADER.size] != header:
+                    return None
+
+                _, _, _, _, size, channels = self.HEADER.unpack(header)
+                if (len(mm) - self.HEADER.size) % (abs(size) // 8 * channels):
+                    raise ValueError('the samples end mid-frame')
+
+                with memoryview(mm)[self.HEADER.size:] as samples:
+                    sound = pygame.mixer.Sound(buffer=samples)
+        except (OSError, ValueError, struct.error) as e:
+            # e.g. an empty or cut off file left by a crash or a full disk, it is rebuilt
+            logging.warning(f'Discarding broken pcm cache entry {entry}: {e}')
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            return None
+
+        # mtime doubles as the last use time for prune()
+        os.utime(entry)
+        self.mapped += 1
+        return sound
+
+    def _build(self, path, entry, header):
+        sound = pygame.mixer.Sound(path)
+
+        tmp = f'{entry}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                f.write(sound.get_raw())
+            os.replace(tmp, entry)
+        except OSError as e:
+            logging.warning(f'Could not write {path} to the pcm cache: {e}')
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        else:
+            self.built += 1
+            logging.debug(f'Added {path} to the pcm cache.')
+
+        return sound
+
+    def prune(self, max_bytes=None):
+        """ Removes the least recently used entries until the cache fits in `max_bytes`. """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        entries = []
+        total = 0
+        for e in os.scandir(self.cache_dir):
+            if e.name.endswith('.pcm'):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+                total += st.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        logging.debug(f'Pruned {removed} entries from the pcm cache, {total} bytes remaining.')
+        return removed
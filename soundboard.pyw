@@ -1,103 +1,413 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter.messagebox import askyesno, showerror
-import os, random, sys, logging, re, wave, threading
+import os, random, sys, time, logging, threading, signal, argparse
+started = time.perf_counter()
 from system_hotkey import SystemHotkey
-from pyaudio import PyAudio, paInt16
 
 # todo: add nicer colors to ui elements
 
 # import pygame without that message
-with open(os.devnull, 'w') as f:
-    temp_stdout = sys.stdout
-    sys.stdout = f
-    import pygame
-    from pygame import _sdl2
-    pygame.init()
-    sys.stdout = temp_stdout
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import pygame
+from pygame import _sdl2
 
+from sound_cache import SoundCache, PcmDiskCache
+from audio_dispatcher import AudioDispatcher
+from recorder import Recorder, RecordingIndex
+from library import SoundLibrary, NameIndex
+from software_mixer import SoftwareMixer
+from voices import VoiceManager, ChannelBackend, SoftwareBackend
+from analysis import LibraryAnalyzer, apply_gain
+from latency import fix_buffer, validate_output, click_samples, measure_loopback, UnderrunWatch
+from instrumentation import metrics, StartupProfile
+from control_server import ControlServer, CommandError
 
-def keybind_listener():
-    hk = SystemHotkey()
-    sfx = get_sfx()
 
-    # sfx keybinds
-    for i in range(0, len(sfx)):
-        hk.register(['alt', bindable_chars[i]], callback=lambda event, s=sfx[i][0]: play(s))
+class PlaybackState:
+    """ The playback settings, kept out of Tk variables so any thread can read them and no window is needed. """
 
-    logging.debug(f'Using {len(sfx)} of {len(bindable_chars)} keybinds.')
+    def __init__(self, volume=50, loop=False, simultaneous=True):
+        self.volume = volume
+        self.loop = loop
+        self.simultaneous = simultaneous
 
-    # control keybinds
-    hk.register(['alt', '1'], callback=lambda event: stop())
-    hk.register(['alt', '2'], callback=lambda event: pause())
-    hk.register(['alt', '3'], callback=lambda event: unpause())
-    hk.register(['alt', '4'], callback=lambda event: random_sound())
+    @property
+    def gain(self):
+        return self.volume / 100
 
+    @property
+    def loops(self):
+        return 999 if self.loop else 0
 
-def get_sfx():
-    if os.path.exists(sfx_dir):
-        sfx_files = os.listdir(sfx_dir)
-        sfx_filenames = [n.split('.')[0] for n in sfx_files]
 
-        sfx_list = list(zip(sfx_files, sfx_filenames))
+class RecordingState:
+    """ The recorder's settings, which the recording menu edits and the hotkeys and control socket read. """
 
-        if len(sfx_files) > len(bindable_chars):
-            sfx_list = sfx_list[:len(bindable_chars)]
-            logging.warning(f'One or more sfx have not been used due to a lack of keybind characters. '
-                            f'The max amount of sfx is currently: {len(bindable_chars)}')
+    def __init__(self, file_name='recording', continuous=False):
+        self.file_name = file_name
+        self.continuous = continuous
 
-        return sfx_list
-    else:
-        os.mkdir(sfx_dir)
-        sound_error_text.set('No sound effects! SFX folder has been created.')
-        return []
 
+def keybind_listener():
+    hk = SystemHotkey(measure=hotkey_measure)
+
+    banks = get_banks()
+    result = hk.register_many(get_bindings(banks), atomic=False)
+    for hotkey, err in result.failed.items():
+        logging.warning(f'Could not register {"+".join(hotkey)}: {err}')
+    logging.debug(f'Registered {len(result.registered)} keybinds in {result.seconds * 1000:.1f} ms.')
+    define_banks(hk, banks)
+    return hk
+
+
+def timed_hotkey(callback):
+    def run(event):
+        # enqueue_time is stamped by the hotkey listener when the OS delivered the key press
+        start = time.perf_counter()
+        metrics.record('hotkey.queue', start - event.enqueue_time)
+        metrics.count('hotkey.presses')
+        callback(event)
+        metrics.since('hotkey.callback', start)
+    return run
+
+
+def sfx_callback(file):
+    return timed_hotkey(lambda event: play(file, event.enqueue_time))
+
+
+def hotkey_text(slot):
+    bank, key = divmod(slot, len(bindable_chars))
+    return f'alt+{bindable_chars[key]}' + (f' [{bank + 1}]' if bank else '')
+
+
+def get_banks():
+    """ {bank: {key: file}}, every bank reuses the same bindable_chars. """
+    banks = {}
+    for slot, file, name in library.entries():
+        bank, key = divmod(slot, len(bindable_chars))
+        banks.setdefault(bank, {})[key] = file
+    return banks
+
+
+def get_bindings(banks):
+    # a key is grabbed once if it has a sound in any bank, bank 1 is the registered callbacks
+    # and the other banks are layers over them, so switching banks never touches the OS grabs
+    first = banks.get(0, {})
+    keys = set(replay_keys).union(*banks.values())
+    bindings = []
+    for key in sorted(keys):
+        if key in first:
+            callback = sfx_callback(first[key])
+        else:
+            callback = replay_callback(replay_keys[key]) if key in replay_keys else None
+        bindings.append((['alt', bindable_chars[key]], callback))
 
-class SoundGrid(tk.LabelFrame):
-    def __init__(self, *args, **kwargs):
-        tk.LabelFrame.__init__(self, *args, **kwargs)
+    logging.debug(f'Using {sum(map(len, banks.values()))} of {library.slots} keybinds in {max(1, len(banks))} banks.')
 
-        self.grid_columnconfigure(0, weight=1)
-        self.rowconfigure(0, weight=1)
+    # control keybinds
+    bindings += [
+        (['alt', '1'], timed_hotkey(lambda event: stop())),
+        (['alt', '2'], timed_hotkey(lambda event: pause())),
+        (['alt', '3'], timed_hotkey(lambda event: unpause())),
+        (['alt', '4'], timed_hotkey(lambda event: random_sound())),
+        (['alt', 'f1'], timed_hotkey(lambda event: instant_replay())),
+        (['alt', 'f2'], timed_hotkey(lambda event: play_replay(-1))),
+        (['alt', 'f3'], timed_hotkey(lambda event: next_bank())),
+    ]
+    if debug:
+        bindings.append((['alt', 'f12'], lambda event: dump_metrics()))
+    return bindings
+
+
+def define_banks(hk, banks):
+    used = set().union(*banks.values())
+    for bank in range(1, sound_banks):
+        files = banks.get(bank, {})
+        # keys without a sound in this bank are silenced rather than falling through to bank 1
+        hk.define_layer(f'bank{bank}', [
+            (['alt', bindable_chars[key]], sfx_callback(files[key]) if key in files else None)
+            for key in sorted(used) if ('alt', bindable_chars[key]) in hk.keybinds
+        ])
+
+
+def next_bank():
+    global active_bank
+
+    banks = max((slot for slot, file, name in library.entries()), default=0) // len(bindable_chars) + 1
+    active_bank = (active_bank + 1) % banks
+    hk.activate_layer(f'bank{active_bank}' if active_bank else None)
+    logging.debug(f'Switched to sound bank {active_bank + 1}/{banks}')
+
+    if root is not None:
+        root.after(0, bank_text.set, f'Bank {active_bank + 1} (alt+f3)')
+
+
+def control_commands():
+    """ What the control socket can do, through the same functions the hotkeys and the window use. """
+    def play_command(arg):
+        received = time.perf_counter()
+        if not arg:
+            raise CommandError('play needs a file or sound name')
+        file = library.find(arg)
+        if file is None:
+            raise CommandError(f'there is no sound called {arg!r}')
+        if not play(file, received):
+            raise CommandError('the audio dispatcher is full, the sound was dropped')
+        return file
+
+    def volume_command(arg):
+        if arg is None:
+            return state.volume
+        try:
+            vol = int(arg)
+        except ValueError:
+            raise CommandError(f'volume has to be a whole number from 0 to 100, not {arg!r}') from None
+        if not 0 <= vol <= 100:
+            raise CommandError(f'volume has to be from 0 to 100, not {vol}')
+
+        change_volume(vol)
+        if control_grid is not None:
+            root.after(0, control_grid.volume_slider.set, vol)
+        return vol
+
+    def random_command(arg):
+        file = random_sound()
+        if file is None:
+            raise CommandError('there are no sounds')
+        return file
+
+    # --headless has no recording menu, this is how it starts, stops and saves the recorder
+    def record_command(arg):
+        if arg == 'start':
+            if not start_recording():
+                raise CommandError(f'the recorder can\'t be used, {recorder.device_name} was not found')
+        elif arg == 'stop':
+            stop_recording()
+        elif arg == 'save':
+            if not recorder.is_recording():
+                raise CommandError('the recorder is not running')
+            save_recording()
+        elif arg is not None:
+            raise CommandError(f'record takes start, stop or save, not {arg!r}')
+        return recorder.is_recording()
+
+    def list_command(arg):
+        query = (arg or '').lower()
+        return [{'file': file, 'name': name, 'hotkey': hotkey_text(slot) if slot is not None else None}
+                for file, name, slot in library.catalog() if query in name.lower()]
+
+    return {
+        'play': play_command,
+        'stop': lambda arg: stop(),
+        'pause': lambda arg: pause(),
+        'unpause': lambda arg: unpause(),
+        'volume': volume_command,
+        'random': random_command,
+        'record': record_command,
+        'list': list_command,
+    }
 
-        canvas = tk.Canvas(self, bd=0, highlightthickness=0)
-        canvas.grid_propagate(False)
-        scrollbar = ttk.Scrollbar(self, orient="vertical", command=canvas.yview)
-        self.scrollable_frame = ttk.Frame(canvas)
 
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all")
-            )
-        )
+def get_sfx():
+    return [(file, name) for slot, file, name in library.entries()]
+
+
+def on_library_change(diff):
+    logging.debug(f'sfx folder changed: {diff}')
+
+    renamed_to = [new for old, new in diff.renamed]
+    for file in diff.removed + diff.modified + [old for old, new in diff.renamed]:
+        sound_cache.discard(library.path(file))
+    if diff.added or diff.modified or renamed_to:
+        sound_cache.warm([library.path(file) for file in diff.added + diff.modified + renamed_to])
+
+    if analyzer is not None:
+        for file in diff.removed + diff.modified:
+            analyzer.forget(file)
+        for old, new in diff.renamed:
+            analyzer.rename(old, new)
+        analyzer.update(diff.added + diff.modified)
+
+    # rebind only grabs and releases the keys that changed, the rest just get their new callbacks
+    banks = get_banks()
+    with replay_lock:
+        move_replays(banks)
+        bindings = get_bindings(banks)
+    result = hk.rebind(bindings, atomic=False)
+    for hotkey, err in result.failed.items():
+        logging.warning(f'Could not register {"+".join(hotkey)}: {err}')
+    define_banks(hk, banks)
+
+    if sound_grid is not None:
+        root.after(0, sound_grid.apply_diff, diff)
+
+
+def load_sound(decode, path):
+    start = time.perf_counter()
+    sound = decode(path)
+    metrics.since('decode', start, os.path.basename(path))
+
+    file = os.path.basename(path)
+    # start at the first audible sample, the silence before it would only add to the hotkey's latency
+    trim = analyzer.trim_seconds(file) if analyzer is not None else 0
+    # pygame caps a sound's volume at 1, so quiet sounds are made louder in their samples instead
+    boost = max(analyzer.gain(file), 1.0) if analyzer is not None else 1.0
+    if trim or boost > 1:
+        samples = pygame.sndarray.samples(sound)
+        if trim:
+            samples = samples[int(trim * pygame.mixer.get_init()[0]):]
+        if boost > 1:
+            samples = apply_gain(samples, boost)
+        sound = pygame.sndarray.make_sound(samples)
+    return sound
+
+
+def on_analysis_update(files):
+    # sounds loaded before their leading silence and gain were known are loaded again, trimmed and boosted
+    changed = [file for file in files if analyzer.trim_seconds(file) or analyzer.gain(file) > 1]
+    for file in changed:
+        sound_cache.discard(library.path(file))
+    if changed:
+        sound_cache.warm([library.path(file) for file in changed])
+
+    report = analyzer.trim_report()
+    for file, ms in report:
+        logging.debug(f'Skipping {ms} ms of leading silence in {file}')
+    if report:
+        logging.info(f'Leading silence trimmed from {len(report)} sfx, {sum(ms for file, ms in report):.0f} ms in total.')
 
-        canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
 
-        canvas.configure(yscrollcommand=scrollbar.set)
+class SoundGrid(tk.LabelFrame):
+    """ Scrollable, searchable list of the library that only has widgets for the rows on screen.
 
-        canvas.grid(row=0, column=0, sticky='nsew')
-        scrollbar.grid(row=0, column=1, sticky='nsew')
+    Scrolling or filtering re-labels the same few rows instead of creating a row per sound.
+    """
 
-        data = get_sfx()
+    def __init__(self, *args, **kwargs):
+        tk.LabelFrame.__init__(self, *args, **kwargs)
 
-        if data:
-            self.scrollable_frame.grid_columnconfigure(1, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+        self.query = tk.StringVar()
+        search = ttk.Entry(self, textvariable=self.query)
+        search.grid(row=0, column=0, columnspan=2, sticky='ew', pady=(0, 5))
+        self.query.trace_add('write', lambda *args: self.refilter())
+
+        self.list_frame = ttk.Frame(self, height=250)
+        self.list_frame.grid_propagate(False)
+        self.list_frame.grid_columnconfigure(1, weight=1)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+
+        self.list_frame.grid(row=1, column=0, sticky='nsew')
+        self.scrollbar.grid(row=1, column=1, sticky='nsew')
+
+        tk.Label(self.list_frame, text="Nr.", anchor="w").grid(row=0, column=0, sticky="ew")
+        tk.Label(self.list_frame, text="Sound Effects", anchor="w").grid(row=0, column=1, sticky="ew")
+        tk.Label(self.list_frame, text="Hotkeys", anchor="w").grid(row=0, column=2, sticky="ew")
+        self.error_label = tk.Label(self.list_frame, textvariable=sound_error_text, anchor="w")
+
+        self.rows = []  # recycled (nr, button, hotkey) widgets, one per visible row
+        self.first = 0
+        self.view = []
+
+        self.list_frame.bind('<Configure>', lambda e: self.resize(e.height))
+        self.bind_mousewheel(self.list_frame)
+
+        self.rebuild()
+
+    def rebuild(self, keep_position=False):
+        self.catalog = library.catalog()
+        self.index = NameIndex(self.catalog, key=lambda entry: entry[1])
+
+        bound = sum(1 for file, name, slot in self.catalog if slot is not None)
+        extra = f', {len(self.catalog)} total' if len(self.catalog) > bound else ''
+        self.configure(text=f'Sounds ({bound}/{library.slots}{extra})')
+
+        self.refilter(keep_position)
+
+    def refilter(self, keep_position=False):
+        self.view = self.index.search(self.query.get())
+        if not keep_position:
+            self.first = 0
+        self.render()
+
+    def resize(self, height):
+        if not self.rows:
+            self.add_rows(1)
+        row_height = max(1, self.rows[0][1].winfo_reqheight())
+
+        # the header takes a row
+        visible = max(1, height // row_height - 1)
+        if visible > len(self.rows):
+            self.add_rows(visible - len(self.rows))
+        self.render()
+
+    def add_rows(self, amount):
+        for _ in range(amount):
+            j = len(self.rows)
+            row = (
+                tk.Label(self.list_frame, anchor="w"),
+                tk.Button(self.list_frame, command=lambda j=j: self.play_row(j)),
+                tk.Label(self.list_frame),
+            )
+            for widget in row:
+                self.bind_mousewheel(widget)
+            self.rows.append(row)
+
+    def bind_mousewheel(self, widget):
+        widget.bind('<MouseWheel>', lambda e: self.yview('scroll', -1 if e.delta > 0 else 1, 'units'))
+        # X11 reports the wheel as buttons 4 and 5
+        widget.bind('<Button-4>', lambda e: self.yview('scroll', -1, 'units'))
+        widget.bind('<Button-5>', lambda e: self.yview('scroll', 1, 'units'))
+
+    def play_row(self, j):
+        if self.first + j < len(self.view):
+            play(self.view[self.first + j][0])
+
+    def render(self):
+        total = len(self.view)
+        visible = len(self.rows)
+        self.first = max(0, min(self.first, total - visible))
+
+        for j, (nr, button, hotkey) in enumerate(self.rows):
+            i = self.first + j
+            if i < total:
+                file, name, slot = self.view[i]
+                nr.configure(text=str(slot + 1) if slot is not None else '')
+                button.configure(text=name)
+                hotkey.configure(text=hotkey_text(slot) if slot is not None else '')
+
+                nr.grid(row=j + 1, column=0, sticky="ew", ipadx=5)
+                button.grid(row=j + 1, column=1, sticky="ew", ipadx=33)
+                hotkey.grid(row=j + 1, column=2, sticky="ew", ipadx=5)
+            else:
+                for widget in (nr, button, hotkey):
+                    widget.grid_remove()
 
-            tk.Label(self.scrollable_frame, text="Nr.", anchor="w").grid(row=0, column=0, sticky="ew")
-            tk.Label(self.scrollable_frame, text="Sound Effects", anchor="w").grid(row=0, column=1, sticky="ew")
-            tk.Label(self.scrollable_frame, text="Hotkeys", anchor="w").grid(row=0, column=2, sticky="ew")
+        if not self.catalog:
+            self.error_label.grid(row=1, column=0, columnspan=3, sticky="ew")
+        else:
+            self.error_label.grid_remove()
 
-            row = 0
-            for file, name in data:
+        if total:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + visible) / total))
+        else:
+            self.scrollbar.set(0, 1)
 
-                tk.Label(self.scrollable_frame, text=str(row + 1), anchor="w").grid(row=row, column=0, sticky="ew", ipadx=5)
-                tk.Button(self.scrollable_frame, text=name, command=lambda n=file: play(n)).grid(row=row, column=1, sticky="ew", ipadx=33)
-                tk.Label(self.scrollable_frame, text=f'alt+{bindable_chars[row]}').grid(row=row, column=2, sticky="ew", ipadx=5)
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.first = int(float(args[1]) * len(self.view))
+        elif args[0] == 'scroll':
+            step = len(self.rows) if args[2] == 'pages' else 1
+            self.first += int(args[1]) * step
+        self.render()
 
-                row += 1
-        else:
-            tk.Label(self.scrollable_frame, textvariable=sound_error_text, anchor="w").grid(row=0, column=0, sticky="ew")
+    def apply_diff(self, diff):
+        # names and slots may have moved anywhere in the list, rebuilding the catalog and index is cheap
+        # next to the widgets, which are reused as they are
+        self.rebuild(keep_position=True)
 
 
 class ControlGrid(tk.LabelFrame):
@@ -132,19 +442,40 @@ class ControlGrid(tk.LabelFrame):
         tk.Label(self, text='Random sound').grid(row=get_y_pos(0), column=0, sticky=tk.E)
         tk.Button(self, command=lambda: random_sound(), text="Random (alt+4)", padx=10).grid(row=get_y_pos(1), column=1, sticky='ew')
 
+        tk.Label(self, text='Instant replay').grid(row=get_y_pos(0), column=0, sticky=tk.E)
+        tk.Button(self, command=lambda: instant_replay(), text="Capture (alt+f1)", padx=10).grid(row=get_y_pos(1), column=1, sticky='ew')
+
+        tk.Label(self, text='Sound bank').grid(row=get_y_pos(0), column=0, sticky=tk.E)
+        tk.Button(self, command=lambda: next_bank(), textvariable=bank_text, padx=10).grid(row=get_y_pos(1), column=1, sticky='ew')
+
         tk.Label(self, text='Volume').grid(row=get_y_pos(0), column=0, sticky=tk.E)
-        volume_slider = tk.Scale(self, from_=0, to=100, orient=tk.HORIZONTAL, tickinterval=100, command=change_volume, variable=volume)
-        volume_slider.set(50)
-        volume_slider.grid(row=get_y_pos(1), column=1, sticky='ew')
+        self.volume_slider = tk.Scale(self, from_=0, to=100, orient=tk.HORIZONTAL, tickinterval=100, command=change_volume)
+        self.volume_slider.set(state.volume)
+        self.volume_slider.grid(row=get_y_pos(1), column=1, sticky='ew')
 
         tk.Label(self, text='Playback Device').grid(row=get_y_pos(0), column=0, sticky=tk.E)
-        opts = ttk.Combobox(self, values=outputs, state='readonly')
+        # listing the devices is slow, it waits until the list is first opened
+        opts = ttk.Combobox(self, state='readonly')
+        opts.configure(postcommand=lambda: opts.configure(values=output_devices()))
         opts.bind('<<ComboboxSelected>>', change_device)
-        opts.set('CABLE Input (VB-Audio Virtual Cable)' if 'CABLE Input (VB-Audio Virtual Cable)' in outputs else outputs[0])
+        opts.set(output_device or 'Default')
         opts.grid(row=get_y_pos(1), column=1, sticky='ew')
 
-        ttk.Checkbutton(self, text="Allow simultaneous playback", onvalue=1, offvalue=0, variable=simultaneous).grid(row=get_y_pos(1, True), column=1, sticky='w')
-        ttk.Checkbutton(self, text="Loop", variable=loop, onvalue=1, offvalue=0).grid(row=get_y_pos(1, True), column=1, sticky='w')
+        # the same mix on a second device, e.g. headphones next to the virtual cable
+        tk.Label(self, text='Monitor Device').grid(row=get_y_pos(0), column=0, sticky=tk.E)
+        monitor_opts = ttk.Combobox(self, state='readonly' if soft_mixer is not None else 'disabled')
+        monitor_opts.configure(postcommand=lambda: monitor_opts.configure(values=['None'] + output_devices()))
+        monitor_opts.bind('<<ComboboxSelected>>', change_monitor)
+        monitor_opts.set(soft_mixer.monitor_device if soft_mixer is not None and soft_mixer.monitor_device else 'None')
+        monitor_opts.grid(row=get_y_pos(1), column=1, sticky='ew')
+
+        # the checkbuttons need Tk variables, the hotkeys read their values from the playback state
+        self.simultaneous = tk.BooleanVar(self, value=state.simultaneous)
+        self.loop = tk.BooleanVar(self, value=state.loop)
+        ttk.Checkbutton(self, text="Allow simultaneous playback", onvalue=1, offvalue=0, variable=self.simultaneous,
+                        command=lambda: setattr(state, 'simultaneous', self.simultaneous.get())).grid(row=get_y_pos(1, True), column=1, sticky='w')
+        ttk.Checkbutton(self, text="Loop", variable=self.loop, onvalue=1, offvalue=0,
+                        command=lambda: setattr(state, 'loop', self.loop.get())).grid(row=get_y_pos(1, True), column=1, sticky='w')
 
         tk.Label(self, text='Recording').grid(row=get_y_pos(0), column=0, sticky=tk.E)
         tk.Button(self, command=open_rec_menu, text="Open Recording Menu", padx=10).grid(row=get_y_pos(1), column=1, sticky='ew')
@@ -153,105 +484,10 @@ class ControlGrid(tk.LabelFrame):
         tk.Button(self, command=refresh_sound_grid, text="Refresh Window", padx=10).grid(row=get_y_pos(1), column=1, sticky='ew')
 
 
-class StoppableThread(threading.Thread):
-    def __init__(self,  *args, **kwargs):
-        super(StoppableThread, self).__init__(*args, **kwargs)
-        self._stop_event = threading.Event()
-
-    def stop(self):
-        self._stop_event.set()
-
-    def stopped(self):
-        return self._stop_event.is_set()
-
-
-class Recorder:
-    def __init__(self, duration=10, verbose=False):
-        self.frames = []
-        self.duration = int(44100 / 1024 * duration)
-        self.verbose = verbose
-        self.t = StoppableThread(target=self.record)
-        self.dev_index = 0
-        self.p = PyAudio()
-        self.usable = True
-
-        for i in range(self.p.get_device_count()):
-            dev = self.p.get_device_info_by_index(i)
-            if dev['name'] == 'Stereo Mix (Realtek(R) Audio)' and dev['hostApi'] == 0:
-                self.dev_index = dev['index']
-                break
-        else:  # if not break
-            logging.warning('Could not find stereo mix device. Is it disabled?')
-            self.usable = False
-
-
-    def start(self):
-        self.t.start()
-        if self.verbose: logging.debug(
-            f'Starting recording.\n'
-            f'Settings:\n\t'
-            f'duration: {self.duration} (about {self.duration / 43} seconds)\n\t'
-            f'verbose: {self.verbose}\n\t'
-            f'frequency: 44100\n\t'
-            f'channels: 2\n\t'
-            f'chunk size: 1024\n\t'
-            f'audio device index: {self.dev_index}')
-
-    def stop(self):
-        self.t.stop()
-        logging.debug('Stopping recording.')
-
-    def record(self):
-        stream = self.p.open(
-            format=paInt16,
-            channels=2,
-            rate=44100,
-            frames_per_buffer=1024,
-            input=True,
-            input_device_index=self.dev_index
-        )
-
-        # 1 sec = 43.1 frames
-        while not self.t.stopped():
-            data = stream.read(1024)
-            self.frames.append(data)
-
-            if len(self.frames) > self.duration:
-                self.frames = self.frames[43:]
-
-    def is_recording(self):
-        return self.t.is_alive()
-
-    def save(self):
-        if not self.t.is_alive(): return
-
-        if not os.path.exists(rec_dir):
-            os.makedirs(rec_dir)
-
-        frames_to_save = self.frames.copy()
-        filepath = os.path.join(rec_dir, f'{recording_file_name.get()}{self.get_latest_recording_no()}.wav')
-
-        logging.debug(f'Creating wav file: {filepath}')
-        wf = wave.open(filepath, 'wb')
-        wf.setnchannels(2)
-        wf.setsampwidth(self.p.get_sample_size(paInt16))
-        wf.setframerate(44100)
-        wf.writeframes(b''.join(frames_to_save))
-        wf.close()
-        logging.debug('File exported successfully.')
-
-    @staticmethod
-    def get_latest_recording_no():
-        recs = os.listdir(rec_dir)
-
-        if not recs: return 1
-        numbers = []
-        for rec in recs:
-            match = re.match(rf'^.*(\d+)\.wav$', rec)
-            if match:
-                numbers.append(int(match.group(1)))
-
-        return max(numbers) + 1
+def save_recording():
+    if not recorder.is_recording(): return
+
+    recorder.save(recording_index.next_path(rec_state.file_name))
 
 
 # todo: finish this
@@ -260,118 +496,388 @@ def open_rec_menu():
         recorder_window = tk.Toplevel(root)
 
         recorder_window.title("Recording Menu")
-        recorder_window.geometry("300x200")
+        recorder_window.geometry("300x230")
+
+        # the window's own variables, what they are set to goes to the recording state
+        continuous = tk.BooleanVar(recorder_window, value=rec_state.continuous)
+        file_name = tk.StringVar(recorder_window, value=rec_state.file_name)
+        file_name.trace_add('write', lambda *args: setattr(rec_state, 'file_name', file_name.get()))
 
         tk.Label(recorder_window, textvariable=rec_text).pack()
         tk.Button(recorder_window, command=start_recording, text="Start Recording", padx=10).pack()
         tk.Button(recorder_window, command=stop_recording, text="Stop Recording", padx=10).pack()
-        tk.Button(recorder_window, command=lambda: recorder.save(), text="Save Recording", padx=10).pack()
+        tk.Button(recorder_window, command=save_recording, text="Save Recording", padx=10).pack()
+        ttk.Checkbutton(recorder_window, text="Continuous recording to disk", variable=continuous, onvalue=1, offvalue=0,
+                        command=lambda: setattr(rec_state, 'continuous', continuous.get())).pack()
+        tk.Button(recorder_window, command=measure_latency, text="Measure Output Latency", padx=10).pack()
 
         tk.Label(recorder_window, text='').pack()
         tk.Label(recorder_window, text='File Name').pack()
-        tk.Entry(recorder_window, textvariable=recording_file_name).pack()
+        tk.Entry(recorder_window, textvariable=file_name).pack()
     else:
         showerror('Recorder Unusable', 'Due to the Stereo Mix device being unavailable, the recorder cannot be used.')
 
 
+def set_rec_text(text):
+    if root is not None:
+        root.after(0, rec_text.set, text)
+
+
 def start_recording():
-    recorder.start()
-    rec_text.set('Recording')
+    """ Starts the recorder, returns False if its input device isn't there. """
+    if not recorder.usable:
+        logging.warning(f'Could not start recording, {recorder.device_name} was not found.')
+        return False
+
+    if rec_state.continuous:
+        recorder.start(recorder.new_writer(
+            recording_index,
+            rec_state.file_name,
+            segment_seconds=int(os.environ.get('REC_SEGMENT_SECONDS', 600)),
+            segment_bytes=int(os.environ.get('REC_SEGMENT_MB', 0)) * 1024 * 1024,
+            max_queue=int(os.environ.get('REC_QUEUE_CHUNKS', 256))
+        ))
+    else:
+        recorder.start()
+    set_rec_text('Recording')
     assert recorder.is_recording()
+    return True
 
 
 def stop_recording():
     recorder.stop()
-    rec_text.set('Not Recording')
+    set_rec_text('Not Recording')
 
 
-def play(sfx):
-    if simultaneous.get():
-        def play_nested():
-            channel = pygame.mixer.find_channel()
-            channel.set_volume(volume.get() / 100)
-            channel.play(pygame.mixer.Sound('sfx/' + sfx), loops=(999 if loop.get() else 0))
-        threading.Thread(target=play_nested).start()
-    else:
-        pygame.mixer.music.unload()
-        pygame.mixer.music.load('sfx/' + sfx)
-        pygame.mixer.music.play(loops=(999 if loop.get() else 0))
+def instant_replay():
+    if not recorder.is_recording():
+        logging.warning('Instant replay needs the recorder to be running.')
+        return
 
+    # copy out of the ring buffer right away, before the recorder overwrites it
+    wav = recorder.snapshot_wav(replay_seconds)
+    dispatcher.submit(_add_replay, wav)
 
-def stop():
-    for i in range(0, (channel_amount + 1)):
-        try:
-            pygame.mixer.Channel(i).stop()
-        except IndexError:
-            continue
 
-    pygame.mixer.music.stop()
-    assert not pygame.mixer.get_busy()
+def replay_callback(i):
+    return lambda event: play_replay(i)
 
 
-def pause():
-    for i in range(0, (channel_amount + 1)):
-        try:
-            pygame.mixer.Channel(i).pause()
-        except IndexError:
-            continue
+def free_replay_key(banks):
+    """ The first key no sfx in any bank and no other replay is using, or None. """
+    used = set(replay_keys).union(*banks.values())
+    return next((key for key in range(len(bindable_chars)) if key not in used), None)
 
-    pygame.mixer.pause()
-    assert pygame.mixer.get_busy()
 
+def move_replays(banks):
+    """ Replays whose key an sfx has been given since move to another free key, sfx always get their slot. """
+    taken = set().union(*banks.values())
+    for key in sorted(set(replay_keys) & taken):
+        i = replay_keys.pop(key)
+        new = free_replay_key(banks)
+        if new is None:
+            logging.warning(f'alt+{bindable_chars[key]} now plays an sfx and there is no free key left for '
+                            f'replay {i + 1}, alt+f2 still plays the latest replay.')
+        else:
+            replay_keys[new] = i
+            logging.warning(f'alt+{bindable_chars[key]} now plays an sfx, replay {i + 1} moved to '
+                            f'alt+{bindable_chars[new]}.')
+
+
+def play_replay(i):
+    if not replays:
+        logging.warning('There are no replays yet, capture one with alt+f1.')
+        return
+
+    dispatcher.submit(_play_sound, replays[i], state.gain, state.loops)
+
+
+def measure_latency():
+    if not recorder.usable:
+        showerror('Recorder Unusable', 'Measuring the output latency needs the Stereo Mix device to hear the output.')
+        return
+
+    freq, size, channels = pygame.mixer.get_init()
+    click = pygame.mixer.Sound(buffer=click_samples(freq, channels))
+
+    def measure_nested():
+        # the click goes through the same dispatcher and voices as a hotkey press
+        latency = measure_loopback(recorder.p, recorder.dev_index, lambda: play_sound(click),
+                                   rate=recorder.rate, channels=recorder.channels)
+        if latency is None:
+            message = 'The click was not heard, is the output device the one Stereo Mix records?'
+        else:
+            message = (f'Trigger to output latency: {latency * 1000:.1f} ms '
+                       f'(mixer buffer: {audio_buffer / freq * 1000:.1f} ms)')
+        logging.info(message)
+        set_rec_text(message)
+
+    threading.Thread(target=measure_nested, daemon=True).start()
+
+
+def play_sound(sound):
+    dispatcher.submit(_play_sound, sound, state.gain, 0)
 
-def unpause():
-    for i in range(0, (channel_amount + 1)):
-        try:
-            pygame.mixer.Channel(i).unpause()
-        except IndexError:
-            continue
 
-    pygame.mixer.unpause()
-    assert pygame.mixer.get_busy()
+def play(sfx, pressed=None):
+    return dispatcher.submit(_play, sfx, state.simultaneous, state.gain, state.loops, pressed)
+
+
+def dump_metrics():
+    metrics.dump(os.path.join(cache_dir, 'metrics.json'))
+
+
+def stop():
+    dispatcher.submit(_stop)
+
+
+def pause():
+    dispatcher.submit(_pause)
+
+
+def unpause():
+    dispatcher.submit(_unpause)
 
 
 def random_sound():
-    sfx = random.choice(get_sfx())
-    play(sfx[0])
+    files = library.files()
+    if files:
+        file = random.choice(files)
+        play(file)
+        return file
 
 
 def change_volume(vol: str):
-    for i in range(0, (channel_amount + 1)):
-        try:
-            pygame.mixer.Channel(i).set_volume(int(vol) / 100)
-        except IndexError:
-            continue
+    state.volume = int(vol)
+    dispatcher.submit(_change_volume, state.gain)
+
 
-    pygame.mixer.music.set_volume(int(vol) / 100)
+def output_devices():
+    """ The names of the output devices, listed on first use since that can take a while. """
+    global outputs
+    if outputs is None:
+        outputs = pygame._sdl2.audio.get_audio_device_names(False)
+    return outputs
 
 
 def change_device(event):
-    logging.debug(f'Changing device to: {event.widget.get()}')
+    dispatcher.submit(_change_device, event.widget.get(), state.gain)
+
+
+def change_monitor(event):
+    dispatcher.submit(_change_monitor, event.widget.get())
+
+
+# the functions below touch the mixer and only run on the dispatcher thread
+
+def _play(sfx, simultaneous_playback, vol, loops, pressed=None):
+    global music_gain
+
+    # turning a sound down is its own volume, turning it up was done to its samples by load_sound(),
+    # the channel volume stays the volume slider
+    level = analyzer.gain(sfx) if analyzer is not None else 1.0
+    gain = min(level, 1.0)
+    if simultaneous_playback:
+        start = time.perf_counter()
+        sound = sound_cache.get(os.path.join(sfx_dir, sfx))
+        loaded = time.perf_counter()
+        metrics.record('play.load', loaded - start, sfx)
+        sound.set_volume(gain)
+        voices.play(sfx, sound, vol, loops, level=level)
+        metrics.since('play.start', loaded)
+    else:
+        start = time.perf_counter()
+        # music is streamed from the file, so quiet sounds can't be made louder here
+        music_gain = gain
+        pygame.mixer.music.unload()
+        pygame.mixer.music.load(os.path.join(sfx_dir, sfx))
+        pygame.mixer.music.set_volume(vol * music_gain)
+        pygame.mixer.music.play(loops=loops, start=analyzer.trim_seconds(sfx) if analyzer is not None else 0.0)
+        metrics.since('play.music', start, sfx)
+
+    if pressed is not None:
+        metrics.since('press_to_play', pressed, sfx)
+
+
+def _play_sound(sound, vol, loops):
+    voices.play(sound, sound, vol, loops)
+
+
+def _add_replay(wav):
+    # pygame closes the file it loads from, the bytes are kept for saving
+    data = wav.getvalue()
+    replays.append(pygame.mixer.Sound(file=wav))
+    i = len(replays) - 1
+
+    # bind it to the first key no sfx in any bank is using, alt+f2 always plays the latest one anyway
+    with replay_lock:
+        key = free_replay_key(get_banks())
+        if key is not None:
+            replay_keys[key] = i
+    if key is not None:
+        hotkey = ['alt', bindable_chars[key]]
+        result = hk.register_many([(hotkey, replay_callback(i))], overwrite=True, atomic=False)
+        if result.registered:
+            logging.info(f'Replay {i + 1} captured, play it with alt+{bindable_chars[key]} or alt+f2.')
+    else:
+        logging.info(f'Replay {i + 1} captured, play it with alt+f2.')
+
+    def persist():
+        path = recording_index.next_path('replay')
+        with open(path, 'wb') as f:
+            f.write(data)
+        logging.debug(f'Saved replay {i + 1} to {path}')
+
+    threading.Thread(target=persist, daemon=True).start()
+
+
+def _stop():
+    voices.stop()
+    pygame.mixer.music.stop()
+    assert not pygame.mixer.get_busy()
+
+
+def _pause():
+    voices.pause()
+
+
+def _unpause():
+    voices.unpause()
+
+
+def _change_volume(vol):
+    voices.set_gain(vol)
+    pygame.mixer.music.set_volume(vol * music_gain)
+
+
+def _change_device(devicename, vol):
+    logging.debug(f'Changing device to: {devicename}')
+    freq, size, channels = pygame.mixer.get_init()
+
+    # the mixer is reopened in the same format, so decoded sounds only have to be copied over, not decoded again
+    sounds = sound_cache.export(lambda sound: sound.get_raw())
+    replay_samples = [replay.get_raw() for replay in replays]
+
+    # voices on the software mixer don't depend on pygame's device and keep playing
+    if soft_mixer is None:
+        voices.stop()
     pygame.mixer.quit()
-    pygame.mixer.init(devicename=event.widget.get())
-    pygame.mixer.music.set_volume(volume.get() / 100)
+    pygame.mixer.init(freq, size, channels, audio_buffer, devicename=devicename)
+    pygame.mixer.set_num_channels(channel_amount)
+    pygame.mixer.music.set_volume(vol * music_gain)
+
+    sound_cache.restore(sounds, lambda raw: pygame.mixer.Sound(buffer=raw))
+    replays[:] = [pygame.mixer.Sound(buffer=raw) for raw in replay_samples]
+    logging.debug(f'Moved {len(sounds)} cached sounds and {len(replays)} replays to {devicename}')
+
+    if soft_mixer is not None:
+        soft_mixer.start(devicename)
+
+
+def _change_monitor(devicename):
+    if devicename == 'None':
+        soft_mixer.remove_monitor()
+    else:
+        soft_mixer.add_monitor(devicename)
 
 
 def save_callback(entry, window):
-    recording_file_name.set(entry.get())
+    rec_state.file_name = entry.get()
     window.destroy()
 
 
-def on_closing():
-    def destroy():
-        pygame.mixer.quit()
-        pygame.quit()
-        root.destroy()
+def shutdown():
+    if control_server is not None:
+        control_server.stop()
+        logging.debug(f'Control server: {control_server.stats()}')
+    library.stop_watching()
+    if recorder.is_recording():
+        recorder.stop()
+        recorder.join()
+    dispatcher.stop(timeout=1)
+    recorder.terminate()
+    if analyzer is not None:
+        analyzer.shutdown()
+    if underrun_watch is not None:
+        underrun_watch.stop()
+    if soft_mixer is not None:
+        logging.debug(f'Software mixer: {soft_mixer.stats()}')
+        soft_mixer.close()
+    logging.debug(f'Sound cache: {sound_cache.stats()}')
+    logging.debug(f'Audio dispatcher: {dispatcher.stats()}')
+    logging.debug(f'Voices: {voices.stats()}')
+    if hotkey_measure:
+        logging.info(f'Hotkey dispatch latency: {hk.dispatch_report()}')
+    if debug:
+        dump_metrics()
+    pygame.mixer.quit()
+    pygame.quit()
+
 
+def on_closing():
     if recorder.is_recording():
-        if askyesno(title='Confirm Exit', message='You are still recording. Are you sure you want to quit?'):
-            recorder.stop()
-            while recorder.is_recording():
-                continue
-            destroy()
-    else:
-        destroy()
+        if not askyesno(title='Confirm Exit', message='You are still recording. Are you sure you want to quit?'):
+            return
+
+    shutdown()
+    root.destroy()
+
+
+def run_headless():
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+
+    logging.info(f'Running without a window, {len(library)} sfx loaded. Stop with SIGINT or SIGTERM.')
+    # a timeout keeps the main thread responsive to signals everywhere
+    while not stopping.wait(1):
+        pass
+
+    logging.info('Shutting down...')
+    shutdown()
+
+
+default_envvars = (
+    'CHANNELS_AMT=256',
+    'AUDIO_RATE=44100',
+    'AUDIO_CHANNELS=2',
+    'AUDIO_BUFFER=512',
+    'SOUND_CACHE_MB=128',
+    'PCM_CACHE_MB=1024',
+    'DISPATCH_QUEUE=64',
+    'DISPATCH_OVERFLOW=drop_oldest',
+    'VOLUME=50',
+    'LOOP=n',
+    'SIMULTANEOUS_PLAYBACK=y',
+    'MIXER_BACKEND=pygame',
+    'MONITOR_DEVICE=',
+    'MAX_VOICES=64',
+    'VOICES_PER_SOUND=4',
+    'RETRIGGER=overlap',
+    'VOICE_STEALING=oldest',
+    'LOUDNESS_NORMALIZE=y',
+    'LOUDNESS_TARGET=-16',
+    'LOUDNESS_MAX_GAIN_DB=12',
+    'TRIM_SILENCE=y',
+    'TRIM_THRESHOLD_DB=-50',
+    'ANALYSIS_WORKERS=0',
+    'HOTKEY_MEASURE=n',
+    'CONTROL_SOCKET=',
+    'LIBRARY_POLL_SECONDS=1',
+    'SOUND_BANKS=4',
+    'REC_DEVICE=Stereo Mix (Realtek(R) Audio)',
+    'REC_RATE=44100',
+    'REC_CHANNELS=2',
+    'REC_CHUNK=1024',
+    'REC_SEGMENT_SECONDS=600',
+    'REC_SEGMENT_MB=0',
+    'REC_QUEUE_CHUNKS=256',
+    'REC_VERBOSE=n',
+    'REC_AUTOSTART=n',
+    'REC_CONTINUOUS=n',
+    'REPLAY_SECONDS=5',
+    'DEBUG=n',
+)
 
 
 def get_envvars():
@@ -395,84 +901,295 @@ def get_envvars():
                 os.environ[key] = value
     else:
         with open('.env', 'w') as write:
-            write.write('CHANNELS_AMT=256\nREC_VERBOSE=n\nDEBUG=n')
+            write.write('\n'.join(default_envvars))
         get_envvars()
 
 
 def init():
-    global sound_grid
+    global sound_cache, dispatcher, hk, soft_mixer, voices, analyzer, audio_buffer, underrun_watch, \
+        control_server, output_device
 
     logging.debug('Initializing...')
 
-    # initialize modules pygame modules
-    pygame.init()
-
-    # set audio output device to vb cable if installed
-    if 'CABLE Input (VB-Audio Virtual Cable)' in outputs:
-        logging.debug('Using VB-Audio Virtual Cable')
+    # only the mixer is needed, pygame.init() would start every pygame module
+    rate = int(os.environ.get('AUDIO_RATE', 44100))
+    channels = int(os.environ.get('AUDIO_CHANNELS', 2))
+    audio_buffer = fix_buffer(int(os.environ.get('AUDIO_BUFFER', 512)))
+    output_device = devicename = open_mixer(rate, channels, audio_buffer)
+    startup.mark('mixer')
+
+    # the settings are checked against the device the mixer got, nothing has used it yet so it can be reopened.
+    # this starts PyAudio, so the recorder doesn't have to when it is first opened
+    checked = validate_output(recorder.p, devicename, rate, channels, audio_buffer)
+    if checked != (rate, channels, audio_buffer):
+        rate, channels, audio_buffer = checked
         pygame.mixer.quit()
-        pygame.mixer.init(devicename='CABLE Input (VB-Audio Virtual Cable)')
-    else:
-        logging.warning('VB Audio Virtual Cable was not found on your system.')
-        pygame.mixer.init()
+        pygame.mixer.init(rate, -16, channels, audio_buffer, devicename=devicename)
+    startup.mark('output check')
+
+    freq, size, mixer_channels = pygame.mixer.get_init()
+    logging.info(f'Audio output: {freq} Hz, {mixer_channels} channels, {audio_buffer} frame buffer '
+                 f'({audio_buffer / freq * 1000:.1f} ms)')
 
-    pygame.mixer.music.set_volume(0.5)
+    pygame.mixer.music.set_volume(state.gain)
     pygame.mixer.set_num_channels(int(os.environ['CHANNELS_AMT']))
 
+    if os.environ.get('MIXER_BACKEND', 'pygame') == 'numpy':
+        try:
+            soft_mixer = SoftwareMixer(freq, mixer_channels, audio_buffer)
+            soft_mixer.start(devicename)
+            if os.environ.get('MONITOR_DEVICE'):
+                soft_mixer.add_monitor(os.environ['MONITOR_DEVICE'])
+        except (RuntimeError, OSError) as e:
+            logging.warning(f'Could not start the software mixer ({e}), using pygame channels instead.')
+            soft_mixer = None
+    elif os.environ.get('MONITOR_DEVICE'):
+        logging.warning('MONITOR_DEVICE needs MIXER_BACKEND=numpy, pygame can only play on one device.')
+
+    if soft_mixer is not None:
+        # a view of the sound's own samples, nothing is copied
+        backend = SoftwareBackend(soft_mixer, pygame.sndarray.samples, gain_of=lambda sound: sound.get_volume())
+        max_voices = int(os.environ.get('MAX_VOICES', 64))
+    else:
+        backend = ChannelBackend()
+        max_voices = min(int(os.environ.get('MAX_VOICES', 64)), channel_amount)
+    voices = VoiceManager(
+        backend,
+        max_voices=max_voices,
+        per_sound=int(os.environ.get('VOICES_PER_SOUND', 4)),
+        retrigger=os.environ.get('RETRIGGER', 'overlap'),
+        steal=os.environ.get('VOICE_STEALING', 'oldest')
+    )
+
+    startup.mark('voices')
+
+    # loudness and leading silence are measured once per file and version, after that they are dict lookups
+    pcm_cache_size = int(os.environ.get('PCM_CACHE_MB', 1024)) * 1024 * 1024
+    pcm_cache = None
+    if pcm_cache_size:
+        pcm_cache = PcmDiskCache(os.path.join(cache_dir, 'pcm'), pcm_cache_size)
+        decode = pcm_cache.load
+    else:
+        decode = pygame.mixer.Sound
+
+    normalize = os.environ.get('LOUDNESS_NORMALIZE', 'y').startswith('y')
+    trim = os.environ.get('TRIM_SILENCE', 'y').startswith('y')
+    if normalize or trim:
+        try:
+            analyzer = LibraryAnalyzer(
+                sfx_dir,
+                os.path.join(cache_dir, 'analysis.json'),
+                lambda path: (pygame.sndarray.samples(decode(path)), pygame.mixer.get_init()[0]),
+                normalize=normalize,
+                target_lufs=float(os.environ.get('LOUDNESS_TARGET', -16)),
+                max_gain_db=float(os.environ.get('LOUDNESS_MAX_GAIN_DB', 12)),
+                trim_threshold_db=float(os.environ.get('TRIM_THRESHOLD_DB', -50)) if trim else None,
+                workers=int(os.environ.get('ANALYSIS_WORKERS', 0)) or None,
+                on_update=on_analysis_update
+            )
+        except RuntimeError as e:
+            logging.info(f'Not analyzing the library: {e}')
+
+    sound_cache = SoundCache(int(os.environ.get('SOUND_CACHE_MB', 128)) * 1024 * 1024,
+                             loader=lambda path: load_sound(decode, path))
+    startup.mark('caches')
+
+    # every mixer call goes through one worker so bursts of presses don't spawn a thread each
+    dispatcher = AudioDispatcher(int(os.environ.get('DISPATCH_QUEUE', 64)), os.environ.get('DISPATCH_OVERFLOW', 'drop_oldest'), metrics)
+
+    # pygame doesn't report underruns, the software mixer does and gets a bigger block when it keeps running dry
+    if soft_mixer is not None:
+        underrun_watch = UnderrunWatch(soft_mixer, resize=lambda block: dispatcher.submit(soft_mixer.resize, block))
+        underrun_watch.start()
+
     logging.debug('Registering keybinds...')
-    keybind_listener()
-    logging.debug('Done!')
+    hk = keybind_listener()
+    startup.mark('hotkeys')
+    # a press is played from here on, anything not loaded yet is decoded on demand
+    playable = startup.milestone('first playable hotkey')
+    logging.debug(f'Done! Hotkeys are live {playable * 1000:.0f} ms after start.')
+
+    # everything below only makes things faster or checks them and happens in the background
+    warm_thread = sound_cache.warm([library.path(file) for file in library.files()])
+    if startup_report:
+        def report_warm_up():
+            warm_thread.join()
+            logging.info(f'Sound warm-up done {startup.milestone("warm-up done") * 1000:.1f} ms after start.')
+        threading.Thread(target=report_warm_up, daemon=True).start()
+    background = [warm_thread]
+    if analyzer is not None:
+        background.append(analyzer.update(library.files()))
+    if pcm_cache is not None:
+        background.append(threading.Thread(target=pcm_cache.prune, daemon=True))
+        background[-1].start()
+    if hotkey_measure:
+        def report_idle_cpu():
+            # the sample covers the whole process, so it waits for the startup work to be done
+            for thread in background:
+                if thread is not None:
+                    thread.join()
+            logging.info(f'Idle CPU use with the hotkey listener running: {hk.measure_idle_cpu()}%')
+        threading.Thread(target=report_idle_cpu, daemon=True).start()
+    if os.environ.get('REC_AUTOSTART', 'n').startswith('y'):
+        # e.g. so instant replay works without a window to start the recorder from
+        threading.Thread(target=start_recording, daemon=True).start()
+
+    library.add_listener(on_library_change)
+    library.watch(float(os.environ.get('LIBRARY_POLL_SECONDS', 1)))
+
+    if os.environ.get('CONTROL_SOCKET'):
+        try:
+            control_server = ControlServer(control_commands(), os.environ['CONTROL_SOCKET'])
+            control_server.start()
+        except (OSError, ValueError) as e:
+            logging.warning(f'Could not start the control server on {os.environ["CONTROL_SOCKET"]}: {e}')
+            control_server = None
+    startup.mark('background start')
+
+
+def open_mixer(rate, channels, buffer):
+    """ Opens the mixer on VB-Audio Virtual Cable if it is installed, else on the default output device.
+
+    Returns the device name, None for the default. SDL falls back to a rate and channel count the device
+    supports by itself, so nothing has to be enumerated first.
+    """
+    try:
+        pygame.mixer.init(rate, -16, channels, buffer, devicename=cable_device)
+        logging.debug('Using VB-Audio Virtual Cable')
+        return cable_device
+    except pygame.error:
+        logging.warning('VB Audio Virtual Cable was not found on your system.')
+        pygame.mixer.init(rate, -16, channels, buffer)
+        return None
+
+
+def report_startup():
+    logging.info('Startup profile:\n' + startup.report())
+
+
+def build_window():
+    global control_grid
 
     root.title("Soundboard")
-    root.geometry('600x320')
+    root.geometry('600x350')
     root.resizable(width=False, height=False)
 
     root.columnconfigure(1, weight=1)
+    root.rowconfigure(0, weight=1)
 
-    ControlGrid(root, text="Controls").grid(row=0, column=0, sticky='nesw', padx=5, pady=10, ipadx=5, ipady=5)
+    control_grid = ControlGrid(root, text="Controls")
+    control_grid.grid(row=0, column=0, sticky='nesw', padx=5, pady=10, ipadx=5, ipady=5)
     sound_grid.grid(row=0, column=1, sticky='nesw', padx=5, pady=10)
 
     root.protocol("WM_DELETE_WINDOW", on_closing)
 
 
 def refresh_sound_grid():
-    sound_grid.grid_forget()
-    new_grid = SoundGrid(root, text=f'Sounds ({len(get_sfx())}/{len(bindable_chars)})')
-    new_grid.grid(row=0, column=1, sticky='nesw', padx=5, pady=10)
+    # changes are normally picked up by the watcher already, this catches anything it missed
+    logging.debug(f'Rescanned sfx folder: {library.scan()}')
 
 
 if __name__ == "__main__":
-    if os.name != 'nt':
-        raise RuntimeError('This program does not (officially) support any platform other than Windows.')
-
-    root = tk.Tk()
+    parser = argparse.ArgumentParser(description='A simple soundboard.')
+    parser.add_argument('--headless', action='store_true',
+                        help='run the hotkeys, mixer and recorder without a window, e.g. as a Linux daemon')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='log how long each part of startup took once the soundboard is ready')
+    args = parser.parse_args()
+    startup = StartupProfile(started)
+    startup_report = args.profile_startup
+    startup.mark('imports')
+
+    if os.name != 'nt' and not args.headless:
+        raise RuntimeError('This program does not (officially) support any platform other than Windows. '
+                           'On Linux it can run with --headless.')
+
+    root = None
+    sound_grid = None
+    control_grid = None
+    if not args.headless:
+        root = tk.Tk()
+
+        # window only variables
+        rec_text = tk.StringVar(value='Not Recording')
+        sound_error_text = tk.StringVar(value='No sound effects!')
+        bank_text = tk.StringVar(value='Bank 1 (alt+f3)')
 
     # global variables
-    volume = tk.IntVar(value=50)
-    loop = tk.BooleanVar(value=False)
-    simultaneous = tk.BooleanVar(value=True)
-    rec_text = tk.StringVar(value='Not Recording')
-    recording_file_name = tk.StringVar(value='recording')
-    sound_error_text = tk.StringVar(value='No sound effects!')
-
     sfx_dir = os.path.join(os.getcwd(), 'sfx')
-    rec_dir = os.path.join(os.getcwd(), 'recordings')
-
-    outputs = pygame._sdl2.audio.get_audio_device_names(False)  # gets output devices
     bindable_chars = '567890qwertyuiopasdfghjklzxcvbnm'
-    sound_grid = SoundGrid(root, text=f'Sounds ({len(get_sfx())}/{len(bindable_chars)})')
+    rec_dir = os.path.join(os.getcwd(), 'recordings')
+    recording_index = RecordingIndex(rec_dir)
+    replays = []
+    soft_mixer = None
+    analyzer = None
+    underrun_watch = None
+    control_server = None
+    audio_buffer = 512
+    music_gain = 1.0
+    replay_keys = {}  # bindable_chars index -> replay number, an sfx given the key moves it, see move_replays()
+    replay_lock = threading.Lock()
+    active_bank = 0
+    cache_dir = os.path.join(os.getcwd(), 'cache')
+    cable_device = 'CABLE Input (VB-Audio Virtual Cable)'
+    output_device = None
+    outputs = None  # output device names, see output_devices()
+
+    created_sfx_dir = not os.path.exists(sfx_dir)
+    if created_sfx_dir:
+        os.mkdir(sfx_dir)
+        if root is not None:
+            sound_error_text.set('No sound effects! SFX folder has been created.')
 
     get_envvars()
+    debug = os.environ['DEBUG'].startswith('y')
+    state = PlaybackState(
+        volume=min(max(int(os.environ.get('VOLUME', 50)), 0), 100),
+        loop=os.environ.get('LOOP', 'n').startswith('y'),
+        simultaneous=os.environ.get('SIMULTANEOUS_PLAYBACK', 'y').startswith('y')
+    )
 
     logging.basicConfig(
-        level=logging.DEBUG if os.environ['DEBUG'].startswith('y') else logging.INFO,
+        level=logging.DEBUG if debug else logging.INFO,
         format='[%(asctime)s][%(levelname)s] %(message)s',
         handlers=[logging.StreamHandler(sys.stdout)]
     )
 
     channel_amount = int(os.environ['CHANNELS_AMT'])
+    sound_banks = max(1, int(os.environ.get('SOUND_BANKS', 4)))
+    hotkey_measure = os.environ.get('HOTKEY_MEASURE', 'n').startswith('y')
     recorder_verbose = os.environ['REC_VERBOSE'].startswith('y')
-    recorder = Recorder(duration=10, verbose=recorder_verbose)
+    replay_seconds = float(os.environ.get('REPLAY_SECONDS', 5))
+    rec_state = RecordingState(continuous=os.environ.get('REC_CONTINUOUS', 'n').startswith('y'))
+    recorder = Recorder(
+        duration=10,
+        rate=int(os.environ.get('REC_RATE', 44100)),
+        channels=int(os.environ.get('REC_CHANNELS', 2)),
+        chunk=int(os.environ.get('REC_CHUNK', 1024)),
+        device_name=os.environ.get('REC_DEVICE', 'Stereo Mix (Realtek(R) Audio)'),
+        verbose=recorder_verbose
+    )
+
+    if created_sfx_dir:
+        logging.info(f'Created {sfx_dir}, put sound effects there.')
+    startup.mark('config')
 
-    init()
-    root.mainloop()
+    library = SoundLibrary(sfx_dir, len(bindable_chars) * sound_banks)
+    library.scan()
+    startup.mark('library scan')
+
+    if args.headless:
+        init()
+        if startup_report:
+            report_startup()
+        run_headless()
+    else:
+        sound_grid = SoundGrid(root)
+        startup.mark('sound grid')
+        init()
+        build_window()
+        startup.mark('window')
+        if startup_report:
+            # the window is usable once Tk has drawn it and is idle
+            root.after_idle(lambda: (startup.mark('first draw'), report_startup()))
+        root.mainloop()
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# sounds can be decoded and mixed without an audio device
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+
+@pytest.fixture
+def mixer():
+    """ pygame's mixer opened in a known format: 44100 Hz, 16 bit, stereo. """
+    pygame = pytest.importorskip('pygame')
+    pygame.mixer.init(44100, -16, 2, 512)
+    try:
+        yield pygame.mixer
+    finally:
+        pygame.mixer.quit()
@@ -0,0 +1,33 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from analysis import apply_gain, leading_silence, loudness
+
+
+def tone(seconds=1.0, rate=44100, amplitude=0.1, channels=2):
+    t = np.arange(int(seconds * rate)) / rate
+    mono = (np.sin(2 * np.pi * 1000 * t) * amplitude * 32767).astype(np.int16)
+    return np.repeat(mono[:, None], channels, axis=1)
+
+
+def test_apply_gain_boosts_and_clips():
+    samples = np.array([[100, -100], [20000, -20000]], dtype=np.int16)
+    boosted = apply_gain(samples, 2.0)
+    assert boosted.dtype == np.int16
+    assert boosted.tolist() == [[200, -200], [32767, -32768]]
+    # the input is left alone, it may be a view of a cached sound
+    assert samples.tolist() == [[100, -100], [20000, -20000]]
+
+
+def test_apply_gain_raises_loudness_by_the_gain():
+    quiet = tone(amplitude=0.05)
+    before = loudness(quiet, 44100)['lufs']
+    after = loudness(apply_gain(quiet, 10 ** (6 / 20)), 44100)['lufs']
+    assert after - before == pytest.approx(6, abs=0.1)
+
+
+def test_leading_silence():
+    samples = np.concatenate([np.zeros((4410, 2), dtype=np.int16), tone(0.1)])
+    assert leading_silence(samples, 44100) == pytest.approx(0.1, abs=0.001)
+    assert leading_silence(np.zeros((100, 2), dtype=np.int16), 44100) == pytest.approx(100 / 44100)
@@ -0,0 +1,143 @@
+import time
+import threading
+
+import pytest
+
+from audio_dispatcher import AudioDispatcher
+from instrumentation import Metrics
+
+
+class Gate:
+    """ A first job that holds the worker until the test opens it, so the queue fills up behind it. """
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.opened = threading.Event()
+
+    def hold(self):
+        self.entered.set()
+        self.opened.wait(5)
+
+
+def blocked_dispatcher(maxsize, overflow, **kwargs):
+    gate = Gate()
+    dispatcher = AudioDispatcher(maxsize, overflow, **kwargs)
+    dispatcher.submit(gate.hold)
+    assert gate.entered.wait(5)
+    return dispatcher, gate
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.005)
+
+
+def test_unknown_policy_and_size_are_rejected():
+    with pytest.raises(ValueError):
+        AudioDispatcher(4, 'drop_random')
+    with pytest.raises(ValueError):
+        AudioDispatcher(0)
+
+
+def test_drop_oldest():
+    dispatcher, gate = blocked_dispatcher(3, 'drop_oldest')
+    ran = []
+    results = [dispatcher.submit(ran.append, i) for i in range(5)]
+    gate.opened.set()
+    dispatcher.stop(5)
+
+    assert results == [True] * 5
+    assert ran == [2, 3, 4]
+    assert dispatcher.stats() == {
+        'depth': 0, 'max_depth': 3, 'submitted': 6, 'executed': 4, 'dropped': 2, 'errors': 0,
+    }
+
+
+def test_drop_newest():
+    dispatcher, gate = blocked_dispatcher(3, 'drop_newest')
+    ran = []
+    results = [dispatcher.submit(ran.append, i) for i in range(5)]
+    gate.opened.set()
+    dispatcher.stop(5)
+
+    assert results == [True, True, True, False, False]
+    assert ran == [0, 1, 2]
+    assert dispatcher.stats()['dropped'] == 2
+    assert dispatcher.stats()['max_depth'] == 3
+
+
+def test_block_waits_for_room():
+    dispatcher, gate = blocked_dispatcher(2, 'block')
+    ran = []
+    dispatcher.submit(ran.append, 0)
+    dispatcher.submit(ran.append, 1)
+
+    blocked = threading.Thread(target=dispatcher.submit, args=(ran.append, 2))
+    blocked.start()
+    time.sleep(0.05)
+    assert blocked.is_alive()
+    assert dispatcher.depth == 2
+
+    gate.opened.set()
+    blocked.join(5)
+    dispatcher.stop(5)
+    assert ran == [0, 1, 2]
+    assert dispatcher.stats()['dropped'] == 0
+    assert dispatcher.stats()['executed'] == 4
+
+
+def test_errors_are_counted_and_the_worker_goes_on():
+    def broken():
+        raise ValueError('boom')
+
+    metrics = Metrics()
+    dispatcher = AudioDispatcher(8, metrics=metrics)
+    ran = []
+    dispatcher.submit(broken)
+    dispatcher.submit(ran.append, 1)
+    dispatcher.stop(5)
+
+    assert ran == [1]
+    assert dispatcher.stats()['errors'] == 1
+    assert dispatcher.stats()['executed'] == 2
+    stages = metrics.snapshot()['stages']
+    assert stages['dispatch.wait']['count'] == 2
+    assert stages['dispatch.broken']['count'] == 1
+
+
+def test_stop_runs_what_is_queued_and_refuses_more():
+    dispatcher, gate = blocked_dispatcher(8, 'drop_oldest')
+    ran = []
+    for i in range(3):
+        dispatcher.submit(ran.append, i)
+    gate.opened.set()
+    dispatcher.stop(5)
+    assert ran == [0, 1, 2]
+    with pytest.raises(RuntimeError):
+        dispatcher.submit(ran.append, 3)
+
+
+def test_block_drops_a_job_waiting_when_stopped():
+    dispatcher, gate = blocked_dispatcher(1, 'block')
+    ran = []
+    dispatcher.submit(ran.append, 1)
+
+    results = []
+    waiting = threading.Thread(target=lambda: results.append(dispatcher.submit(ran.append, 2)))
+    waiting.start()
+    time.sleep(0.05)
+    assert waiting.is_alive()
+
+    stopper = threading.Thread(target=dispatcher.stop)
+    stopper.start()
+    wait_for(lambda: not waiting.is_alive())
+    gate.opened.set()
+    stopper.join(5)
+
+    assert results == [False]
+    assert ran == [1]
+    assert dispatcher.stats()['dropped'] == 1
+    assert dispatcher.stats()['executed'] == 2
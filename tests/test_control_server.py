@@ -0,0 +1,132 @@
+import os
+import socket
+import asyncio
+import threading
+
+import pytest
+
+from control_server import ControlServer, CommandError, parse_address
+
+unix_only = pytest.mark.skipif(os.name == 'nt', reason='needs Unix sockets')
+
+
+def make_server(address, **commands):
+    def fail(arg):
+        raise CommandError('nope')
+    return ControlServer({'echo': lambda arg: arg, 'fail': fail, **commands}, address)
+
+
+def test_parse_address():
+    assert parse_address('127.0.0.1:8765') == ('tcp', '127.0.0.1', 8765)
+    assert parse_address(':8765') == ('tcp', '127.0.0.1', 8765)
+    assert parse_address('/tmp/sb.sock') == ('unix', '/tmp/sb.sock', None)
+    assert parse_address('./a:1/sb.sock') == ('unix', './a:1/sb.sock', None)
+
+
+def test_text_and_json_replies():
+    server = make_server('127.0.0.1:0')
+    assert server.handle_line('') is None
+    assert server.handle_line('echo hello world').endswith(' "hello world"')
+    assert server.handle_line('fail').split(' ', 2)[::2] == ['error', 'nope']
+    assert server.handle_line('bogus').startswith('error ')
+    assert '"id": 7' in server.handle_line('{"id": 7, "cmd": "echo", "arg": 1}')
+    assert server.handle_line('[{"cmd": "echo"}, {"cmd": "fail"}]').count('"ok"') == 2
+    assert server.handled == 3 and server.errors == 3
+
+
+def test_tcp_round_trip():
+    server = make_server('127.0.0.1:0')
+    server.start()
+    try:
+        with socket.create_connection(('127.0.0.1', server.port), timeout=5) as client:
+            client.sendall(b'echo a\necho b\n')
+            reader = client.makefile()
+            replies = reader.readline(), reader.readline()
+        assert [reply.split(' ', 2)[2] for reply in replies] == ['"a"\n', '"b"\n']
+    finally:
+        server.stop()
+
+
+def test_slow_command_only_holds_up_its_own_client():
+    release = threading.Event()
+    server = make_server('127.0.0.1:0', wait=lambda arg: release.wait(5))
+    server.start()
+    try:
+        with socket.create_connection(('127.0.0.1', server.port), timeout=5) as slow, \
+                socket.create_connection(('127.0.0.1', server.port), timeout=5) as fast:
+            slow.sendall(b'wait\necho after\n')
+            fast.sendall(b'echo quick\n')
+            assert fast.makefile().readline().endswith('"quick"\n')
+            assert not release.is_set()
+
+            release.set()
+            reader = slow.makefile()
+            replies = reader.readline(), reader.readline()
+        assert [reply.split(' ', 2)[2] for reply in replies] == ['true\n', '"after"\n']
+    finally:
+        release.set()
+        server.stop()
+
+
+def test_windows_rejects_socket_paths(monkeypatch):
+    # os.name is restored right away, pytest itself needs the real one
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'name', 'nt')
+        try:
+            make_server('/tmp/sb.sock')
+            rejected = False
+        except ValueError:
+            rejected = True
+    assert rejected
+
+
+@unix_only
+def test_start_does_not_hang_on_unexpected_errors(tmp_path, monkeypatch):
+    monkeypatch.delattr(asyncio, 'start_unix_server')
+    server = make_server(str(tmp_path / 'sb.sock'))
+    thread = threading.Thread(target=lambda: pytest.raises(AttributeError, server.start), daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+@unix_only
+def test_does_not_delete_other_files(tmp_path):
+    path = tmp_path / '.env'
+    path.write_text('DEBUG=n\n')
+    with pytest.raises(OSError):
+        make_server(str(path)).start()
+    assert path.read_text() == 'DEBUG=n\n'
+
+
+@unix_only
+def test_does_not_take_over_a_live_socket(tmp_path):
+    path = str(tmp_path / 'sb.sock')
+    first = make_server(path)
+    first.start()
+    try:
+        with pytest.raises(OSError):
+            make_server(path).start()
+        assert os.path.exists(path)
+    finally:
+        first.stop()
+
+
+@unix_only
+def test_replaces_a_stale_socket(tmp_path):
+    path = str(tmp_path / 'sb.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()  # the file stays, nobody listens on it
+
+    server = make_server(path)
+    server.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(5)
+            client.connect(path)
+            client.sendall(b'echo x\n')
+            assert client.makefile().readline().endswith('"x"\n')
+    finally:
+        server.stop()
+    assert not os.path.exists(path)
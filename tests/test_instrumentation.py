@@ -0,0 +1,61 @@
+import pytest
+
+from instrumentation import Histogram, Metrics
+
+
+@pytest.mark.parametrize('us', range(0, 70))
+def test_bucket_contains_sample(us):
+    bucket = Histogram._bucket(us)
+    assert us < Histogram._upper_bound(bucket)
+    # the bucket below ends at or before the sample
+    lower = max((b for b in range(bucket) if b < 3 or b >= 12), default=None)
+    if lower is not None:
+        assert Histogram._upper_bound(lower) <= us
+
+
+def test_buckets_grow_monotonically():
+    bounds = [Histogram._upper_bound(b) for b in list(range(4)) + list(range(12, Histogram.BUCKETS))]
+    assert bounds == sorted(bounds)
+    assert len(set(bounds)) == len(bounds)
+
+
+@pytest.mark.parametrize('us', [0, 1, 2, 3, 4, 7, 8, 100, 10 ** 6])
+def test_summary_of_short_samples(us):
+    h = Histogram()
+    h.record(us / 1e6)
+    summary = h.summary()
+    assert summary['count'] == 1
+    assert summary['p50_ms'] == summary['max_ms'] == round(us / 1000, 3)
+
+
+def test_huge_sample_goes_in_last_bucket():
+    h = Histogram()
+    h.record(1e9)
+    assert h.counts[-1] == 1
+    assert h.percentile(99) == 1e9
+
+
+def test_percentile_is_within_a_bucket():
+    h = Histogram()
+    for us in range(1, 1001):
+        h.record(us / 1e6)
+    assert 500e-6 <= h.percentile(50) <= 500e-6 * 1.25
+    assert 990e-6 <= h.percentile(99) <= 1000e-6
+
+
+def test_metrics_dump_with_microsecond_samples(tmp_path):
+    metrics = Metrics()
+    metrics.record('hotkey.callback', 3e-6, key='a.wav')
+    metrics.count('hotkey.presses')
+    snapshot = metrics.dump(str(tmp_path / 'metrics.json'))
+    assert (tmp_path / 'metrics.json').exists()
+    assert snapshot['stages']['hotkey.callback']['count'] == 1
+    assert snapshot['counters'] == {'hotkey.presses': 1}
+
+
+def test_range_matches_the_docstring():
+    # 1 µs buckets below 4 µs, 29 quarter octave ones from 4 µs to 2^31 µs
+    assert Histogram._upper_bound(Histogram.BUCKETS - 1) == 2 ** 31
+    assert Histogram._bucket(2 ** 31 - 1) == Histogram.BUCKETS - 1
+    assert Histogram._bucket(7 << 28) == Histogram.BUCKETS - 1
+    assert Histogram._bucket((7 << 28) - 1) == Histogram.BUCKETS - 2
@@ -0,0 +1,128 @@
+import pytest
+
+pytest.importorskip('pyaudio')
+
+from latency import fix_buffer, validate_output, click_samples, UnderrunWatch, MIN_BUFFER, MAX_BUFFER  # noqa: E402
+
+
+@pytest.mark.parametrize('requested, fixed', [
+    (512, 512), (500, 512), (513, 1024), (1, MIN_BUFFER), (0, MIN_BUFFER), (-5, MIN_BUFFER),
+    (MAX_BUFFER, MAX_BUFFER), (MAX_BUFFER + 1, MAX_BUFFER), (10 ** 6, MAX_BUFFER),
+])
+def test_fix_buffer(requested, fixed):
+    assert fix_buffer(requested) == fixed
+
+
+def test_fix_buffer_warns_only_when_it_changes_something(caplog):
+    fix_buffer(256)
+    assert not caplog.records
+    fix_buffer(300)
+    assert 'using 512' in caplog.text
+
+
+class FakeAudio:
+    def __init__(self, max_channels=2, rates=(44100, 48000), default_rate=48000, broken=False):
+        self.dev = {'index': 3, 'name': 'Speakers', 'maxOutputChannels': max_channels,
+                    'defaultSampleRate': float(default_rate)}
+        self.rates = rates
+        self.broken = broken
+
+    def get_device_count(self):
+        return 1
+
+    def get_device_info_by_index(self, i):
+        return self.dev
+
+    def get_default_output_device_info(self):
+        if self.broken:
+            raise IOError('no default output device')
+        return self.dev
+
+    def is_format_supported(self, rate, **kwargs):
+        if rate not in self.rates:
+            raise ValueError('Invalid sample rate')
+        return True
+
+
+def test_validate_output_keeps_supported_settings():
+    assert validate_output(FakeAudio(), 'Speakers', 44100, 2, 512) == (44100, 2, 512)
+
+
+def test_validate_output_adjusts_unsupported_settings():
+    assert validate_output(FakeAudio(max_channels=1), None, 22050, 6, 300) == (48000, 1, 512)
+
+
+def test_validate_output_without_a_device_only_fixes_the_buffer():
+    assert validate_output(FakeAudio(broken=True), None, 22050, 6, 300) == (22050, 6, 512)
+
+
+def test_click_samples():
+    click = click_samples(1000, 2, seconds=0.01)
+    assert len(click) == 10 * 2 * 2
+
+
+class FakeMixer:
+    def __init__(self, block=256):
+        self.block = block
+        self.rate = 44100
+        self.underruns = 0
+
+    def resize(self, block):
+        self.block = block
+
+
+def test_underrun_watch_doubles_the_block_past_the_threshold():
+    mixer = FakeMixer()
+    watch = UnderrunWatch(mixer, threshold=3)
+
+    mixer.underruns += 2
+    watch.check()
+    assert mixer.block == 256
+
+    # only underruns since the last check count
+    mixer.underruns += 2
+    watch.check()
+    assert mixer.block == 256
+
+    mixer.underruns += 3
+    watch.check()
+    assert mixer.block == 512
+
+
+def test_underrun_watch_stops_at_the_max_block():
+    mixer = FakeMixer(block=1024)
+    watch = UnderrunWatch(mixer, threshold=1, max_block=2048)
+    for _ in range(3):
+        mixer.underruns += 5
+        watch.check()
+    assert mixer.block == 2048
+
+
+def test_underrun_watch_ignores_underruns_from_before_it_started():
+    mixer = FakeMixer()
+    mixer.underruns = 50
+    watch = UnderrunWatch(mixer, threshold=3)
+    watch.check()
+    assert mixer.block == 256
+
+
+def test_underrun_watch_hands_the_resize_over():
+    mixer = FakeMixer()
+    requested = []
+    watch = UnderrunWatch(mixer, threshold=1, resize=requested.append)
+    mixer.underruns += 1
+    watch.check()
+    assert requested == [512]
+    assert mixer.block == 256
+
+
+def test_underrun_watch_thread_checks_every_interval():
+    mixer = FakeMixer()
+    watch = UnderrunWatch(mixer, interval=0.01, threshold=1)
+    watch.start()
+    mixer.underruns += 1
+    watch.join(0.2)
+    watch.stop()
+    watch.join(1)
+    assert not watch.is_alive()
+    assert mixer.block == 512
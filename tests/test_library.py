@@ -0,0 +1,113 @@
+import logging
+import threading
+
+from library import SoundLibrary, NameIndex
+
+
+def make_library(tmp_path, files, slots):
+    for file in files:
+        (tmp_path / file).write_bytes(file.encode())
+    library = SoundLibrary(str(tmp_path), slots)
+    library.scan()
+    return library
+
+
+def test_slots_in_name_order(tmp_path):
+    library = make_library(tmp_path, ['c.wav', 'a.wav', 'b.wav'], 2)
+    assert library.entries() == [(0, 'a.wav', 'a'), (1, 'b.wav', 'b')]
+    assert library.slot('c.wav') is None
+
+
+def test_freed_slot_goes_to_a_waiting_file(tmp_path):
+    library = make_library(tmp_path, ['a.wav', 'b.wav', 'c.wav'], 2)
+    (tmp_path / 'b.wav').unlink()
+    diff = library.update(['b.wav'])
+    assert diff.removed == ['b.wav']
+    assert diff.slots == {'b.wav': 1, 'c.wav': 1}
+    assert library.slot('c.wav') == 1
+
+    # a later file waits, the slots are all taken
+    (tmp_path / 'd.wav').write_bytes(b'd')
+    library.update(['d.wav'])
+    assert library.slot('d.wav') is None
+    assert library.free_slots() == []
+
+
+def test_freed_slot_and_new_file_go_by_name(tmp_path):
+    library = make_library(tmp_path, ['a.wav', 'b.wav', 'd.wav'], 2)
+    (tmp_path / 'b.wav').unlink()
+    (tmp_path / 'c.wav').write_bytes(b'c')
+    library.scan()
+    assert library.slot('c.wav') == 1
+    assert library.slot('d.wav') is None
+
+
+def test_rename_keeps_the_slot(tmp_path):
+    library = make_library(tmp_path, ['a.wav', 'b.wav'], 2)
+    (tmp_path / 'b.wav').rename(tmp_path / 'z.wav')
+    diff = library.scan()
+    assert diff.renamed == [('b.wav', 'z.wav')]
+    assert library.slot('z.wav') == 1
+
+
+def test_no_hotkey_warning_only_when_more_files_wait(tmp_path, caplog):
+    caplog.set_level(logging.WARNING)
+    library = make_library(tmp_path, ['a.wav', 'b.wav', 'c.wav'], 2)
+    assert '1 sfx have no hotkey' in caplog.text
+    caplog.clear()
+
+    (tmp_path / 'a.wav').write_bytes(b'changed')
+    library.update(['a.wav'])
+    assert 'no hotkey' not in caplog.text
+
+    (tmp_path / 'd.wav').write_bytes(b'd')
+    library.update(['d.wav'])
+    assert '2 sfx have no hotkey' in caplog.text
+
+
+def test_listeners_run_without_the_lock(tmp_path):
+    library = make_library(tmp_path, ['a.wav'], 2)
+    seen = []
+
+    def listener(diff):
+        # another thread, e.g. the hotkey thread picking a random sound, must not wait for the listeners
+        result = []
+        reader = threading.Thread(target=lambda: result.append(library.files()))
+        reader.start()
+        reader.join(2)
+        seen.append((diff.added, result))
+
+    library.add_listener(listener)
+    (tmp_path / 'b.wav').write_bytes(b'b')
+    library.update(['b.wav'])
+    assert seen and seen[0][0] == ['b.wav'] and seen[0][1], 'library.files() blocked during the listener'
+
+
+def test_listeners_see_diffs_in_order(tmp_path):
+    library = make_library(tmp_path, [], 100)
+    seen = []
+    library.add_listener(lambda diff: seen.extend(diff.added))
+
+    def add(prefix):
+        for i in range(20):
+            name = f'{prefix}{i:02}.wav'
+            (tmp_path / name).write_bytes(name.encode())
+            library.update([name])
+
+    threads = [threading.Thread(target=add, args=(prefix,)) for prefix in 'xyz']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(seen) == sorted(library.files())
+    for prefix in 'xyz':
+        mine = [name for name in seen if name.startswith(prefix)]
+        assert mine == sorted(mine)
+
+
+def test_name_index_narrows():
+    index = NameIndex(['Airhorn', 'air raid', 'bruh'], key=str)
+    assert index.search('AIR') == ['Airhorn', 'air raid']
+    assert index.search('airh') == ['Airhorn']
+    assert index.search('') == ['Airhorn', 'air raid', 'bruh']
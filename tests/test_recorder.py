@@ -0,0 +1,319 @@
+import os
+import time
+import wave
+import threading
+
+import pytest
+
+pyaudio = pytest.importorskip('pyaudio')
+
+from recorder import PcmRingBuffer, Recorder, RecordingIndex, SegmentWriter  # noqa: E402
+
+RATE = 1000
+CHUNK = 100
+T0 = 1.0  # PortAudio reports an adc time of 0 when the host api has none
+
+
+def frames(start, count, frame_bytes=2):
+    # every frame holds its own number, so a snapshot shows exactly which frames it has
+    return b''.join((i % 256).to_bytes(1, 'little') * frame_bytes for i in range(start, start + count))
+
+
+def joined(views):
+    return b''.join(bytes(view) for view in views)
+
+
+class TestPcmRingBuffer:
+    def test_snapshot_before_full(self):
+        ring = PcmRingBuffer(1, RATE, 2, headroom=0)
+        ring.write(frames(0, 10))
+        assert ring.available() == 20
+        assert joined(ring.snapshot()) == frames(0, 10)
+        assert joined(ring.snapshot(8)) == frames(6, 4)
+
+    def test_wraparound_keeps_the_newest_frames(self):
+        ring = PcmRingBuffer(1, 10, 2, headroom=0)
+        ring.write(frames(0, 7))
+        ring.write(frames(7, 7))
+        assert ring.available() == ring.capacity == 20
+        views = ring.snapshot()
+        assert len(views) == 2
+        assert joined(views) == frames(4, 10)
+
+    def test_write_larger_than_capacity(self):
+        ring = PcmRingBuffer(1, 10, 2, headroom=0)
+        ring.write(frames(0, 3))
+        ring.write(frames(3, 25))
+        assert ring.written == 56
+        assert joined(ring.snapshot()) == frames(18, 10)
+
+    def test_snapshot_is_whole_frames(self):
+        ring = PcmRingBuffer(1, RATE, 4, headroom=0)
+        ring.write(frames(0, 5, 4))
+        assert joined(ring.snapshot(10)) == frames(3, 2, 4)
+        assert ring.snapshot(3) == []
+
+    def test_snapshot_seconds_leaves_out_the_headroom(self):
+        ring = PcmRingBuffer(1, 10, 2, headroom=0.5)
+        ring.write(frames(0, 30))
+        assert ring.available() == 30
+        assert joined(ring.snapshot_seconds()) == frames(20, 10)
+        assert joined(ring.snapshot_seconds(0.3)) == frames(27, 3)
+
+    def test_clear(self):
+        ring = PcmRingBuffer(1, RATE, 2)
+        ring.write(frames(0, 10))
+        ring.clear()
+        assert ring.snapshot() == []
+
+
+class FakeAudio:
+    """ Enough of PyAudio for the recorder to find its device; tests drive _callback themselves. """
+
+    def __init__(self, names=('Stereo Mix (Realtek(R) Audio)',)):
+        self.names = names
+
+    def get_device_count(self):
+        return len(self.names)
+
+    def get_device_info_by_index(self, i):
+        return {'index': i, 'name': self.names[i], 'hostApi': 0}
+
+    def terminate(self):
+        pass
+
+
+def make_recorder(**kwargs):
+    return Recorder(duration=1, rate=RATE, channels=1, chunk=CHUNK, audio=FakeAudio(), **kwargs)
+
+
+def feed(recorder, count, adc_time, status=0):
+    data = frames(recorder.frames_captured, count)
+    return recorder._callback(data, count, {'input_buffer_adc_time': T0 + adc_time}, status)
+
+
+def test_device_lookup():
+    assert make_recorder().usable
+    assert not Recorder(device_name='Missing', audio=FakeAudio()).usable
+
+
+def test_callback_counts_captured_frames():
+    recorder = make_recorder()
+    for i in range(3):
+        assert feed(recorder, CHUNK, i * CHUNK / RATE) == (None, pyaudio.paContinue)
+
+    metrics = recorder.metrics()
+    assert metrics['frames_captured'] == 3 * CHUNK
+    assert metrics['callbacks'] == 3
+    assert metrics['overflows'] == 0
+    assert metrics['dropped_frames'] == 0
+    assert joined(recorder.ring.snapshot()) == frames(0, 3 * CHUNK)
+
+
+def test_overflow_flag_is_counted():
+    recorder = make_recorder()
+    feed(recorder, CHUNK, 0.0)
+    feed(recorder, CHUNK, 0.1, status=pyaudio.paInputOverflow)
+    feed(recorder, CHUNK, 0.2, status=pyaudio.paInputOverflow)
+    assert recorder.overflows == 2
+    assert recorder.dropped_frames == 0
+
+
+def test_adc_gap_is_counted_as_dropped_frames():
+    recorder = make_recorder()
+    feed(recorder, CHUNK, 0.0)
+    # 250 frames went missing between the two buffers
+    feed(recorder, CHUNK, 0.35)
+    assert recorder.dropped_frames == 250
+    # timing follows on from the late buffer
+    feed(recorder, CHUNK, 0.45)
+    assert recorder.dropped_frames == 250
+
+
+def test_adc_jitter_is_not_a_drop():
+    recorder = make_recorder()
+    feed(recorder, CHUNK, 0.0)
+    feed(recorder, CHUNK, 0.1 + (CHUNK // 2) / RATE)
+    feed(recorder, CHUNK, 0.2 + (CHUNK // 2) / RATE - 0.01)
+    assert recorder.dropped_frames == 0
+
+
+def test_missing_adc_time_is_ignored():
+    recorder = make_recorder()
+    feed(recorder, CHUNK, 0.0)
+    recorder._callback(frames(0, CHUNK), CHUNK, {'input_buffer_adc_time': 0.0}, 0)
+    recorder._callback(frames(0, CHUNK), CHUNK, {}, 0)
+    recorder._callback(frames(0, CHUNK), CHUNK, None, 0)
+    feed(recorder, CHUNK, 0.1)
+    assert recorder.callbacks == 5
+    assert recorder.dropped_frames == 0
+
+
+def test_callback_feeds_the_writer():
+    class Writer:
+        def __init__(self):
+            self.chunks = []
+
+        def put(self, data):
+            self.chunks.append(data)
+
+        def metrics(self):
+            return {}
+
+    recorder = make_recorder()
+    recorder.writer = Writer()
+    feed(recorder, CHUNK, 0.0)
+    feed(recorder, CHUNK, 0.1)
+    assert b''.join(recorder.writer.chunks) == frames(0, 2 * CHUNK)
+
+
+def test_save_writes_the_last_seconds(tmp_path):
+    recorder = make_recorder()
+    for i in range(15):
+        feed(recorder, CHUNK, i * CHUNK / RATE)
+
+    path = tmp_path / 'replay.wav'
+    recorder.save(str(path), seconds=0.5)
+    with wave.open(str(path), 'rb') as wf:
+        assert wf.getframerate() == RATE
+        assert wf.getnchannels() == 1
+        assert wf.readframes(wf.getnframes()) == frames(1000, 500)
+
+
+class BlockedIndex:
+    """ Holds the writer thread in its first next_path() until `release` is set. """
+
+    def __init__(self, rec_dir):
+        self.index = RecordingIndex(rec_dir)
+        self.release = threading.Event()
+
+    def next_path(self, prefix):
+        self.release.wait()
+        return self.index.next_path(prefix)
+
+
+class MissingDirIndex:
+    def __init__(self, rec_dir):
+        self.rec_dir = rec_dir
+
+    def next_path(self, prefix):
+        return os.path.join(self.rec_dir, 'gone', f'{prefix}1.wav')
+
+
+def test_writer_failure_is_recorded_and_drained(tmp_path, caplog):
+    writer = SegmentWriter(MissingDirIndex(str(tmp_path)), 'rec', RATE, 1, 2, max_queue=2)
+    writer.put(frames(0, 10))
+    deadline = time.monotonic() + 5
+    while writer.error is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert isinstance(writer.error, FileNotFoundError)
+
+    # more than the queue holds, none of it may block or claim the disk is slow
+    for i in range(10):
+        writer.put(frames(0, 10))
+    start = time.monotonic()
+    writer.close()
+    assert time.monotonic() - start < 5
+    assert not writer._thread.is_alive()
+    assert writer.chunks_dropped == 11
+    assert writer.metrics()['error']
+    assert 'not keeping up' not in caplog.text
+
+
+def test_close_gives_up_on_a_stuck_writer(tmp_path):
+    index = BlockedIndex(str(tmp_path))
+    writer = SegmentWriter(index, 'rec', RATE, 1, 2, max_queue=1)
+    writer.put(frames(0, 10))
+    while writer._queue.qsize():
+        time.sleep(0.01)
+    writer.put(frames(10, 10))
+
+    start = time.monotonic()
+    writer.close(timeout=0.1)
+    assert time.monotonic() - start < 1
+    index.release.set()
+
+
+def read_segments(paths):
+    data = []
+    for path in paths:
+        with wave.open(path, 'rb') as wf:
+            data.append(wf.readframes(wf.getnframes()))
+    return data
+
+
+def test_segments_rotate_by_bytes(tmp_path):
+    writer = SegmentWriter(RecordingIndex(str(tmp_path)), 'rec', RATE, 1, 2, segment_seconds=0, segment_bytes=101)
+    for i in range(5):
+        writer.put(frames(i * 30, 30))
+    writer.close()
+
+    # 101 bytes round down to 50 whole frames
+    assert writer.paths == [str(tmp_path / f'rec{i}.wav') for i in range(1, 4)]
+    segments = read_segments(writer.paths)
+    assert [len(data) for data in segments] == [100, 100, 100]
+    assert b''.join(segments) == frames(0, 150)
+    assert writer.metrics()['bytes_written'] == 300
+
+
+def test_segments_rotate_by_seconds(tmp_path):
+    writer = SegmentWriter(RecordingIndex(str(tmp_path)), 'rec', RATE, 1, 2, segment_seconds=0.04)
+    writer.put(frames(0, 100))
+    writer.close()
+
+    segments = read_segments(writer.paths)
+    assert [len(data) for data in segments] == [80, 80, 40]
+    assert b''.join(segments) == frames(0, 100)
+
+
+def test_smaller_limit_wins(tmp_path):
+    writer = SegmentWriter(RecordingIndex(str(tmp_path)), 'rec', RATE, 1, 2, segment_seconds=1, segment_bytes=40)
+    writer.put(frames(0, 50))
+    writer.close()
+    assert [len(data) for data in read_segments(writer.paths)] == [40, 40, 20]
+
+
+def test_no_limit_is_one_segment(tmp_path):
+    writer = SegmentWriter(RecordingIndex(str(tmp_path)), 'rec', RATE, 1, 2, segment_seconds=0)
+    for i in range(4):
+        writer.put(frames(i * 100, 100))
+    writer.close()
+    assert read_segments(writer.paths) == [frames(0, 400)]
+
+
+def test_full_queue_drops_and_counts(tmp_path, caplog):
+    index = BlockedIndex(str(tmp_path))
+    writer = SegmentWriter(index, 'rec', RATE, 1, 2, max_queue=3)
+    writer.put(frames(0, 10))
+    # the writer has taken the first chunk and is stuck opening its file
+    while writer._queue.qsize():
+        time.sleep(0.01)
+    for i in range(1, 6):
+        writer.put(frames(i * 10, 10))
+
+    assert writer.chunks_dropped == 2
+    assert writer.max_backlog == 3
+    assert caplog.text.count('not keeping up') == 1
+
+    index.release.set()
+    writer.close()
+    assert read_segments(writer.paths) == [frames(0, 40)]
+    assert writer.metrics()['chunks_dropped'] == 2
+
+
+def test_index_continues_after_existing_recordings(tmp_path):
+    for name in ('recording3.wav', 'replay7.wav', 'notes.txt', 'recording.wav'):
+        (tmp_path / name).write_bytes(b'')
+    index = RecordingIndex(str(tmp_path))
+    assert index.next_path('recording') == str(tmp_path / 'recording8.wav')
+    assert index.next_path('replay') == str(tmp_path / 'replay9.wav')
+
+
+def test_index_scans_once_and_skips_new_files(tmp_path):
+    index = RecordingIndex(str(tmp_path / 'recordings'))
+    assert index.next_path('rec') == str(tmp_path / 'recordings' / 'rec1.wav')
+
+    # a file made since the scan is stepped over, a higher number elsewhere isn't looked for again
+    (tmp_path / 'recordings' / 'rec2.wav').write_bytes(b'')
+    (tmp_path / 'recordings' / 'rec50.wav').write_bytes(b'')
+    assert index.next_path('rec') == str(tmp_path / 'recordings' / 'rec3.wav')
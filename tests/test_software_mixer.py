@@ -0,0 +1,165 @@
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from software_mixer import SoftwareMixer, MonitorOutput  # noqa: E402
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+# the streams are fakes, but opening one still takes PyAudio's sample format constant
+needs_pyaudio = pytest.mark.skipif(pyaudio is None, reason='needs pyaudio')
+
+BLOCK = 64
+FULL = 32767
+
+
+class FakeStream:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.callback = kwargs['stream_callback']
+        self.active = False
+        self.closed = False
+
+    def start_stream(self):
+        self.active = True
+
+    def stop_stream(self):
+        self.active = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAudio:
+    DEVICES = [{'index': 0, 'name': 'Speakers', 'maxOutputChannels': 2},
+               {'index': 1, 'name': 'Headphones', 'maxOutputChannels': 2}]
+
+    def __init__(self):
+        self.streams = []
+
+    def get_device_count(self):
+        return len(self.DEVICES)
+
+    def get_device_info_by_index(self, i):
+        return self.DEVICES[i]
+
+    def open(self, **kwargs):
+        self.streams.append(FakeStream(**kwargs))
+        return self.streams[-1]
+
+    def terminate(self):
+        pass
+
+
+def square(frames, amplitude=FULL, channels=2):
+    mono = np.where(np.arange(frames) % 2, amplitude, -amplitude).astype(np.int16)
+    return np.repeat(mono[:, None], channels, axis=1)
+
+
+def block_of(data):
+    return np.frombuffer(data, dtype=np.int16).reshape(-1, 2)
+
+
+def test_single_voice_passes_through():
+    mixer = SoftwareMixer(block=BLOCK)
+    samples = square(BLOCK, 8000)
+    mixer.play(samples)
+    out = block_of(mixer.mix())
+    assert np.abs(out.astype(np.int32) - samples).max() <= 1
+    assert mixer.limited_blocks == 0
+    assert mixer.active == 0
+
+
+def test_limiter_keeps_full_scale_voices_from_clipping():
+    mixer = SoftwareMixer(block=BLOCK, ceiling=0.98)
+    mixer.play(square(4 * BLOCK))
+    mixer.play(square(4 * BLOCK))
+
+    for _ in range(4):
+        out = block_of(mixer.mix())
+        peak = np.abs(out.astype(np.int32)).max()
+        assert peak <= math.ceil(0.98 * FULL)
+        assert peak >= 0.97 * FULL
+    assert mixer.limited_blocks == 4
+
+
+def test_limiter_gain_recovers_over_the_release():
+    mixer = SoftwareMixer(block=BLOCK, ceiling=0.98, release=0.05)
+    mixer.play(square(BLOCK))
+    mixer.play(square(BLOCK))
+    mixer.mix()
+    limit = mixer._limit
+    assert limit == pytest.approx(0.49, abs=0.01)
+
+    quiet = square(100 * BLOCK, 8000)
+    mixer.play(quiet)
+    recovery = math.ceil((1 - limit) / 0.05)
+    peaks = [np.abs(block_of(mixer.mix()).astype(np.int32)).max() for _ in range(recovery + 2)]
+
+    # a step of `release` per block, never a jump back up
+    assert peaks[0] == pytest.approx(8000 * (limit + 0.05), rel=0.01)
+    assert all(a <= b for a, b in zip(peaks, peaks[1:]))
+    assert peaks[recovery - 2] < 8000 * 0.99
+    assert peaks[recovery - 1] == pytest.approx(8000, abs=1)
+    assert mixer._limit == 1.0
+
+
+def test_volume_and_gain_are_applied_before_limiting():
+    mixer = SoftwareMixer(block=BLOCK)
+    mixer.volume = 0.5
+    mixer.play(square(BLOCK, 8000), gain=0.5)
+    assert np.abs(block_of(mixer.mix()).astype(np.int32)).max() == pytest.approx(2000, abs=1)
+
+
+@needs_pyaudio
+def test_resize_reopens_the_streams():
+    audio = FakeAudio()
+    mixer = SoftwareMixer(block=BLOCK, audio=audio)
+    mixer.start('Speakers')
+    mixer.add_monitor('Headphones')
+    main, monitor = audio.streams
+
+    mixer.resize(4 * BLOCK)
+    assert main.closed and monitor.closed
+    new_main, new_monitor = audio.streams[2:]
+    assert new_main.kwargs['frames_per_buffer'] == 4 * BLOCK
+    assert new_main.kwargs['output_device_index'] == 0
+    assert new_monitor.kwargs['frames_per_buffer'] == 4 * BLOCK
+    assert new_monitor.kwargs['output_device_index'] == 1
+    assert mixer.monitor_device == 'Headphones'
+
+    # voices keep playing across the resize and blocks have the new size
+    mixer.play(square(10 * BLOCK, 1000))
+    data, _ = new_main.callback(None, 4 * BLOCK, {}, 0)
+    assert len(block_of(data)) == 4 * BLOCK
+
+
+@needs_pyaudio
+def test_monitor_gets_the_same_mix():
+    audio = FakeAudio()
+    mixer = SoftwareMixer(block=BLOCK, audio=audio)
+    mixer.add_monitor('Headphones')
+    mixer.play(square(2 * BLOCK, 4000))
+    first, second = mixer.mix(), mixer.mix()
+
+    callback = mixer.monitor.stream.callback
+    assert callback(None, BLOCK, {}, 0)[0] == first
+    assert callback(None, BLOCK, {}, 0)[0] == second
+    # dry, it plays silence
+    assert callback(None, BLOCK, {}, 0)[0] == bytes(BLOCK * 4)
+    assert mixer.stats()['monitor_silent_bytes'] == BLOCK * 4
+
+
+@needs_pyaudio
+def test_monitor_drops_the_oldest_blocks():
+    monitor = MonitorOutput(FakeAudio(), 1, 'Headphones', 44100, 2, BLOCK, max_blocks=2)
+    blocks = [bytes([i]) * BLOCK * 4 for i in range(3)]
+    for block in blocks:
+        monitor.push(block)
+    assert monitor.dropped_bytes == BLOCK * 4
+    assert monitor._callback(None, 2 * BLOCK, {}, 0)[0] == blocks[1] + blocks[2]
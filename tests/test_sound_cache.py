@@ -0,0 +1,134 @@
+import os
+import wave
+
+import pytest
+
+pytest.importorskip('pygame')
+
+from sound_cache import SoundCache, PcmDiskCache, sound_nbytes  # noqa: E402
+
+FRAMES = 4410  # 0.1 s in the mixer's format
+NBYTES = FRAMES * 2 * 2
+
+
+def write_wav(path, frames=FRAMES, value=1000):
+    with wave.open(str(path), 'wb') as wf:
+        wf.setnchannels(2)
+        wf.setsampwidth(2)
+        wf.setframerate(44100)
+        wf.writeframes(value.to_bytes(2, 'little', signed=True) * 2 * frames)
+    return str(path)
+
+
+@pytest.fixture
+def sfx(tmp_path, mixer):
+    return [write_wav(tmp_path / f'{name}.wav') for name in 'abcd']
+
+
+def test_sound_size_comes_from_the_mixer_format(sfx, mixer):
+    assert sound_nbytes(mixer.Sound(sfx[0])) == NBYTES
+
+
+def test_hits_and_misses(sfx):
+    cache = SoundCache(10 * NBYTES)
+    first = cache.get(sfx[0])
+    assert cache.get(sfx[0]) is first
+    cache.get(sfx[1])
+    assert cache.stats() == {
+        'hits': 1, 'misses': 2, 'evictions': 0, 'entries': 2, 'resident_bytes': 2 * NBYTES, 'budget': 10 * NBYTES,
+    }
+
+
+def test_least_recently_used_is_evicted_past_the_budget(sfx):
+    cache = SoundCache(2 * NBYTES)
+    cache.get(sfx[0])
+    cache.get(sfx[1])
+    cache.get(sfx[0])  # b is now the least recently used
+    cache.get(sfx[2])
+
+    assert sfx[1] not in cache
+    assert sfx[0] in cache and sfx[2] in cache
+    assert cache.resident_bytes == 2 * NBYTES
+    assert cache.evictions == 1
+
+
+def test_sound_larger_than_the_budget_is_not_cached(tmp_path, sfx):
+    big = write_wav(tmp_path / 'big.wav', frames=3 * FRAMES)
+    cache = SoundCache(2 * NBYTES)
+    cache.get(sfx[0])
+    assert cache.get(big) is not None
+    assert big not in cache
+    assert sfx[0] in cache
+
+
+def test_changed_file_is_decoded_again(tmp_path, sfx):
+    cache = SoundCache(10 * NBYTES)
+    first = cache.get(sfx[0])
+    write_wav(sfx[0], frames=2 * FRAMES)
+    os.utime(sfx[0], ns=(1, 1))
+
+    second = cache.get(sfx[0])
+    assert second is not first
+    assert cache.resident_bytes == 2 * NBYTES
+    assert len(cache) == 1
+
+
+def test_discard_and_clear(sfx):
+    cache = SoundCache(10 * NBYTES)
+    for path in sfx:
+        cache.get(path)
+    cache.discard(sfx[0])
+    cache.discard('not cached')
+    assert sfx[0] not in cache
+    assert cache.resident_bytes == 3 * NBYTES
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.resident_bytes == 0
+
+
+def test_export_and_restore_keep_order_and_samples(sfx, mixer):
+    cache = SoundCache(10 * NBYTES)
+    for path in sfx[:3]:
+        cache.get(path)
+    cache.get(sfx[0])
+
+    exported = cache.export(lambda sound: sound.get_raw())
+    assert [path for path, stamp, data in exported] == [sfx[1], sfx[2], sfx[0]]
+
+    restored = SoundCache(2 * NBYTES)
+    restored.restore(exported, lambda data: mixer.Sound(buffer=data))
+    # the budget still applies, the least recently used goes first
+    assert sfx[1] not in restored
+    assert restored.get(sfx[0]).get_raw() == exported[2][2]
+    assert restored.stats()['hits'] == 1
+
+
+def test_warm_stops_at_the_budget(sfx):
+    cache = SoundCache(2 * NBYTES)
+    cache.warm(sfx + ['missing.wav']).join(5)
+    assert len(cache) == 2
+    assert cache.evictions == 0
+
+
+def test_pcm_cache_maps_what_it_built(tmp_path, sfx):
+    cache = PcmDiskCache(str(tmp_path / 'pcm'), 10 * NBYTES)
+    built = cache.load(sfx[0])
+    mapped = cache.load(sfx[0])
+    assert (cache.built, cache.mapped) == (1, 1)
+    assert mapped.get_raw() == built.get_raw()
+
+
+@pytest.mark.parametrize('keep', [0, 10, PcmDiskCache.HEADER.size + 3])
+def test_pcm_cache_rebuilds_broken_entries(tmp_path, sfx, keep):
+    cache = PcmDiskCache(str(tmp_path / 'pcm'), 10 * NBYTES)
+    expected = cache.load(sfx[0]).get_raw()
+
+    # empty, cut off in the header, cut off mid-frame
+    entry = cache._entry_path(sfx[0])
+    with open(entry, 'r+b') as f:
+        f.truncate(keep)
+
+    assert cache.load(sfx[0]).get_raw() == expected
+    assert cache.built == 2
+    assert os.path.getsize(entry) == PcmDiskCache.HEADER.size + NBYTES
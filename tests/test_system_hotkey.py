@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import threading
+import types
+
+import pytest
+
+# the X or Windows bindings have to be installed for the module to import
+system_hotkey = pytest.importorskip('system_hotkey')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fake_hotkey import FakeHotkey  # noqa: E402
+
+KeymapIndex = system_hotkey.KeymapIndex
+
+
+def kbmap(rows, per=2):
+    return types.SimpleNamespace(keysyms_per_keycode=per, keysyms=[ks for row in rows for ks in row])
+
+
+class TestKeymapIndex:
+    # keycodes 8, 9, 10 with a lower and upper case keysym each
+    rows = [(ord('y'), ord('Y')), (ord('z'), ord('Z')), (ord('q'), ord('Q'))]
+
+    def test_lookups(self):
+        index = KeymapIndex(kbmap(self.rows), 8, 10)
+        assert index.keycode(ord('z')) == 9
+        assert index.keycode(ord('Q')) == 10
+        assert index.keycode(ord('x')) is None
+        assert index.keysym(9) == ord('z')
+        assert index.keysym(9, 1) == ord('Z')
+
+    def test_swapped_keys_are_reported_as_moves(self):
+        index = KeymapIndex(kbmap(self.rows), 8, 10)
+        moves = index.update(kbmap([self.rows[1], self.rows[0], self.rows[2]]))
+        assert moves == {8: 9, 9: 8}
+        assert index.keycode(ord('y')) == 9
+        assert index.keycode(ord('Z')) == 8
+        assert index.keycode(ord('q')) == 10
+
+    def test_unchanged_mapping_moves_nothing(self):
+        index = KeymapIndex(kbmap(self.rows), 8, 10)
+        assert index.update(kbmap(self.rows)) == {}
+
+    def test_removed_keysym_is_forgotten(self):
+        index = KeymapIndex(kbmap(self.rows), 8, 10)
+        index.update(kbmap([self.rows[0], (0, 0), self.rows[2]]))
+        assert index.keycode(ord('z')) is None
+
+    def test_lowest_keycode_wins(self):
+        index = KeymapIndex(kbmap([self.rows[2], self.rows[2], self.rows[0]]), 8, 10)
+        assert index.keycode(ord('q')) == 8
+        index.update(kbmap([(0, 0), self.rows[2], self.rows[0]]))
+        assert index.keycode(ord('q')) == 9
+
+    def test_keysyms_per_keycode_change_rebuilds(self):
+        index = KeymapIndex(kbmap(self.rows), 8, 10)
+        rows = [(ord('z'), ord('Z'), 0), (ord('y'), ord('Y'), 0), (ord('q'), ord('Q'), 0)]
+        assert index.update(kbmap(rows, per=3)) == {9: 8, 8: 9}
+        assert index.keycode(ord('y')) == 9
+
+
+class RecordingHotkey(FakeHotkey):
+    def __init__(self):
+        super().__init__(callback_loop=False)
+        self.calls = []
+
+    def _grab_many(self, pending):
+        self.calls += [('grab', keycode, masks) for _, keycode, masks in pending]
+        return super()._grab_many(pending)
+
+    def _ungrab_many(self, pending):
+        self.calls += [('ungrab', keycode, masks) for _, keycode, masks in pending]
+
+
+def test_regrab_follows_moved_keys():
+    hk = RecordingHotkey()
+    pressed = []
+    hk.register_many([(['alt', key], lambda e, key=key: pressed.append(key)) for key in 'yzq'])
+    alt = hk.modders['alt']
+    y, z, q = (hk._get_keycode(key) for key in 'yzq')
+    hk.calls.clear()
+
+    # the layout swaps y and z, like switching between QWERTY and QWERTZ
+    hk._keycodes['y'], hk._keycodes['z'] = z, y
+    with hk._bind_lock:
+        hk._regrab({y: z, z: y})
+        hk._publish()
+
+    ungrabs = [call for call in hk.calls if call[0] == 'ungrab']
+    grabs = [call for call in hk.calls if call[0] == 'grab']
+    assert sorted(ungrabs) == sorted([('ungrab', y, alt), ('ungrab', z, alt)])
+    assert sorted(grabs) == sorted([('grab', z, alt), ('grab', y, alt)])
+    # every old grab is released before any new one is made
+    assert hk.calls.index(grabs[0]) > max(hk.calls.index(call) for call in ungrabs)
+
+    for key in 'yzq':
+        hk._dispatch[hk._event_key(hk.event(['alt', key]))](None)
+    assert pressed == ['y', 'z', 'q']
+
+
+def test_no_moves_no_grabs():
+    hk = RecordingHotkey()
+    hk.register_many([(['alt', 'q'], lambda e: None)])
+    hk.calls.clear()
+    hk._regrab({})
+    assert hk.calls == []
+
+
+def test_dispatch_skips_keys_that_left_the_keyboard():
+    hk = RecordingHotkey()
+    hk.register_many([(['alt', 'q'], lambda e: None), (['alt', 'w'], lambda e: None)])
+    hk._get_keycode = lambda key, keycodes=dict(hk._keycodes): None if key == 'w' else keycodes[key]
+    with hk._bind_lock:
+        hk._publish()
+    assert len(hk._dispatch) == 1
+
+
+def test_callback_loop_dispatches_injected_presses():
+    hk = FakeHotkey()
+    pressed = []
+    hk.register_many([(['alt', 'q'], lambda e: pressed.append(e.seq))])
+    for seq in range(3):
+        hk.press(['alt', 'q'], seq)
+    deadline = time.monotonic() + 5
+    while len(pressed) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pressed == [0, 1, 2]
+
+
+def test_single_key_register_waits_for_the_bind_lock():
+    hk = FakeHotkey(callback_loop=False)
+    done = []
+
+    def register_then_unregister():
+        hk.register(['alt', 'q'], callback=lambda e: None)
+        done.append('register')
+        hk.unregister(['alt', 'q'])
+        done.append('unregister')
+
+    with hk._bind_lock:
+        thread = threading.Thread(target=register_then_unregister)
+        thread.start()
+        thread.join(0.1)
+        assert done == []
+        assert not hk.keybinds
+    thread.join(5)
+    assert done == ['register', 'unregister']
+    assert not hk.keybinds and not hk._dispatch
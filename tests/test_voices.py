@@ -0,0 +1,192 @@
+import pytest
+
+pytest.importorskip('pygame')
+
+from voices import VoiceManager  # noqa: E402
+
+
+class FakeBackend:
+    """ Hands out numbered handles, `capacity` plays the part of the mixer's channel count. """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.live = {}  # handle -> sound
+        self.gains = {}
+        self.paused = set()
+        self.stopped = []
+        self._next = 0
+
+    def start(self, sound, gain, loops):
+        if self.capacity is not None and len(self.live) >= self.capacity:
+            return None
+        self._next += 1
+        self.live[self._next] = sound
+        self.gains[self._next] = gain
+        return self._next
+
+    def alive(self, handle, sound):
+        return self.live.get(handle) is sound
+
+    def stop(self, handle):
+        del self.live[handle]
+        self.stopped.append(handle)
+
+    def finish(self, handle):
+        del self.live[handle]
+
+    def pause(self, handle):
+        self.paused.add(handle)
+
+    def unpause(self, handle):
+        self.paused.discard(handle)
+
+    def set_gain(self, handle, sound, gain):
+        self.gains[handle] = gain
+
+
+def make_manager(backend=None, **kwargs):
+    backend = backend or FakeBackend()
+    return VoiceManager(backend, **kwargs), backend
+
+
+def test_unknown_policies_are_rejected():
+    with pytest.raises(ValueError):
+        VoiceManager(FakeBackend(), retrigger='loop')
+    with pytest.raises(ValueError):
+        VoiceManager(FakeBackend(), steal='newest')
+
+
+def test_overlap_caps_voices_per_sound():
+    manager, backend = make_manager(per_sound=2)
+    first = manager.play('a', 'A')
+    manager.play('a', 'A')
+    manager.play('a', 'A')
+    assert manager.playing('a') == 2
+    assert backend.stopped == [first]
+    assert manager.stolen == 1
+
+
+def test_restart_stops_the_old_voices():
+    manager, backend = make_manager(retrigger='restart')
+    first = manager.play('a', 'A')
+    second = manager.play('a', 'A')
+    assert backend.stopped == [first]
+    assert second in backend.live
+    assert manager.playing('a') == 1
+
+
+def test_ignore_keeps_the_playing_voice():
+    manager, backend = make_manager(retrigger='ignore')
+    manager.play('a', 'A')
+    assert manager.play('a', 'A') is None
+    assert manager.playing('a') == 1
+    assert manager.ignored == 1
+
+
+def test_toggle_stops_then_plays_again():
+    manager, backend = make_manager(retrigger='toggle')
+    first = manager.play('a', 'A')
+    assert manager.play('a', 'A') is None
+    assert backend.stopped == [first]
+    assert manager.playing('a') == 0
+    assert manager.play('a', 'A') is not None
+
+
+def test_retrigger_can_be_overridden_per_play():
+    manager, backend = make_manager(retrigger='overlap')
+    manager.play('a', 'A')
+    assert manager.play('a', 'A', retrigger='ignore') is None
+    assert manager.playing('a') == 1
+
+
+def test_steal_oldest():
+    manager, backend = make_manager(max_voices=2, steal='oldest')
+    first = manager.play('a', 'A')
+    manager.play('b', 'B')
+    manager.play('c', 'C')
+    assert backend.stopped == [first]
+    assert len(manager) == 2
+    assert manager.playing('a') == 0
+
+
+def test_steal_quietest():
+    manager, backend = make_manager(max_voices=2, steal='quietest')
+    manager.play('a', 'A', gain=0.8)
+    quiet = manager.play('b', 'B', gain=0.2)
+    manager.play('c', 'C', gain=0.5)
+    assert backend.stopped == [quiet]
+    assert manager.playing('b') == 0
+
+
+def test_steal_quietest_counts_each_sounds_level():
+    # the volume slider is the same for every voice, the sounds' own gains decide who is quieter
+    manager, backend = make_manager(FakeBackend(capacity=2), max_voices=8, steal='quietest')
+    manager.play('loud', 'L', gain=0.5, level=2.0)
+    quiet = manager.play('quiet', 'Q', gain=0.5, level=0.25)
+    manager.play('new', 'N', gain=0.5, level=1.0)
+    assert backend.stopped == [quiet]
+    assert manager.playing('loud') == 1
+
+
+def test_levels_survive_a_volume_change():
+    manager, backend = make_manager(max_voices=2, steal='quietest')
+    manager.play('loud', 'L', gain=0.5, level=2.0)
+    quiet = manager.play('quiet', 'Q', gain=0.5, level=0.5)
+    manager.set_gain(0.8)
+    manager.play('new', 'N', gain=0.8)
+    assert backend.stopped == [quiet]
+
+
+def test_steal_none_refuses():
+    manager, backend = make_manager(max_voices=2, steal='none')
+    manager.play('a', 'A')
+    manager.play('b', 'B')
+    assert manager.play('c', 'C') is None
+    assert backend.stopped == []
+    assert manager.refused == 1
+
+
+def test_backend_running_out_steals_too():
+    manager, backend = make_manager(FakeBackend(capacity=1), max_voices=8)
+    first = manager.play('a', 'A')
+    assert manager.play('b', 'B') is not None
+    assert backend.stopped == [first]
+    assert manager.stolen == 1
+
+
+def test_finished_voices_are_reaped():
+    manager, backend = make_manager(max_voices=2, steal='none')
+    first = manager.play('a', 'A')
+    manager.play('b', 'B')
+    backend.finish(first)
+    assert manager.play('c', 'C') is not None
+    assert manager.stats()['active'] == 2
+
+
+def test_global_operations_touch_live_voices_only():
+    manager, backend = make_manager()
+    first = manager.play('a', 'A')
+    second = manager.play('b', 'B')
+    backend.finish(first)
+
+    manager.pause()
+    assert backend.paused == {second}
+    manager.unpause()
+    assert backend.paused == set()
+
+    manager.set_gain(0.5)
+    assert backend.gains[second] == 0.5
+    assert backend.gains[first] == 1.0
+
+    manager.stop()
+    assert backend.stopped == [second]
+    assert len(manager) == 0
+
+
+def test_stop_one_key():
+    manager, backend = make_manager()
+    a = manager.play('a', 'A')
+    manager.play('b', 'B')
+    manager.stop('a')
+    assert backend.stopped == [a]
+    assert manager.playing('b') == 1
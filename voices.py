@@ -0,0 +1,221 @@
+import time
+import logging
+from collections import OrderedDict
+
+import pygame
+
+
+class ChannelBackend:
+    """ Plays voices on pygame mixer channels. """
+
+    def start(self, sound, gain, loops):
+        channel = pygame.mixer.find_channel()
+        if channel is None:
+            return None
+        channel.set_volume(gain)
+        channel.play(sound, loops=loops)
+        return channel
+
+    def alive(self, handle, sound):
+        # the channel may have finished and been handed to another sound since
+        return handle.get_busy() and handle.get_sound() is sound
+
+    def stop(self, handle):
+        handle.stop()
+
+    def pause(self, handle):
+        handle.pause()
+
+    def unpause(self, handle):
+        handle.unpause()
+
+    def set_gain(self, handle, sound, gain):
+        handle.set_volume(gain)
+
+
+class SoftwareBackend:
+    """ Plays voices on a SoftwareMixer, `to_samples` turns a sound into the sample array it mixes.
+
+    `gain_of` gives a sound's own gain, which pygame channels would apply by themselves (Sound.set_volume).
+    """
+
+    def __init__(self, mixer, to_samples, gain_of=None):
+        self.mixer = mixer
+        self.to_samples = to_samples
+        self.gain_of = gain_of or (lambda sound: 1.0)
+
+    def start(self, sound, gain, loops):
+        return self.mixer.play(self.to_samples(sound), gain * self.gain_of(sound), loops)
+
+    def alive(self, handle, sound):
+        return self.mixer.is_playing(handle)
+
+    def stop(self, handle):
+        self.mixer.stop(handle)
+
+    def pause(self, handle):
+        self.mixer.pause(handle)
+
+    def unpause(self, handle):
+        self.mixer.unpause(handle)
+
+    def set_gain(self, handle, sound, gain):
+        self.mixer.set_gain(gain * self.gain_of(sound), handle)
+
+
+class Voice:
+    __slots__ = ('key', 'sound', 'handle', 'gain', 'level', 'started')
+
+    def __init__(self, key, sound, handle, gain, level=1.0):
+        self.key = key
+        self.sound = sound
+        self.handle = handle
+        self.gain = gain
+        self.level = level
+        self.started = time.perf_counter()
+
+
+class VoiceManager:
+    """ Keeps track of what is playing so polyphony can be capped and global operations only touch live voices.
+
+    `key` identifies a sound (e.g. its file name). What a key that is already playing does is decided by the
+    retrigger mode: 'overlap' plays it again, 'restart' stops the old voices first, 'ignore' does nothing and
+    'toggle' stops it instead. Past `per_sound` voices of one key its oldest voice is stopped, past `max_voices`
+    in total the `steal` policy picks a voice to stop: 'oldest', 'quietest' or 'none' to refuse the new one.
+    A cap of 0 means no limit. How loud a voice is, for 'quietest', is its gain times the `level` it was played
+    with, the sound's own gain (e.g. its normalization) that the backend doesn't see.
+
+    It isn't thread safe, the soundboard only uses it from the audio dispatcher thread.
+    """
+
+    RETRIGGER = ('overlap', 'restart', 'ignore', 'toggle')
+    STEAL = ('oldest', 'quietest', 'none')
+
+    def __init__(self, backend, max_voices=64, per_sound=4, retrigger='overlap', steal='oldest'):
+        if retrigger not in self.RETRIGGER:
+            raise ValueError(f'Unknown retrigger mode: {retrigger!r}, expected one of {self.RETRIGGER}')
+        if steal not in self.STEAL:
+            raise ValueError(f'Unknown voice stealing policy: {steal!r}, expected one of {self.STEAL}')
+
+        self.backend = backend
+        self.max_voices = max_voices
+        self.per_sound = per_sound
+        self.retrigger = retrigger
+        self.steal = steal
+
+        self._voices = OrderedDict()  # id -> Voice, oldest first
+        self._by_key = {}  # key -> {id: Voice}
+        self._next_id = 0
+
+        self.started = 0
+        self.ignored = 0
+        self.stolen = 0
+        self.refused = 0
+
+    def __len__(self):
+        return len(self._voices)
+
+    def playing(self, key):
+        self._reap()
+        return len(self._by_key.get(key, ()))
+
+    def _reap(self):
+        for voice_id, voice in list(self._voices.items()):
+            if not self.backend.alive(voice.handle, voice.sound):
+                self._forget(voice_id)
+
+    def _forget(self, voice_id):
+        voice = self._voices.pop(voice_id)
+        same_key = self._by_key[voice.key]
+        del same_key[voice_id]
+        if not same_key:
+            del self._by_key[voice.key]
+        return voice
+
+    def _stop_voice(self, voice_id):
+        self.backend.stop(self._forget(voice_id).handle)
+
+    def _victim(self):
+        if self.steal == 'oldest':
+            return next(iter(self._voices))
+        if self.steal == 'quietest':
+            return min(self._voices, key=lambda voice_id: self._voices[voice_id].gain * self._voices[voice_id].level)
+        return None
+
+    def play(self, key, sound, gain=1.0, loops=0, retrigger=None, level=1.0):
+        """ Starts a voice of `sound`, returns the backend's handle or None if nothing was started. """
+        self._reap()
+        mode = retrigger or self.retrigger
+
+        same_key = self._by_key.get(key)
+        if same_key:
+            if mode == 'ignore':
+                self.ignored += 1
+                return None
+            if mode in ('restart', 'toggle'):
+                for voice_id in list(same_key):
+                    self._stop_voice(voice_id)
+                if mode == 'toggle':
+                    return None
+            elif self.per_sound and len(same_key) >= self.per_sound:
+                self._stop_voice(next(iter(same_key)))
+                self.stolen += 1
+
+        if self.max_voices and len(self._voices) >= self.max_voices and not self._steal():
+            self.refused += 1
+            return None
+
+        handle = self.backend.start(sound, gain, loops)
+        # the backend can run out before our cap does, e.g. fewer pygame channels than max_voices
+        if handle is None and self._voices and self._steal():
+            handle = self.backend.start(sound, gain, loops)
+        if handle is None:
+            self.refused += 1
+            logging.warning(f'No free voice to play {key}.')
+            return None
+
+        self._next_id += 1
+        voice = Voice(key, sound, handle, gain, level)
+        self._voices[self._next_id] = voice
+        self._by_key.setdefault(key, {})[self._next_id] = voice
+        self.started += 1
+        return handle
+
+    def _steal(self):
+        victim = self._victim()
+        if victim is None:
+            logging.warning('All voices are in use and voice stealing is off, not playing the sound.')
+            return False
+        self._stop_voice(victim)
+        self.stolen += 1
+        return True
+
+    def stop(self, key=None):
+        """ Stops every voice of `key`, or every voice. """
+        for voice_id in list(self._by_key.get(key, ()) if key is not None else self._voices):
+            self._stop_voice(voice_id)
+
+    def pause(self):
+        self._reap()
+        for voice in self._voices.values():
+            self.backend.pause(voice.handle)
+
+    def unpause(self):
+        for voice in self._voices.values():
+            self.backend.unpause(voice.handle)
+
+    def set_gain(self, gain):
+        self._reap()
+        for voice in self._voices.values():
+            voice.gain = gain
+            self.backend.set_gain(voice.handle, voice.sound, gain)
+
+    def stats(self):
+        return {
+            'active': len(self._voices),
+            'sounds': len(self._by_key),
+            'started': self.started,
+            'ignored': self.ignored,
+            'stolen': self.stolen,
+            'refused': self.refused,
+        }